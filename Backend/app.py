@@ -1,45 +1,114 @@
 import os
+import sys
 import json
-import tempfile
-import markdown
-from flask import Flask, request, redirect, url_for, jsonify
+import time
+import asyncio
+import sqlite3
+import importlib
+import threading
+from flask import Flask, Response, g, request, redirect, url_for, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
+from async_runtime import run_async, iterate_async, in_flight
+from upload_buffer import UploadedFile, UploadRejected, MAX_UPLOAD_BYTES, format_megabytes, expand_zip
+from job_queue import JobQueue, QueueFull, timed_stage
+from sse_stream import sse_event
+from gemini_governor import default_governor
+from single_flight import default_single_flight
+from structured_output import AgentError, ModelOutputError, to_jsonable
+from lab_history import ISO_DATE, LabHistoryStore, PatientKey, report_date
+import telemetry
 
 load_dotenv()
 
-# Import your custom agents
-try:
-    from multimodel_medical_agent import MultimodalMedicalAgent
-    from patient_advisor import PatientConsultantAgent
-    from patient_advisor import ConsultationSummaryJSON 
-    from prescription_reader import PrescriptionReaderAgent
-    # Corrected Agent Import (using the correct file name)
-    from doctor_agent import DoctorAssistant
-    
-except ImportError as e:
-    print(f"Error importing agents: {e}")
-    print("Please make sure all necessary files are in the current directory.")
-    exit(1)
+
+class AgentJSONProvider(DefaultJSONProvider):
+    """jsonify() for payloads holding the pydantic objects agents return: each is serialized once, here."""
+
+    @staticmethod
+    def default(o):
+        try:
+            return to_jsonable(o)
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__)
+app.json = AgentJSONProvider(app)
 CORS(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "A_SECURE_FALLBACK_KEY_") 
+# Reject oversized requests from Content-Length before the body is parsed
+# (headroom for the multipart envelope and patient profile fields).
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 1024 * 1024
 
 # --- CONFIGURATION ---
 if not os.getenv("GOOGLE_API_KEY"):
     print("⚠️  WARNING: GOOGLE_API_KEY not found in environment variables.")
 
-# Initialize Agents
-try:
-    extractor_agent = MultimodalMedicalAgent()
-    consultant_agent = PatientConsultantAgent()
-    prescription_agent = PrescriptionReaderAgent()
-    # Corrected Agent Initialization (using a descriptive name)
-    symptom_agent = DoctorAssistant()
+# --- AGENTS (built on first use) ---
+# Importing google-genai and the loaders and creating four genai clients
+# dominates worker boot, so each agent module is imported and its agent
+# built only when a route first needs it. With PRELOAD_AGENTS=1 (set
+# automatically by gunicorn.conf.py when GUNICORN_PRELOAD=1) they are built
+# once at import instead, in the gunicorn master before it forks workers.
+AGENT_CLASSES = {
+    "extractor": ("multimodel_medical_agent", "MultimodalMedicalAgent"),
+    "consultant": ("patient_advisor", "PatientConsultantAgent"),
+    "prescription": ("prescription_reader", "PrescriptionReaderAgent"),
+    "symptom": ("doctor_agent", "DoctorAssistant"),
+}
+_agents = {}
+_agents_lock = threading.Lock()
+
+
+def get_agent(name):
+    """Returns the named agent, importing its module and building it on first use."""
+    agent = _agents.get(name)
+    if agent is None:
+        with _agents_lock:
+            agent = _agents.get(name)
+            if agent is None:
+                module_name, class_name = AGENT_CLASSES[name]
+                agent = getattr(importlib.import_module(module_name), class_name)()
+                _agents[name] = agent
+    return agent
+
+
+def agents_ready(*names):
+    """Builds the named agents if needed; False (and a log line) when one cannot be created."""
+    try:
+        for name in names:
+            get_agent(name)
+        return True
+    except Exception as e:
+        print(f"Failed to initialize agents: {e}")
+        return False
+
 
-except Exception as e:
-    print(f"Failed to initialize agents: {e}")
+def preload_agents():
+    if not agents_ready(*AGENT_CLASSES):
+        print("Please make sure all necessary files are in the current directory.")
+
+
+if os.getenv("PRELOAD_AGENTS", "0") == "1":
+    preload_agents()
+
+# Background jobs for long-running analyses (JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL)
+job_queue = JobQueue.from_env()
+
+# Lab results of reports sent with a patient_id, for /patients/<id>/trends and
+# incremental consultations, kept per calling user (disabled unless
+# LAB_HISTORY_PATH is set; only behind authentication that sets X-User-Id)
+lab_history = LabHistoryStore.from_env()
+
+# Batch uploads: files per batch, total request size, reports analyzed at once
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 50))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 200 * 1024 * 1024))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+# Adds a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
 
 # Helper function to generate standardized error response
 def generate_error_response(message, status_code=400):
@@ -48,30 +117,242 @@ def generate_error_response(message, status_code=400):
         "message": message
     }), status_code
 
+# --- Telemetry: per-request metrics and stage timings (exported at /metrics) ---
+
+def route_label():
+    # The URL rule, not the path, so /jobs/<job_id> stays one series
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_telemetry():
+    g.request_started = time.perf_counter()
+    g.request_timings = telemetry.start_request(route_label())
+
+
+@app.after_request
+def finish_request_telemetry(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    telemetry.finish_request(route_label(), request.method, response.status_code, elapsed)
+    if SERVER_TIMING:
+        stages = g.request_timings.header()
+        response.headers["Server-Timing"] = f"{stages + ', ' if stages else ''}total;dur={elapsed * 1000:.1f}"
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(telemetry.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = BATCH_MAX_BYTES if request.endpoint == 'analyze_reports_batch' else MAX_UPLOAD_BYTES
+    return generate_error_response(f"Upload too large: the limit is {format_megabytes(limit)}.", 413)
+
 # Helper function for new symptom analysis output
 def format_symptom_analysis_to_markdown(data):
-    """Converts the SymptomAnalysisResult JSON structure into a readable Markdown string."""
-    md = f"**{data.get('disclaimer_and_urgency', 'Disclaimer: No professional medical advice provided.')}**\n\n"
+    """Converts a SymptomAnalysisResult into a readable Markdown string."""
+    md = f"**{data.disclaimer_and_urgency or 'Disclaimer: No professional medical advice provided.'}**\n\n"
     md += "## 1. What You Might Be Experiencing\n"
-    md += f"{data.get('current_condition_analysis', 'N/A')}\n\n"
+    md += f"{data.current_condition_analysis or 'N/A'}\n\n"
     
     md += "## 2. Possible Medical Problems\n"
-    problems = data.get('possible_medical_problems', [])
+    problems = data.possible_medical_problems
     md += "\n".join([f"- {p}" for p in problems]) if problems else "- N/A\n"
     md += "\n\n"
     
     md += "## 3. Immediate Actions to Take\n"
-    actions = data.get('immediate_actions', [])
+    actions = data.immediate_actions
     md += "\n".join([f"- {a}" for a in actions]) if actions else "- N/A\n"
     md += "\n\n"
     
     md += "## 4. Recommended Specialist\n"
-    md += f"**Specialist:** {data.get('recommended_specialist', 'General Practitioner (GP)')}\n\n"
+    md += f"**Specialist:** {data.recommended_specialist or 'General Practitioner (GP)'}\n\n"
     
-    md += f"***\n{data.get('final_statement', 'N/A')}"
+    md += f"***\n{data.final_statement or 'N/A'}"
     return md
 
 
+# --- Report Pipeline (shared by the synchronous route and background jobs) ---
+
+class PipelineError(AgentError):
+    """A pipeline failure carrying the message and HTTP status for the error response."""
+
+
+def get_patient_profile(form):
+    return {
+        "name": form.get('name', 'Unknown'),
+        "age": form.get('age', ''), 
+        "gender": form.get('gender', 'Unknown'),
+        "history": form.get('history', 'None'),
+        "complaints": form.get('complaints', 'None')
+    }
+
+
+def get_user_scope(form):
+    """The caller's user id (X-User-Id header or user_id field), or None."""
+    return (request.headers.get("X-User-Id") or form.get("user_id") or "").strip()[:128] or None
+
+
+def get_patient(form):
+    """
+    The lab history key for an upload: the patient id (X-Patient-Id header or
+    patient_id form field) under the caller's user id, or None when no
+    patient id was sent or the history is disabled. Patient ids are chosen by
+    the client, so a history is only written for a known caller; raises
+    PipelineError (400) otherwise.
+    """
+    patient_id = (request.headers.get("X-Patient-Id") or form.get("patient_id") or "").strip()[:128] or None
+    if lab_history is None or patient_id is None:
+        return None
+    owner = get_user_scope(form)
+    if owner is None:
+        raise PipelineError("A patient_id needs the caller's user id (X-User-Id header or user_id field).", 400)
+    return PatientKey(owner, patient_id)
+
+
+def wants_incremental():
+    """Incremental consultations are requested with ?incremental=1 (or a form field incremental=1)."""
+    return (request.args.get('incremental') or request.form.get('incremental')) in ('1', 'true')
+
+
+def record_lab_history(structured_data, patient, incremental):
+    """
+    Stores the report's lab results for the patient. Returns (consultant
+    input, lab_history summary): in incremental mode the consultant input
+    keeps only the results that changed since the patient's earlier reports.
+    """
+    analysis, summary = structured_data, {}
+    if incremental:
+        analysis, summary = lab_history.incremental_analysis(patient, structured_data)
+    stored = lab_history.record(patient, structured_data)
+    history = {"patient_id": patient.patient_id, "stored_results": stored, "incremental": incremental, **summary}
+    if report_date(structured_data) is None:
+        history["note"] = "The report has no collection date, so it was not added to the lab history."
+    return analysis, history
+
+
+async def record_lab_history_async(structured_data, patient, incremental, stages=None):
+    if lab_history is None or patient is None:
+        return structured_data, None
+    try:
+        with timed_stage(stages, "lab_history"), telemetry.span("lab_history"):
+            return await asyncio.to_thread(record_lab_history, structured_data, patient, incremental)
+    except sqlite3.Error as e:
+        # The report is still analyzed in full; only the history is missing
+        print(f"[History] Lab history update failed: {e}")
+        return structured_data, None
+
+
+async def run_extraction_async(upload, stages=None):
+    """Step 1 of the report pipeline: returns the validated MedicalRecord or raises PipelineError."""
+    try:
+        with timed_stage(stages, "extraction"):
+            return await get_agent("extractor").analyze_file_async(upload)
+    except ModelOutputError as e:
+        raise PipelineError(f"Extraction Error: {e.message}") from e
+    except AgentError as e:
+        raise PipelineError(f"Extraction Agent Failed: {e.message}", e.status_code) from e
+
+
+def build_report_payload(patient_profile, structured_data, consultation, history=None):
+    """The /analyze_reports response; the pydantic objects are serialized by jsonify/sse_event."""
+    payload = {
+        "status": "success",
+        "service": "Medical Consultation",
+        "patient_profile": patient_profile,
+        "structured_medical_data": structured_data,
+        "consultation_summary_markdown": consultation.markdown,
+        "consultation_summary_html": consultation.html,
+        "consultation_summary_json": consultation.summary
+    }
+    if history is not None:
+        payload["lab_history"] = history
+    return payload
+
+
+async def report_pipeline_async(upload, patient_profile, stages=None, patient=None, incremental=False):
+    """
+    Extraction -> consultation for one buffered upload.
+
+    Returns the success payload dict; raises PipelineError on agent failures.
+    Per-stage durations (seconds) are recorded into `stages` when given.
+    With a `patient` (PatientKey) the lab results are added to the lab history, and
+    `incremental` sends the consultant only the results that changed.
+    """
+    # 1. Run Step 1: Extraction Agent
+    structured_data = await run_extraction_async(upload, stages)
+    report_analysis, history = await record_lab_history_async(structured_data, patient, incremental, stages)
+
+    # 2. Run Step 2: Consultant Agent (single structured call; Markdown/HTML rendered locally)
+    try:
+        with timed_stage(stages, "consultation"):
+            consultation = await get_agent("consultant").generate_consultation_bundle_async(
+                report_analysis=report_analysis,
+                patient_profile=patient_profile
+            )
+    except AgentError as e:
+        raise PipelineError(f"Consultant Agent Failed: {e.message}", e.status_code) from e
+
+    return build_report_payload(patient_profile, structured_data, consultation, history)
+
+
+def run_report_pipeline(upload, patient_profile, stages=None, patient=None, incremental=False):
+    """Sync entry point for routes and job workers (runs on the shared event loop)."""
+    return run_async(report_pipeline_async(upload, patient_profile, stages, patient, incremental))
+
+
+def stream_report_pipeline(upload, patient_profile, patient=None, incremental=False):
+    """
+    SSE variant of run_report_pipeline: an `extraction` event, `markdown` events
+    per consultation section, then a `result` event with the usual payload
+    (or an `error` event). Owns `upload` and closes it when done.
+    """
+    try:
+        try:
+            structured_data = run_async(run_extraction_async(upload))
+        except PipelineError as e:
+            yield sse_event("error", {"message": e.message})
+            return
+        finally:
+            upload.close()
+        yield sse_event("extraction", structured_data)
+        report_analysis, history = run_async(record_lab_history_async(structured_data, patient, incremental))
+
+        agen = get_agent("consultant").stream_consultation_async(report_analysis, patient_profile)
+        for event, data in iterate_async(agen):
+            if event == "markdown":
+                yield sse_event("markdown", data)
+            elif event == "result":
+                yield sse_event("result", build_report_payload(patient_profile, structured_data, data, history))
+    except AgentError as e:
+        yield sse_event("error", {"message": f"Consultant Agent Failed: {e.message}"})
+    except Exception as e:
+        yield sse_event("error", {"message": f"An unexpected server error occurred: {str(e)}"})
+
+
+def wants_stream():
+    """Streaming is requested with ?stream=1 or an 'Accept: text/event-stream' header."""
+    return request.args.get('stream') in ('1', 'true') or request.accept_mimetypes.best == 'text/event-stream'
+
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop reverse proxies (nginx) from buffering the stream
+        "X-Accel-Buffering": "no"
+    })
+
+
+def wants_async_job():
+    """Job mode is requested with ?mode=async (or a form field mode=async)."""
+    return (request.args.get('mode') or request.form.get('mode')) == 'async'
+
+
 # --- ROUTE 1: Medical Consultation (Lab Reports, Clinical Notes, etc.) ---
 
 @app.route('/analyze_reports', methods=['GET', 'POST'])
@@ -86,86 +367,353 @@ def index():
         if file.filename == '':
             return generate_error_response('No selected file.')
 
-        if 'extractor_agent' not in globals() or 'consultant_agent' not in globals():
+        if not agents_ready('extractor', 'consultant'):
             return generate_error_response("System Error: AI agents failed to initialize. Check GOOGLE_API_KEY.", 500)
 
-        tmp_path = None
+        upload = None
         try:
-            # Save file temporarily
-            suffix = os.path.splitext(file.filename)[1]
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                file.save(tmp_file.name)
-                tmp_path = tmp_file.name
-
-            # 2. Get Patient Profile from Form
-            patient_profile = {
-                "name": request.form.get('name', 'Unknown'),
-                "age": request.form.get('age', ''), 
-                "gender": request.form.get('gender', 'Unknown'),
-                "history": request.form.get('history', 'None'),
-                "complaints": request.form.get('complaints', 'None')
-            }
-
-            # 3. Run Step 1: Extraction Agent
-            raw_json_str = extractor_agent.analyze_file(tmp_path)
-            
-            # Check for errors in extraction
-            try:
-                structured_data = json.loads(raw_json_str)
-            except json.JSONDecodeError:
-                return generate_error_response("Extraction Error: The AI failed to generate valid JSON data.", 500)
-
-            if "error" in structured_data:
-                return generate_error_response(f"Extraction Agent Failed: {structured_data['error']}", 500)
-
-            # 4. Run Step 2: Consultant Agent (Markdown Output)
-            doctor_summary_md = consultant_agent.generate_consultation(
-                report_analysis=structured_data,
-                patient_profile=patient_profile,
-                json_output=False # Explicitly request Markdown
-            )
-
-            # 5. Run Step 2: Consultant Agent (Structured JSON Output)
-            doctor_summary_json_str = consultant_agent.generate_consultation(
-                report_analysis=structured_data,
-                patient_profile=patient_profile,
-                json_output=True
-            )
-            
-            # Check for consultant agent errors
-            if doctor_summary_md.startswith("Error generating consultation:"):
-                return generate_error_response(f"Consultant Agent Failed (Markdown): {doctor_summary_md}", 500)
-            
-            # Attempt to parse the JSON string into a dictionary
+            # Buffer the upload in memory (spills to disk only when large); size,
+            # page-count limits and the content hash are handled in the same pass
             try:
-                doctor_summary_json = json.loads(doctor_summary_json_str)
-                ConsultationSummaryJSON.model_validate(doctor_summary_json)
-            except Exception as e:
-                 return generate_error_response(f"Consultant Agent Failed (JSON parsing/validation): {str(e)}", 500)
-
-            # --- SUCCESS RESPONSE: RETURN JSON ---
-            return jsonify({
-                "status": "success",
-                "service": "Medical Consultation",
-                "patient_profile": patient_profile,
-                "structured_medical_data": structured_data,
-                "consultation_summary_markdown": doctor_summary_md,
-                "consultation_summary_html": markdown.markdown(doctor_summary_md),
-                "consultation_summary_json": doctor_summary_json
-            }), 200
-
+                with telemetry.span("upload"):
+                    upload = UploadedFile.from_stream(file.stream, file.filename)
+            except UploadRejected as e:
+                return generate_error_response(str(e), 413)
+
+            # 2. Get Patient Profile from Form (and the patient the lab history is kept under)
+            patient_profile = get_patient_profile(request.form)
+            patient, incremental = get_patient(request.form), wants_incremental()
+
+            # 3a. Job mode: hand the upload to the worker pool and return immediately
+            if wants_async_job():
+                job_upload = upload
+                try:
+                    job_id = job_queue.submit(
+                        lambda stages: run_report_pipeline(job_upload, patient_profile, stages, patient, incremental),
+                        on_done=job_upload.close
+                    )
+                except QueueFull as e:
+                    return generate_error_response(str(e), 503)
+                upload = None  # now owned by the job
+                return jsonify({
+                    "status": "accepted",
+                    "service": "Medical Consultation",
+                    "job_id": job_id,
+                    "status_url": url_for('get_job', job_id=job_id)
+                }), 202
+
+            # 3b. Streaming mode: Server-Sent Events while the consultation is generated
+            if wants_stream():
+                events = stream_report_pipeline(upload, patient_profile, patient, incremental)
+                upload = None  # now owned by the stream
+                return sse_response(events)
+
+            # 3c. Synchronous mode: run the pipeline in this request
+            return jsonify(run_report_pipeline(upload, patient_profile, patient=patient, incremental=incremental)), 200
+
+        except PipelineError as e:
+            return generate_error_response(e.message, e.status_code)
         except Exception as e:
             # Catch file operations errors or unexpected exceptions
             return generate_error_response(f"An unexpected server error occurred: {str(e)}", 500)
         finally:
-            # Cleanup temp file
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            # Release the upload buffer
+            if upload is not None:
+                upload.close()
 
     # For GET request, we return a simple JSON status or error message
     return jsonify({
         "status": "info",
-        "message": "Send a POST request with a 'file' and patient profile data to initiate analysis."
+        "message": "Send a POST request with a 'file' and patient profile data to initiate analysis. Add ?mode=async to receive a job id instead of waiting."
+    }), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return generate_error_response("Job not found or expired.", 404)
+
+    created_at, started_at, finished_at = job["created_at"], job["started_at"], job["finished_at"]
+    return jsonify({
+        "status": job["status"],
+        "job_id": job["id"],
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "queue_seconds": round(started_at - created_at, 4) if started_at else None,
+        "total_seconds": round(finished_at - created_at, 4) if finished_at else None,
+        "stages": job["stages"],
+        "result": job["result"],
+        "error": job["error"]
+    }), 200
+
+
+# --- ROUTE 1b: Batch Medical Consultation (many reports or a zip) ---
+
+def collect_batch_uploads(files):
+    """
+    Buffers the batch's files, expanding .zip uploads into their members.
+
+    Returns (filename, upload, error) entries in upload order; files that
+    break the size/page limits carry an error instead of an upload.
+    """
+    entries = []
+    for file in files:
+        if not file.filename:
+            continue
+        remaining = BATCH_MAX_FILES - len(entries)
+        if remaining <= 0:
+            raise UploadRejected(f"Batch holds more than {BATCH_MAX_FILES} files.")
+        try:
+            upload = UploadedFile.from_stream(file.stream, file.filename)
+        except UploadRejected as e:
+            entries.append((file.filename, None, str(e)))
+            continue
+
+        if upload.ext != ".zip":
+            entries.append((file.filename, upload, None))
+            continue
+        with upload:
+            entries.extend(expand_zip(upload, max_files=remaining))
+    return entries
+
+
+def get_batch_profiles(form, entries):
+    """
+    One patient profile per batch entry: the shared form fields, overridden by
+    the optional `profiles` JSON field (an object keyed by filename, or a
+    list in file order).
+    """
+    base_profile = get_patient_profile(form)
+    raw = form.get('profiles')
+    if not raw:
+        return [dict(base_profile) for _ in entries]
+
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError:
+        raise PipelineError("'profiles' must be a JSON object keyed by filename or a JSON list.", 400)
+    if isinstance(overrides, list):
+        overrides = dict(enumerate(overrides))
+    elif not isinstance(overrides, dict):
+        raise PipelineError("'profiles' must be a JSON object keyed by filename or a JSON list.", 400)
+
+    profiles = []
+    for index, (filename, _, _) in enumerate(entries):
+        override = overrides.get(filename, overrides.get(index)) or {}
+        profile = dict(base_profile)
+        profile.update({key: str(value) for key, value in override.items() if key in base_profile})
+        profiles.append(profile)
+    return profiles
+
+
+def batch_concurrency():
+    """BATCH_CONCURRENCY, optionally lowered per request with ?concurrency=N."""
+    try:
+        requested = int(request.args.get('concurrency') or request.form.get('concurrency') or BATCH_CONCURRENCY)
+    except ValueError:
+        requested = BATCH_CONCURRENCY
+    return max(1, min(requested, BATCH_CONCURRENCY))
+
+
+async def batch_pipeline_async(entries, profiles, concurrency, patient=None):
+    """
+    Runs the report pipeline over every entry with at most `concurrency`
+    reports in flight, yielding one result dict per file as it finishes.
+    Owns the uploads and closes each one when its pipeline is done. With a
+    `patient` (PatientKey) every report is added to that patient's lab
+    history (a batch of past reports backfills it).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index, filename, upload, profile):
+        stages = {}
+        try:
+            async with semaphore:
+                with timed_stage(stages, "total"):
+                    result = await report_pipeline_async(upload, profile, stages, patient)
+            return {"index": index, "filename": filename, "status": "success", "stages": stages, "result": result}
+        except PipelineError as e:
+            return {"index": index, "filename": filename, "status": "error", "stages": stages, "message": e.message}
+        except Exception as e:
+            return {"index": index, "filename": filename, "status": "error", "stages": stages,
+                    "message": f"An unexpected server error occurred: {str(e)}"}
+        finally:
+            upload.close()
+
+    tasks = [
+        asyncio.ensure_future(run_one(index, filename, upload, profile))
+        for index, ((filename, upload, _), profile) in enumerate(zip(entries, profiles))
+        if upload is not None
+    ]
+    try:
+        for index, (filename, upload, error) in enumerate(entries):
+            if upload is None:
+                yield {"index": index, "filename": filename, "status": "error", "stages": {}, "message": error}
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # Client went away mid-stream: stop the remaining reports
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def stream_batch_ndjson(entries, profiles, concurrency, patient=None):
+    """NDJSON variant of the batch response: one line per file as it completes, then a summary line."""
+    start = time.perf_counter()
+    succeeded = failed = 0
+    try:
+        for item in iterate_async(batch_pipeline_async(entries, profiles, concurrency, patient)):
+            if item["status"] == "success":
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False, default=to_jsonable) + "\n"
+    except Exception as e:
+        yield json.dumps({"status": "error", "message": f"An unexpected server error occurred: {str(e)}"}) + "\n"
+    finally:
+        for _, upload, _ in entries:
+            if upload is not None:
+                upload.close()
+    yield json.dumps({
+        "status": "done",
+        "count": len(entries),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_seconds": round(time.perf_counter() - start, 4)
+    }) + "\n"
+
+
+def wants_ndjson():
+    """NDJSON streaming is requested with ?stream=ndjson or an 'Accept: application/x-ndjson' header."""
+    return request.args.get('stream') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+@app.route('/analyze_reports/batch', methods=['POST'])
+def analyze_reports_batch():
+    # Batches get their own request size limit (checked before the body is parsed)
+    request.max_content_length = BATCH_MAX_BYTES
+
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not any(file.filename for file in files):
+        return generate_error_response("No files in the request. Send one or more 'files' parts or a .zip archive.")
+
+    if not agents_ready('extractor', 'consultant'):
+        return generate_error_response("System Error: AI agents failed to initialize. Check GOOGLE_API_KEY.", 500)
+
+    entries = []
+    try:
+        try:
+            with telemetry.span("upload"):
+                entries = collect_batch_uploads(files)
+            profiles = get_batch_profiles(request.form, entries)
+        except UploadRejected as e:
+            return generate_error_response(str(e), 413)
+        if not entries:
+            return generate_error_response("The batch contains no files.")
+
+        concurrency = batch_concurrency()
+        patient = get_patient(request.form)
+
+        # Streaming mode: one NDJSON line per file as soon as it finishes
+        if wants_ndjson():
+            events = stream_batch_ndjson(entries, profiles, concurrency, patient)
+            entries = []  # now owned by the stream
+            return Response(stream_with_context(events), mimetype="application/x-ndjson", headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            })
+
+        # Default: wait for every file and answer with one JSON document
+        async def collect():
+            return [item async for item in batch_pipeline_async(entries, profiles, concurrency, patient)]
+
+        start = time.perf_counter()
+        results = sorted(run_async(collect()), key=lambda item: item["index"])
+        succeeded = sum(1 for item in results if item["status"] == "success")
+        return jsonify({
+            "status": "success" if succeeded == len(results) else ("partial" if succeeded else "error"),
+            "service": "Batch Medical Consultation",
+            "count": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "concurrency": concurrency,
+            "elapsed_seconds": round(time.perf_counter() - start, 4),
+            "results": results
+        }), 200
+
+    except PipelineError as e:
+        return generate_error_response(e.message, e.status_code)
+    except Exception as e:
+        return generate_error_response(f"An unexpected server error occurred: {str(e)}", 500)
+    finally:
+        # Release any upload buffers not handed to the pipeline
+        for _, upload, _ in entries:
+            if upload is not None:
+                upload.close()
+
+# --- ROUTE 1c: Lab history (trends across a patient's reports) ---
+
+@app.route('/patients/<patient_id>/trends', methods=['GET'])
+def patient_trends(patient_id):
+    """
+    A patient's stored lab results per item, as written by the same caller
+    (X-User-Id header or ?user_id=). Optional filters: ?item=HbA1c
+    (repeatable, or comma-separated ?items=), ?from= and ?to= (YYYY-MM-DD).
+    """
+    if lab_history is None:
+        return generate_error_response("Lab history is disabled. Set LAB_HISTORY_PATH to enable it.", 404)
+    owner = get_user_scope(request.args)
+    if owner is None:
+        return generate_error_response("Lab trends need the caller's user id (X-User-Id header or user_id parameter).", 400)
+
+    items = [item.strip() for value in request.args.getlist('item') + request.args.getlist('items')
+             for item in value.split(',') if item.strip()]
+    start, end = request.args.get('from'), request.args.get('to')
+    for label, value in (("from", start), ("to", end)):
+        if value and not ISO_DATE.fullmatch(value):
+            return generate_error_response(f"'{label}' must be a date in YYYY-MM-DD format.", 400)
+
+    try:
+        with telemetry.span("lab_history"):
+            trends = lab_history.trends(PatientKey(owner, patient_id), items, start, end)
+    except sqlite3.Error as e:
+        return generate_error_response(f"Lab history query failed: {str(e)}", 500)
+    return jsonify({
+        "status": "success",
+        "service": "Lab Trends",
+        "patient_id": patient_id,
+        "from": start,
+        "to": end,
+        "items": trends
+    }), 200
+
+# --- Service status: Gemini governor, request coalescing, HTTP pool, symptom cache, job queue and in-flight agent calls ---
+
+def genai_pool_stats():
+    # genai_client is imported with the first agent; there is no pool before that
+    module = sys.modules.get("genai_client")
+    return module.default_client_factory.pool_stats() if module else None
+
+
+def symptom_cache_stats():
+    # None until the symptom agent is built, or when SYMPTOM_CACHE is off
+    agent = _agents.get("symptom")
+    return agent.cache_stats() if agent else None
+
+
+@app.route('/status', methods=['GET'])
+def service_status():
+    return jsonify({
+        "status": "ok",
+        "agent_calls_in_flight": in_flight(),
+        "jobs_pending": job_queue.pending,
+        "gemini": default_governor.stats(),
+        "single_flight": default_single_flight.stats(),
+        "genai_pool": genai_pool_stats(),
+        "symptom_cache": symptom_cache_stats()
     }), 200
 
 # --- ROUTE 2: Prescription Analysis (Image-based) ---
@@ -181,25 +729,24 @@ def analyze_prescription():
     if file.filename == '':
         return generate_error_response("No selected file"), 400
 
-    if 'prescription_agent' not in globals():
+    if not agents_ready('prescription'):
         return generate_error_response("System Error: Prescription Agent failed to initialize.", 500)
     
-    tmp_path = None
+    upload = None
     try:
-        # Save file temporarily (required for PIL.Image.open and agent input)
-        suffix = os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
-
-        # 2. Run the two-step Prescription Agent
-        analysis_result = prescription_agent.analyze_prescription_image(tmp_path)
-        
-        # 3. Check for errors from the agent
-        if "error" in analysis_result:
-            return generate_error_response(f"Prescription Analysis Failed: {analysis_result['error']}", 500)
+        # Buffer the upload in memory (PIL reads it directly, no temp file)
+        try:
+            with telemetry.span("upload"):
+                upload = UploadedFile.from_stream(file.stream, file.filename)
+        except UploadRejected as e:
+            return generate_error_response(str(e), 413)
+
+        # 2. Run the two-step Prescription Agent; a user scope lets retakes of a
+        # recent prescription from the same user reuse its analysis
+        user_scope = get_user_scope(request.form)
+        analysis_result = run_async(get_agent("prescription").analyze_prescription_image_async(upload, user_scope=user_scope))
 
-        # 4. Return Success
+        # 3. Return Success
         return jsonify({
             "status": "success",
             "service": "Prescription Analysis",
@@ -207,16 +754,43 @@ def analyze_prescription():
             "analysis": analysis_result["analysis"]
         }), 200
 
+    except ModelOutputError as e:
+        # The AI returned non-JSON text or something other than a JSON object
+        return generate_error_response(f"Analysis Error: {e.message}", e.status_code)
+    except AgentError as e:
+        # LoaderError (400) when the upload is not a readable image
+        return generate_error_response(f"Prescription Analysis Failed: {e.message}", e.status_code)
     except Exception as e:
         return generate_error_response(f"An unexpected server error occurred during prescription analysis: {str(e)}", 500)
     finally:
-        # Cleanup temp file
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+        # Release the upload buffer
+        if upload is not None:
+            upload.close()
 
 
 # --- ROUTE 3: Symptom Analysis (Text-based) ---
 
+def stream_symptom_analysis(symptoms):
+    try:
+        for event, data in iterate_async(get_agent("symptom").analyze_stream_async(symptoms)):
+            if event == "field":
+                yield sse_event("field", data)
+            elif event == "result":
+                yield sse_event("result", {
+                    "status": "success",
+                    "service": "Symptom Analysis",
+                    "input_symptoms": symptoms,
+                    "analysis_json": data,
+                    "analysis_markdown": format_symptom_analysis_to_markdown(data)
+                })
+    except ModelOutputError as e:
+        yield sse_event("error", {"message": f"Analysis Error: {e.message}"})
+    except AgentError as e:
+        yield sse_event("error", {"message": f"Symptom Analysis Failed: {e.message}"})
+    except Exception as e:
+        yield sse_event("error", {"message": f"An unexpected server error occurred during symptom analysis: {str(e)}"})
+
+
 @app.route('/doctor_assistant', methods=['POST'])
 def analyze_symptoms_route():
     # 1. Get symptoms from request body
@@ -228,33 +802,33 @@ def analyze_symptoms_route():
     if not symptoms or not isinstance(symptoms, str):
         return generate_error_response("Symptoms must be a non-empty string.", 400)
 
-    if 'symptom_agent' not in globals():
+    if not agents_ready('symptom'):
         return generate_error_response("System Error: Symptom Analysis Agent failed to initialize.", 500)
 
-    try:
-        # 2. Run the Doctor Assistant Agent (returns JSON string)
-        analysis_json_str = symptom_agent.analyze(symptoms)
-        
-        # 3. Parse the JSON result
-        try:
-            analysis_data = json.loads(analysis_json_str)
-        except json.JSONDecodeError:
-            # This handles the case where the AI returns non-JSON text or a malformed error JSON
-            return generate_error_response("Analysis Error: AI failed to generate valid JSON.", 500)
+    # 2a. Streaming mode: the disclaimer field arrives first, then the other fields, then the result
+    if wants_stream():
+        return sse_response(stream_symptom_analysis(symptoms))
 
-        # 4. Check for internal errors from the agent's try/except block (which returns {"error": "..."})
-        if "error" in analysis_data:
-            return generate_error_response(f"Symptom Analysis Failed: {analysis_data['error']}", 500)
+    try:
+        # 2. Run the Doctor Assistant Agent (returns a validated SymptomAnalysisResult)
+        analysis_data = run_async(get_agent("symptom").analyze_async(symptoms))
 
-        # 5. Return Success with structured JSON and a formatted Markdown string
+        # 3. Return Success with structured JSON and a formatted Markdown string
+        with telemetry.span("render"):
+            analysis_markdown = format_symptom_analysis_to_markdown(analysis_data)
         return jsonify({
             "status": "success",
             "service": "Symptom Analysis",
             "input_symptoms": symptoms,
             "analysis_json": analysis_data,
-            "analysis_markdown": format_symptom_analysis_to_markdown(analysis_data)
+            "analysis_markdown": analysis_markdown
         }), 200
 
+    except ModelOutputError as e:
+        # The AI returned non-JSON text or JSON that does not match the schema
+        return generate_error_response(f"Analysis Error: {e.message}", e.status_code)
+    except AgentError as e:
+        return generate_error_response(f"Symptom Analysis Failed: {e.message}", e.status_code)
     except Exception as e:
         return generate_error_response(f"An unexpected server error occurred during symptom analysis: {str(e)}", 500)
 
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+
+
+class BackgroundLoop:
+    """
+    One asyncio event loop per process, running in a daemon thread.
+
+    Flask views (sync, one thread per request under gunicorn's gthread
+    worker) submit agent coroutines here and block only on a future, so
+    every in-flight Gemini call in the process shares a single loop and a
+    single genai async connection pool. The genai async client binds its
+    HTTP pool to the first loop that uses it, which is why calls must not
+    be spread over per-request loops (asyncio.run).
+
+    The loop starts lazily and restarts after a fork, so it is safe with
+    gunicorn's --preload.
+    """
+
+    def __init__(self, name: str = "agent-event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+        """Runs `coro` on the background loop and waits for its result."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), loop)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Agent call exceeded {timeout}s")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+
+async def _in_context(coro: Coroutine[Any, Any, Any], context: contextvars.Context) -> Any:
+    # Tasks on the loop thread would otherwise start from that thread's context;
+    # this keeps the caller's request-scoped values (e.g. telemetry labels).
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+_default_loop = BackgroundLoop()
+
+
+def run_async(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """Runs an agent coroutine on the process-wide background loop."""
+    if timeout is None and os.getenv("AGENT_CALL_TIMEOUT"):
+        timeout = float(os.getenv("AGENT_CALL_TIMEOUT"))
+    return _default_loop.run(coro, timeout)
+
+
+def iterate_async(agen: AsyncIterator[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+    """
+    Drives an async generator on the background loop from sync code, one
+    item at a time (used by streaming Flask responses). The generator is
+    closed if the consumer stops early, e.g. when the client disconnects.
+    """
+    async def next_item():
+        return await agen.__anext__()
+
+    try:
+        while True:
+            try:
+                yield run_async(next_item(), timeout)
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(agen.aclose())
+
+
+def in_flight() -> int:
+    """Number of agent coroutines currently awaited by request threads."""
+    return _default_loop.in_flight
@@ -0,0 +1,99 @@
+"""
+Benchmark: large scanned PDF extraction, one Vision call vs. page groups.
+
+Builds a scanned PDF (default 30 pages) and extracts it with
+MultimodalMedicalAgent.analyze_file_async against FakeGenaiClient, whose
+simulated latency grows with the pages in each call (--base + --per-page
+seconds per page), as Vision calls do. Each row sets EXTRACTION_CHUNK_PAGES
+(0 = the whole file in one call) and reports wall time, calls made and the
+lab results in the merged record.
+
+Usage (from Backend/):
+    python benchmarks/bench_chunked_extraction.py --pages 30 --chunk-pages 0 4 8 15 --concurrency 4
+"""
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# genai.Client refuses an empty key; the fake never sends it anywhere.
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+
+from corpus import report_lines, scanned_pdf
+from fake_genai import FakeGenaiClient, LatencyModel, PassThroughFlight
+from cache_store import MemoryCache, TieredCache
+
+
+def _pdf_pages(contents) -> int:
+    from pypdf import PdfReader
+
+    pages = 0
+    for part in contents if isinstance(contents, list) else [contents]:
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.mime_type == "application/pdf":
+            pages += len(PdfReader(io.BytesIO(inline.data)).pages)
+    return pages
+
+
+class PagedLatencyClient(FakeGenaiClient):
+    """FakeGenaiClient whose extraction latency is base + per_page * PDF pages in the call."""
+
+    def __init__(self, base: float, per_page: float):
+        super().__init__(LatencyModel("zero"))
+        self.base = base
+        self.per_page = per_page
+
+    def plan(self, contents, config):
+        kind, _ = super().plan(contents, config)
+        return kind, self.base + self.per_page * _pdf_pages(contents)
+
+
+def run(path: str, chunk_pages: int, concurrency: int, client: PagedLatencyClient) -> dict:
+    os.environ["EXTRACTION_CHUNK_PAGES"] = str(chunk_pages)
+    os.environ["EXTRACTION_CHUNK_CONCURRENCY"] = str(concurrency)
+    from multimodel_medical_agent import MultimodalMedicalAgent
+
+    agent = MultimodalMedicalAgent(cache=TieredCache(MemoryCache()), single_flight=PassThroughFlight())
+    agent.client = client
+    client.reset()
+    start = time.perf_counter()
+    record = asyncio.run(agent.analyze_file_async(path))
+    return {"seconds": time.perf_counter() - start, "calls": len(client.calls["extraction"]),
+            "results": len(record.content.diagnostic.results) if record.content.diagnostic else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=30, help="Pages in the scanned PDF")
+    parser.add_argument("--chunk-pages", type=int, nargs="+", default=[0, 4, 8, 15], help="EXTRACTION_CHUNK_PAGES values")
+    parser.add_argument("--concurrency", type=int, default=4, help="EXTRACTION_CHUNK_CONCURRENCY")
+    parser.add_argument("--base", type=float, default=0.5, help="Simulated seconds per call")
+    parser.add_argument("--per-page", type=float, default=0.25, help="Simulated seconds per PDF page in a call")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per setting (median reported)")
+    args = parser.parse_args()
+
+    print(f"Building a {args.pages}-page scanned PDF...")
+    rng = random.Random(0)
+    data = scanned_pdf([report_lines(rng, page=p + 1) for p in range(args.pages)], rng)
+    client = PagedLatencyClient(args.base, args.per_page)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "discharge.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"\n{'chunk pages':>11}{'calls':>7}{'median s':>10}{'results':>9}")
+        for chunk_pages in args.chunk_pages:
+            results = [run(path, chunk_pages, args.concurrency, client) for _ in range(args.runs)]
+            print(f"{chunk_pages or 'off':>11}{results[0]['calls']:>7}"
+                  f"{statistics.median(r['seconds'] for r in results):>10.2f}{results[0]['results']:>9}")
+
+
+if __name__ == "__main__":
+    main()
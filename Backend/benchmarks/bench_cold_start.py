@@ -0,0 +1,109 @@
+"""
+Benchmark: worker cold start, lazy vs. eager agent construction.
+
+Each run starts a fresh interpreter, as a new gunicorn worker would.
+
+1. Import-time report: `python -X importtime -c "import app"`, showing the
+   app's total import time and the heaviest top-level imports.
+2. Time to first request: wall time from process start until the Flask
+   app has served a first request. `/status` needs no agent. The symptom
+   route builds the DoctorAssistant, with its genai client never called.
+
+Eager mode (PRELOAD_AGENTS=1) imports and builds all four agents at import,
+as the app did before agents were built on first use.
+
+Usage (from Backend/):
+    python benchmarks/bench_cold_start.py --runs 5 --top 12
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "lazy (default)": {"PRELOAD_AGENTS": "0"},
+    "eager (PRELOAD_AGENTS=1)": {"PRELOAD_AGENTS": "1"},
+}
+
+# Child script: import the app and serve one request without network access.
+FIRST_REQUEST_SCRIPT = """
+import sys
+import app
+if sys.argv[1] == "symptom":
+    assert app.agents_ready("symptom")
+client = app.app.test_client()
+assert client.get("/status").status_code == 200
+"""
+
+
+def child_env(overrides):
+    env = dict(os.environ)
+    # genai.Client refuses an empty key; nothing is sent anywhere.
+    env.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+    env.update(overrides)
+    return env
+
+
+def import_report(overrides):
+    """Returns (total_ms, [(cumulative_ms, module)] for top-level imports) from -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BACKEND_DIR, env=child_env(overrides), capture_output=True, text=True, check=True
+    )
+    total_ms, modules = 0.0, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = (part for part in line.replace("import time:", "|", 1).split("|"))
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if name == "app":
+            total_ms = int(cumulative_us) / 1000
+        elif depth == 1:
+            modules.append((int(cumulative_us) / 1000, name))
+    return total_ms, sorted(modules, reverse=True)
+
+
+def time_to_first_request(overrides, route, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", FIRST_REQUEST_SCRIPT, route], cwd=BACKEND_DIR,
+                       env=child_env(overrides), capture_output=True, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement (median reported)")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest top-level imports to list")
+    args = parser.parse_args()
+
+    results = {}
+    for label, overrides in MODES.items():
+        total_ms, modules = import_report(overrides)
+        print(f"\n=== import app: {label} — {total_ms:.0f} ms ===")
+        print(f"{'cumulative ms':>14}  module")
+        for cumulative_ms, name in modules[:args.top]:
+            print(f"{cumulative_ms:14.1f}  {name}")
+        results[label] = (
+            total_ms,
+            time_to_first_request(overrides, "status", args.runs),
+            time_to_first_request(overrides, "symptom", args.runs),
+        )
+
+    print(f"\n{'mode':28} {'import ms':>10} {'first /status ms':>17} {'first symptom ms':>17}")
+    for label, (import_ms, status_ms, symptom_ms) in results.items():
+        print(f"{label:28} {import_ms:10.0f} {status_ms:17.0f} {symptom_ms:17.0f}")
+    lazy, eager = results["lazy (default)"], results["eager (PRELOAD_AGENTS=1)"]
+    print(f"\nworker start -> first request: {eager[1] - lazy[1]:.0f} ms faster "
+          f"({100 * (1 - lazy[1] / eager[1]):.0f}%) without preloading agents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: /analyze_reports consultation step, two LLM calls vs. one.
+
+Runs PatientConsultantAgent against a stubbed genai client with a fixed
+per-call latency, so the difference reflects round-trips only.
+
+Usage (from Backend/):
+    python benchmarks/bench_consultation.py --latency 0.8 --runs 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# genai.Client refuses an empty key; the stub never sends it anywhere.
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+
+import markdown
+from patient_advisor import PatientConsultantAgent, ConsultationSummaryJSON
+
+SAMPLE_REPORT = {
+    "meta": {"doc_type": "Diagnostic", "confidence": 0.92},
+    "content": {"diagnostic": {"test_name": "Lipid Panel", "results": [
+        {"item": "LDL", "value": 162, "unit": "mg/dL", "flag": "High"},
+        {"item": "HDL", "value": 38, "unit": "mg/dL", "flag": "Low"},
+    ]}},
+    "summary": "Lipid panel with elevated LDL and low HDL.",
+}
+
+SAMPLE_SUMMARY = ConsultationSummaryJSON(
+    overall_summary="Your cholesterol profile needs attention. LDL is high and HDL is low.",
+    key_findings=[
+        {"parameter_name": "LDL", "status": "High", "interpretation": "More 'bad' cholesterol than recommended."},
+        {"parameter_name": "HDL", "status": "Low", "interpretation": "Less 'good' cholesterol than recommended."},
+    ],
+    lifestyle_recommendations=["Walk 30 minutes daily.", "Reduce fried food.", "Add oats and nuts."],
+    when_to_see_doctor=["Chest pain or shortness of breath."],
+)
+
+
+class StubModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if config is not None and config.response_mime_type == "application/json":
+            return SimpleNamespace(text=SAMPLE_SUMMARY.model_dump_json())
+        return SimpleNamespace(text="## 🩺 Dr. AI Summary\n\n**1. The Big Picture**\n...")
+
+
+def legacy_flow(agent):
+    md = agent.generate_consultation(SAMPLE_REPORT, {"name": "Test"}, json_output=False)
+    json_str = agent.generate_consultation(SAMPLE_REPORT, {"name": "Test"}, json_output=True)
+    summary = json.loads(json_str)
+    ConsultationSummaryJSON.model_validate(summary)
+    return {"markdown": md, "html": markdown.markdown(md), "json": summary}
+
+
+def bundle_flow(agent):
+    return agent.generate_consultation_bundle(SAMPLE_REPORT, {"name": "Test"})
+
+
+def run(flow, agent, runs):
+    agent.client.models.calls = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        flow(agent)
+    elapsed = time.perf_counter() - start
+    return elapsed / runs, agent.client.models.calls / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="Simulated seconds per LLM call")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    agent = PatientConsultantAgent()
+    agent.client = SimpleNamespace(models=StubModels(args.latency))
+
+    legacy_avg, legacy_calls = run(legacy_flow, agent, args.runs)
+    bundle_avg, bundle_calls = run(bundle_flow, agent, args.runs)
+
+    print(f"legacy (markdown + json): {legacy_avg * 1000:8.1f} ms/request, {legacy_calls:.0f} LLM calls")
+    print(f"bundle (json + render)  : {bundle_avg * 1000:8.1f} ms/request, {bundle_calls:.0f} LLM calls")
+    print(f"speedup                 : {legacy_avg / bundle_avg:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
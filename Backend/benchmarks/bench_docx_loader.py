@@ -0,0 +1,138 @@
+"""
+Benchmark: DOCX loading, python-docx object model vs. streaming lxml iterparse.
+
+Builds lab reports with large results tables (document.xml is written
+directly, so even 50k-row files take a moment to build) and loads each one
+with:
+
+- legacy:        python-docx, paragraphs only (the old SmartLoader.load_docx)
+- python-docx+:  python-docx walking paragraphs and tables (same text as streaming)
+- streaming:     docx_reader.docx_to_text (the current SmartLoader.load_docx)
+
+Reports load time, peak RSS growth (each load runs in a fresh process) and
+how many lab rows reach the model.
+
+Usage (from Backend/):
+    python benchmarks/bench_docx_loader.py --rows 1000 10000 50000 --runs 3
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import statistics
+import subprocess
+import zipfile
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import LAB_PANEL
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+LOADERS = ("legacy", "python-docx+", "streaming")
+
+
+def _paragraph(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def _row(cells) -> str:
+    return "<w:tr>" + "".join(f"<w:tc><w:tcPr/>{_paragraph(cell)}</w:tc>" for cell in cells) + "</w:tr>"
+
+
+def build_docx(rows: int, seed: int = 0) -> bytes:
+    """A report with a few paragraphs and one `rows`-row results table, packaged from a python-docx skeleton."""
+    from docx import Document
+
+    rng = random.Random(seed)
+    skeleton = io.BytesIO()
+    Document().save(skeleton)
+
+    body = [_paragraph("CITY DIAGNOSTICS LABORATORY"), _paragraph("Patient: Test Patient    MRN: 123456"), "<w:tbl>",
+            _row(("Test", "Result", "Unit", "Reference"))]
+    for i in range(rows):
+        name, unit, low, high = LAB_PANEL[i % len(LAB_PANEL)]
+        body.append(_row((name, str(round(rng.uniform(low, high * 1.2), 1)), unit, f"{low}-{high}")))
+    body += ["</w:tbl>", _paragraph("Interpretation: values flagged H/L are outside the reference range.")]
+    document_xml = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    f'<w:document xmlns:w="{W_NS}"><w:body>{"".join(body)}<w:sectPr/></w:body></w:document>')
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(skeleton) as source, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = document_xml.encode("utf-8") if item.filename == "word/document.xml" else source.read(item)
+            target.writestr(item, data)
+    return out.getvalue()
+
+
+def load(loader: str, data: bytes) -> str:
+    if loader == "streaming":
+        from document_loader import SmartLoader
+        return SmartLoader.load_docx(io.BytesIO(data))
+
+    import docx
+    document = docx.Document(io.BytesIO(data))
+    if loader == "legacy":
+        return "\n".join(para.text for para in document.paragraphs)
+    lines = [para.text for para in document.paragraphs if para.text]
+    for table in document.tables:
+        lines += [" | ".join(cell.text for cell in row.cells) for row in table.rows]
+    return "\n".join(lines)
+
+
+def worker(loader: str, path: str) -> None:
+    """Runs one load in this (fresh) process and prints its measurements as JSON."""
+    with open(path, "rb") as f:
+        data = f.read()
+    # Import the loader's modules before taking the baseline
+    load(loader, build_docx(1))
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    text = load(loader, data)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lab_rows = sum(1 for line in text.splitlines() if line.split(" | ")[0] in {name for name, *_ in LAB_PANEL})
+    print(json.dumps({"seconds": elapsed, "rss_kb": peak - baseline, "chars": len(text), "lab_rows": lab_rows}))
+
+
+def measure(loader: str, path: str) -> dict:
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", loader, path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000], help="Table rows per document")
+    parser.add_argument("--runs", type=int, default=3, help="Loads per loader and size (median reported)")
+    parser.add_argument("--loaders", nargs="+", choices=LOADERS, default=list(LOADERS))
+    parser.add_argument("--worker", nargs=2, metavar=("LOADER", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    import tempfile
+    print(f"{'rows':>7} {'docx KB':>8}  {'loader':<13}{'median ms':>10}{'peak RSS MB':>13}{'chars':>10}{'lab rows':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, f"report_{rows}.docx")
+            data = build_docx(rows)
+            with open(path, "wb") as f:
+                f.write(data)
+            for loader in args.loaders:
+                results = [measure(loader, path) for _ in range(args.runs)]
+                print(f"{rows:>7} {len(data) / 1024:>8.0f}  {loader:<13}"
+                      f"{statistics.median(r['seconds'] for r in results) * 1000:>10.1f}"
+                      f"{max(r['rss_kb'] for r in results) / 1024:>13.1f}"
+                      f"{results[0]['chars']:>10}{results[0]['lab_rows']:>10}")
+
+
+if __name__ == "__main__":
+    main()
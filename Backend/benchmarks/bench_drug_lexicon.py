@@ -0,0 +1,129 @@
+"""
+Benchmark: drug-name normalization lookups on a large lexicon.
+
+Builds a synthetic lexicon of --entries canonical names (random syllables,
+most ending in a real pharmacological stem such as "-sartan" or "-prazole",
+each with --aliases brand aliases) on top of the bundled
+data/drug_lexicon.tsv, then times DrugLexicon.match per lookup path:
+
+- exact:   a known name or alias with a strength ("Tab. Corvamid 500mg")
+- prefix:  a truncated name ("Corvam 500")
+- fuzzy:   one or two OCR-style character errors ("Corvarnid 500")
+- miss:    a name that is not in the lexicon (correct = no match)
+- cached:  the exact queries again, served from the LRU
+
+Reports build time, index size and median/p95 microseconds per lookup, with
+the cache cleared before each lookup except in the "cached" row.
+
+Usage (from Backend/):
+    python benchmarks/bench_drug_lexicon.py --entries 50000 --queries 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drug_lexicon import DEFAULT_LEXICON_PATH, DrugLexicon
+
+CONSONANTS = "bcdfghklmnprstvxz"
+VOWELS = "aeiou"
+CODAS = ("", "", "", "n", "r", "l", "s", "x")
+STEMS = ("pril", "sartan", "olol", "azole", "prazole", "mycin", "cillin", "statin", "tidine", "dipine", "floxacin",
+         "mab", "nib", "vir", "zepam", "triptan", "gliptin", "parin", "dronate", "lukast", "afil", "oxetine", "cycline",
+         "semide", "thiazide", "setron", "glitazone", "profen", "caine", "sone")
+OCR_CONFUSIONS = {"m": "rn", "l": "1", "o": "0", "i": "l", "e": "c", "n": "m", "a": "o", "u": "v"}
+
+
+def bundled_entries():
+    entries = []
+    with open(DEFAULT_LEXICON_PATH, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                canonical, _, aliases = line.rstrip("\n").partition("\t")
+                entries.append((canonical, [alias.strip() for alias in aliases.split(",") if alias.strip()]))
+    return entries
+
+
+def synthetic_entries(count: int, aliases: int, rng: random.Random):
+    syllable = lambda: rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(CODAS)
+    names = set()
+    while len(names) < count * (1 + aliases):
+        stem = rng.choice(STEMS) if rng.random() < 0.7 else syllable()
+        names.add(("".join(syllable() for _ in range(rng.randint(1, 3))) + stem).capitalize())
+    names = sorted(names)
+    rng.shuffle(names)
+    return [(names[i * (1 + aliases)], names[i * (1 + aliases) + 1:(i + 1) * (1 + aliases)]) for i in range(count)]
+
+
+def misspell(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(1, len(chars))
+        chars[i] = OCR_CONFUSIONS.get(chars[i], chars[i] + chars[i])
+    return "".join(chars)
+
+
+def queries(entries, count: int, rng: random.Random):
+    """Per path: [(query text, expected canonical name or None)]."""
+    picked = [(rng.choice([canonical, *aliases]), canonical) for canonical, aliases in rng.sample(entries, count)]
+    strength = lambda: f" {rng.choice((5, 10, 40, 250, 500, 650))}{rng.choice(('', 'mg', ' mg'))}"
+    return {
+        "exact": [(f"{rng.choice(('', 'Tab. ', 'Cap '))}{name}{strength()}", canonical) for name, canonical in picked],
+        "prefix": [(name[:max(6, len(name) - 2)] + strength(), canonical) for name, canonical in picked],
+        "fuzzy": [(misspell(name, rng) + strength(), canonical) for name, canonical in picked],
+        "miss": [(f"Qwzx{name[::-1]}{strength()}", None) for name, _ in picked],
+    }
+
+
+def time_lookups(lexicon: DrugLexicon, cases, clear: bool):
+    """Per-lookup seconds and the number of lookups returning the expected name (None for a miss)."""
+    timings, correct = [], 0
+    for text, expected in cases:
+        if clear:
+            lexicon._match.cache_clear()
+        start = time.perf_counter()
+        match = lexicon.match(text)
+        timings.append(time.perf_counter() - start)
+        correct += (match.name if match else None) == expected
+    return timings, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=50000, help="Synthetic canonical entries added to the bundled lexicon")
+    parser.add_argument("--aliases", type=int, default=2, help="Brand aliases per synthetic entry")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups per path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entries = bundled_entries() + synthetic_entries(args.entries, args.aliases, rng)
+
+    start = time.perf_counter()
+    lexicon = DrugLexicon(entries)
+    build_seconds = time.perf_counter() - start
+    # Measured on a second build: tracing allocations slows the first one down
+    tracemalloc.start()
+    DrugLexicon(entries)
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{len(lexicon)} entries, {len(lexicon.keys)} keys: built in {build_seconds:.2f} s, "
+          f"index ~{index_bytes / 2 ** 20:.1f} MiB")
+
+    print(f"\n{'path':<8}{'correct':>10}{'median µs':>11}{'p95 µs':>9}")
+    paths = queries(entries, args.queries, rng)
+    rows = [(path, cases, True) for path, cases in paths.items()] + [("cached", paths["exact"], False)]
+    for path, cases, clear in rows:
+        timings, correct = time_lookups(lexicon, cases, clear)
+        timings.sort()
+        print(f"{path:<8}{f'{correct}/{len(cases)}':>10}{statistics.median(timings) * 1e6:>11.1f}"
+              f"{timings[int(len(timings) * 0.95)] * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
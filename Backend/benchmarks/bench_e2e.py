@@ -0,0 +1,363 @@
+"""
+Benchmark: offline end-to-end load test of the three Flask routes.
+
+Drives /analyze_reports, /analyze_prescription and /doctor_assistant
+concurrently through the Flask test client, with every agent pointed at
+FakeGenaiClient (benchmarks/fake_genai.py). The fake returns schema-valid
+JSON after a simulated latency, so the whole pipeline runs as in production
+(upload buffering, loaders, image optimization, governor, JSON parsing,
+Markdown/HTML rendering) without network access or API cost.
+
+Documents come from benchmarks/corpus.py: text, long-text, scanned and mixed
+PDFs, DOCX, phone-photo JPEGs, PNG screenshots and plain text.
+
+Reports per route: p50/p95/p99 latency, throughput and errors; per stage:
+loader, image optimization, rendering and simulated LLM time; and process
+RSS. By default the rate limits, result caches and request coalescing are
+off, so every request does the full work.
+
+Regression checks: save a run with --save, then compare later runs with
+--baseline. The run exits with status 1 when a route's p95 or throughput,
+or peak RSS, is worse than the baseline by more than --tolerance.
+
+Usage (from Backend/):
+    python benchmarks/bench_e2e.py --requests 40 --concurrency 16
+    python benchmarks/bench_e2e.py --latency lognormal:0.8:0.4 --latency extraction=fixed:2
+    python benchmarks/bench_e2e.py --latency zero --save baseline.json
+    python benchmarks/bench_e2e.py --latency zero --baseline baseline.json --tolerance 0.15
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import threading
+import contextlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import KINDS as DOCUMENT_KINDS, PRESCRIPTION_KINDS, build_corpus  # noqa: E402
+from fake_genai import FakeGenaiClient, install_fake_client, parse_latency_args  # noqa: E402
+
+ROUTES = ("reports", "prescription", "symptoms")
+SYMPTOMS = ["fever", "dry cough", "sore throat", "headache", "runny nose", "fatigue", "body ache",
+            "nausea", "dizziness", "chest tightness", "sneezing", "chills", "loss of appetite"]
+
+
+def configure_environment(args):
+    """Must run before `app` is imported: the governor and caches read the env at import."""
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+    if not args.keep_limits:
+        os.environ["GEMINI_RPM"] = "0"
+        os.environ["GEMINI_TPM"] = "0"
+    if not args.warm_cache:
+        os.environ["EXTRACTION_CACHE_MAXSIZE"] = "0"
+        os.environ["MEDICINE_CACHE_MAXSIZE"] = "0"
+        os.environ["SYMPTOM_CACHE_MAXSIZE"] = "0"
+        os.environ.pop("EXTRACTION_CACHE_PATH", None)
+        os.environ.pop("MEDICINE_CACHE_PATH", None)
+        os.environ.pop("SYMPTOM_CACHE_PATH", None)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 1) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+    }
+
+
+def rss_mb():
+    """Current resident set size in MB (falls back to the process peak off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler(threading.Thread):
+    """Samples RSS while the load runs, so the peak excludes corpus generation."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return round(self.peak, 1)
+
+
+class StageTimer:
+    """Wraps functions in place and records their wall time per stage name."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, owner, attribute, stage):
+        original = owner.__dict__[attribute]
+        is_static = isinstance(original, staticmethod)
+        function = original.__func__ if is_static else original
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(owner, attribute, staticmethod(timed) if is_static else timed)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+
+def instrument(app_module, timer):
+    """Times the CPU-bound stages that sit between the LLM calls."""
+    import patient_advisor
+    from document_loader import SmartLoader
+    from image_optimizer import ImageOptimizer
+    from prescription_reader import PrescriptionReaderAgent
+
+    timer.wrap(SmartLoader, "process_file", "load_document")
+    timer.wrap(ImageOptimizer, "optimize", "optimize_image")
+    timer.wrap(PrescriptionReaderAgent, "_open_image", "decode_prescription")
+    timer.wrap(patient_advisor.PatientConsultantAgent, "_bundle", "render_consultation")
+    timer.wrap(app_module, "format_symptom_analysis_to_markdown", "render_symptoms")
+
+
+def build_requests(args, corpus):
+    """The shuffled request mix: (route, kind, request kwargs) per request."""
+    rng = random.Random(args.seed)
+    report_documents = [(kind, doc) for kind in args.documents for doc in corpus[kind]]
+    prescription_documents = [(kind, doc) for kind in PRESCRIPTION_KINDS for doc in corpus[kind]]
+    plan = []
+    for route in args.routes:
+        for i in range(args.requests):
+            if route == "reports":
+                kind, (filename, data) = report_documents[i % len(report_documents)]
+                plan.append((route, kind, {"path": "/analyze_reports", "filename": filename, "data": data,
+                                           "form": {"age": "45", "gender": "Female", "history": "Hypertension"}}))
+            elif route == "prescription":
+                kind, (filename, data) = prescription_documents[i % len(prescription_documents)]
+                plan.append((route, kind, {"path": "/analyze_prescription", "filename": filename, "data": data}))
+            else:
+                # Unique text per request, so no request is answered by another's result
+                symptoms = ", ".join(rng.sample(SYMPTOMS, 3)) + f" for {i + 1} days"
+                plan.append((route, "text", {"path": "/doctor_assistant", "json": {"symptoms": symptoms}}))
+    rng.shuffle(plan)
+    return plan
+
+
+class Driver:
+    """Sends requests through one Flask test client per thread."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        return client
+
+    def send(self, route, kind, request):
+        client = self.client()
+        start = time.perf_counter()
+        if "json" in request:
+            response = client.post(request["path"], json=request["json"])
+        else:
+            form = dict(request.get("form", {}))
+            form["file"] = (io.BytesIO(request["data"]), request["filename"])
+            response = client.post(request["path"], data=form, content_type="multipart/form-data")
+        elapsed = time.perf_counter() - start
+        ok = response.status_code == 200 and response.get_json().get("status") == "success"
+        error = None if ok else f"{response.status_code}: {(response.get_json() or {}).get('message', '')[:120]}"
+        return route, kind, elapsed, error
+
+
+def run(args):
+    configure_environment(args)
+    print(f"Building corpus ({', '.join(args.documents)}; {args.variants} variant(s) each)...")
+    corpus = build_corpus(sorted(set(args.documents) | set(PRESCRIPTION_KINDS)), args.variants)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log if not args.verbose else sys.stdout):
+        import app as app_module
+
+        default_latency, overrides = parse_latency_args(args.latency, args.seed)
+        fake = FakeGenaiClient(default_latency, overrides, seed=args.seed)
+        install_fake_client(app_module, fake, coalesce=args.dedupe)
+        timer = StageTimer()
+        instrument(app_module, timer)
+        driver = Driver(app_module.app)
+
+        # Warm-up: first-use costs (template compile, PIL plugins, pool start) are not measured
+        warmup = [(route, kind, request) for route, kind, request in build_requests(
+            argparse.Namespace(**{**vars(args), "requests": 1}), corpus)]
+        for item in warmup:
+            driver.send(*item)
+        fake.reset()
+        timer.reset()
+
+        plan = build_requests(args, corpus)
+        rss_start = round(rss_mb(), 1)
+        sampler = RssSampler()
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(lambda item: driver.send(*item), plan))
+        wall = time.perf_counter() - start
+        rss_peak = sampler.stop()
+        rss_end = round(rss_mb(), 1)
+
+    results = {
+        "config": {
+            "requests_per_route": args.requests, "concurrency": args.concurrency, "routes": list(args.routes),
+            "documents": list(args.documents), "latency": args.latency or [default_latency.spec],
+            "dedupe": args.dedupe, "warm_cache": args.warm_cache, "keep_limits": args.keep_limits,
+        },
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(outcomes) / wall, 2),
+        "routes": {},
+        "documents": {},
+        "stages": {},
+        "rss_mb": {"start": rss_start, "end": rss_end, "peak": rss_peak},
+        "errors": [],
+    }
+    for route in args.routes:
+        samples = [elapsed for r, _, elapsed, error in outcomes if r == route and error is None]
+        errors = sum(1 for r, _, _, error in outcomes if r == route and error is not None)
+        results["routes"][route] = {**summarize(samples), "errors": errors, "throughput_rps": round(len(samples) / wall, 2)}
+    for kind in sorted({kind for route, kind, _, _ in outcomes if route == "reports"}):
+        results["documents"][kind] = summarize([e for r, k, e, err in outcomes if r == "reports" and k == kind and err is None])
+    for stage, samples in sorted(timer.samples.items()):
+        results["stages"][stage] = summarize(samples)
+    for kind, samples in fake.calls.items():
+        if samples:
+            results["stages"][f"llm_{kind} (simulated)"] = summarize(samples)
+    results["errors"] = sorted({error for _, _, _, error in outcomes if error is not None})[:10]
+    return results
+
+
+def print_report(results):
+    config = results["config"]
+    print(f"\n{len(config['routes'])} route(s) x {config['requests_per_route']} requests, "
+          f"concurrency {config['concurrency']}, latency {' '.join(config['latency'])}")
+    header = f"{'':24} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>7}"
+    print("\n" + header)
+    for route, row in results["routes"].items():
+        print(f"{route:24} {row['count']:6} {row['errors']:6} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} "
+              f"{row['p99_ms']:9.1f} {row['throughput_rps']:7.2f}")
+    print(f"{'all routes':24} {'':6} {'':6} {'':9} {'':9} {'':9} {results['throughput_rps']:7.2f}")
+
+    if results["documents"]:
+        print(f"\n{'/analyze_reports by file':24} {'count':>6} {'':6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for kind, row in results["documents"].items():
+            print(f"{kind:24} {row['count']:6} {'':6} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}")
+
+    print(f"\n{'stage':40} {'calls':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage, row in results["stages"].items():
+        print(f"{stage:40} {row['count']:6} {row['mean_ms']:9.1f} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f}")
+
+    rss = results["rss_mb"]
+    print(f"\nRSS: {rss['start']:.0f} MB at start, {rss['end']:.0f} MB at end, {rss['peak']:.0f} MB peak")
+    for error in results["errors"]:
+        print(f"error: {error}")
+
+
+def compare(results, baseline, tolerance):
+    """Lists regressions beyond `tolerance` (fraction) relative to `baseline`."""
+    regressions = []
+
+    def check(label, current, previous, higher_is_worse=True):
+        if not previous:
+            return
+        change = (current - previous) / previous
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        print(f"{label:40} {previous:10.1f} -> {current:10.1f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(label)
+
+    if baseline.get("config") != results["config"]:
+        print("\nwarning: baseline was recorded with a different configuration")
+    print(f"\n{'vs. baseline':40} {'baseline':>10}    {'current':>10}  {'change':>7}")
+    for route, row in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous:
+            check(f"{route} p95 ms", row["p95_ms"], previous["p95_ms"])
+            check(f"{route} req/s", row["throughput_rps"], previous["throughput_rps"], higher_is_worse=False)
+    check("peak RSS MB", results["rss_mb"]["peak"], baseline.get("rss_mb", {}).get("peak"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=30, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--documents", nargs="+", choices=list(DOCUMENT_KINDS), default=list(DOCUMENT_KINDS),
+                        help="Corpus kinds uploaded to /analyze_reports")
+    parser.add_argument("--variants", type=int, default=2, help="Distinct documents per corpus kind")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Simulated LLM latency: SPEC or KIND=SPEC (zero, fixed:S, uniform:MIN:MAX, "
+                             "lognormal:MEDIAN:SIGMA; default lognormal:0.5:0.35). Repeatable.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--dedupe", action="store_true", help="Keep request coalescing (single flight) on")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the extraction and medicine caches on")
+    parser.add_argument("--keep-limits", action="store_true", help="Keep the GEMINI_RPM/TPM rate limits on")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    parser.add_argument("--save", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare with results saved by --save; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (default 0.10)")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_report(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
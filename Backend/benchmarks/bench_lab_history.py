@@ -0,0 +1,105 @@
+"""
+Benchmark: lab history writes and trend queries on a populated store.
+
+Fills a LabHistoryStore with --patients patients x --reports reports (one
+every 90 days) of the corpus lab panel, then times:
+
+- record:       storing one report's results (one transaction)
+- item range:   trends() for one item over a one-year window
+- all items:    trends() for every item of one patient
+- incremental:  latest_before() for a full report's items
+
+and prints the SQLite query plan of each read, which should be a single
+SEARCH on the primary key.
+
+Usage (from Backend/):
+    python benchmarks/bench_lab_history.py --patients 2000 --reports 12
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import LAB_PANEL
+from lab_history import LabHistoryStore, PatientKey, item_key
+from multimodel_medical_agent import MedicalRecord
+
+
+def report(date: str, rng: random.Random) -> MedicalRecord:
+    results = [{"item": name, "value": round(rng.uniform(low, high) * rng.uniform(0.8, 1.2), 1), "unit": unit}
+               for name, unit, low, high in LAB_PANEL]
+    return MedicalRecord.model_validate({
+        "meta": {"doc_type": "Diagnostic", "confidence": 0.9},
+        "content": {"diagnostic": {"collection_date": date, "results": results}},
+        "summary": "",
+    })
+
+
+def median_ms(fn, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--reports", type=int, default=12, help="Reports per patient")
+    parser.add_argument("--runs", type=int, default=200, help="Timed queries per row (median reported)")
+    args = parser.parse_args()
+    if args.reports < 1 or args.patients < 1:
+        parser.error("--patients and --reports must be at least 1")
+
+    rng = random.Random(0)
+    first = datetime.date(2023, 1, 1)
+    dates = [(first + datetime.timedelta(days=90 * i)).isoformat() for i in range(args.reports)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = LabHistoryStore(os.path.join(directory, "lab_history.sqlite3"))
+        start = time.perf_counter()
+        for patient in range(args.patients):
+            for date in dates:
+                store.record(PatientKey("bench", f"patient-{patient}"), report(date, rng))
+        fill_seconds = time.perf_counter() - start
+        rows = args.patients * args.reports * len(LAB_PANEL)
+        size = sum(os.path.getsize(path) for path in (store.path, store.path + "-wal") if os.path.exists(path))
+        print(f"{rows} rows ({args.patients} patients x {args.reports} reports x {len(LAB_PANEL)} items): "
+              f"filled in {fill_seconds:.1f} s, {size / 2 ** 20:.1f} MiB\n")
+
+        patient = lambda: PatientKey("bench", f"patient-{rng.randrange(args.patients)}")
+        keys = [item_key(name) for name, *_ in LAB_PANEL]
+        extra = report(dates[-1], rng)
+        queries = [
+            ("record", lambda: store.record(PatientKey("bench", "patient-bench"), extra), None),
+            ("item range", lambda: store.trends(patient(), ["HbA1c"], dates[max(0, len(dates) - 5)], dates[-1]),
+             "SELECT * FROM lab_results WHERE owner = ? AND patient_id = ? AND item_key IN (?)"
+             " AND collection_date >= ? AND collection_date <= ?"
+             " ORDER BY item_key, collection_date"),
+            ("all items", lambda: store.trends(patient()),
+             "SELECT * FROM lab_results WHERE owner = ? AND patient_id = ? ORDER BY item_key, collection_date"),
+            ("incremental", lambda: store.latest_before(patient(), keys, dates[-1]),
+             "SELECT item_key, MAX(collection_date) FROM lab_results WHERE owner = ? AND patient_id = ? AND item_key IN (?, ?)"
+             " AND collection_date < ? GROUP BY item_key"),
+        ]
+        print(f"{'query':<13}{'median ms':>10}  plan")
+        conn = store._connect()
+        for label, fn, sql in queries:
+            plan = ""
+            if sql:
+                params = [None] * sql.count("?")
+                plan = "; ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+            print(f"{label:<13}{median_ms(fn, args.runs):>10.3f}  {plan}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: local lab-value parser coverage and speed on the text corpus.
+
+Loads each text-based corpus document with SmartLoader, parses the text with
+LabTextParser and reports, per document kind:
+
+- layout:   the registry layout that read the most rows
+- rows:     lab rows parsed / lab rows in the document
+- coverage: parsed share of result-like lines
+- outcome:  local (no model call), remainder (model sees only the unparsed
+            text) or llm (full model extraction), as MultimodalMedicalAgent decides
+- tokens:   estimated model input tokens, full document vs. what is still sent
+- parse ms: median parse time
+
+The "+noise" variants append a qualified value ("<5") and a free-text
+comment, which the parser leaves to the model.
+
+It then checks number formats: grouped thousands ("11,800", lakh "2,50,000")
+and decimal commas ("13,5") must read as the printed value, and rows that mix
+a decimal comma with a decimal point must be left unparsed.
+
+Usage (from Backend/):
+    python benchmarks/bench_lab_parser.py --runs 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import LAB_PANEL, build_document
+from document_loader import SmartLoader
+from gemini_governor import estimate_tokens
+from lab_parser import LabTextParser
+
+TEXT_KINDS = ("text", "text_pdf", "text_pdf_long", "docx")
+NOISE = ("CRP                           <5  mg/L      0-5",
+         "Comment: mild microcytic anemia; correlate clinically with iron studies and repeat CBC in 4 weeks. "
+         "Sample received hemolysed; potassium may be falsely elevated and should be repeated if clinically indicated. "
+         "Fasting status was not confirmed at collection, so glucose and lipid values should be interpreted with caution. "
+         "Results were verified by the duty pathologist.")
+
+# (row, expected value) - None: the row is ambiguous and must stay unparsed
+NUMBER_CASES = (
+    ("Total WBC Count     11,800  cells/cumm  4,000-11,000", 11800.0),
+    ("Platelet Count    2,50,000  cells/cumm  1,50,000-4,10,000", 250000.0),
+    ("Platelets: 250,000 cells/uL (150,000-410,000)", 250000.0),
+    ("Hemoglobin            13,5  g/dL        12,0-17,5", 13.5),
+    ("Creatinine             1,2  mg/dL       0.7-1.3", None),
+)
+
+
+def load_text(kind: str) -> str:
+    filename, data = build_document(kind)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        text = SmartLoader().process_file(path)
+    if not isinstance(text, str):
+        raise SystemExit(f"{kind}: loader did not return text")
+    return text
+
+
+def lab_rows(text: str) -> int:
+    names = {name for name, *_ in LAB_PANEL}
+    return sum(1 for line in text.splitlines() if any(line.startswith(name) for name in names))
+
+
+def outcome(parser: LabTextParser, parsed) -> str:
+    if not parser.is_confident(parsed):
+        return "llm"
+    return "remainder" if parser.needs_llm_for_remainder(parsed) else "local"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="Parses per document (median reported)")
+    parser.add_argument("--kinds", nargs="+", choices=TEXT_KINDS, default=list(TEXT_KINDS))
+    args = parser.parse_args()
+
+    lab_parser = LabTextParser.from_env()
+    documents = []
+    for kind in args.kinds:
+        text = load_text(kind)
+        documents += [(kind, text), (kind + "+noise", text + "\n" + "\n".join(NOISE))]
+
+    print(f"{'document':<20}{'layout':<12}{'rows':>10}{'coverage':>10}  {'outcome':<11}{'tokens':>15}{'parse ms':>10}")
+    for name, text in documents:
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            parsed = lab_parser.parse(text)
+            timings.append(time.perf_counter() - start)
+        result = outcome(lab_parser, parsed)
+        sent = {"local": 0, "remainder": estimate_tokens(parsed.remainder()), "llm": estimate_tokens(text)}[result]
+        expected = lab_rows(text) + (1 if name.endswith("+noise") else 0)
+        print(f"{name:<20}{parsed.layout or '-':<12}{f'{len(parsed.rows)}/{expected}':>10}{parsed.coverage:>10.2f}  "
+              f"{result:<11}{f'{estimate_tokens(text)} -> {sent}':>15}{statistics.median(timings) * 1000:>10.2f}")
+
+    print(f"\n{'number format':<60}{'expected':>10}{'parsed':>10}")
+    failures = 0
+    for line, expected in NUMBER_CASES:
+        rows = lab_parser.parse(line).rows
+        value = rows[0].value if rows else None
+        failures += value != expected
+        print(f"{line:<60}{str(expected):>10}{str(value):>10}{'' if value == expected else '  MISMATCH'}")
+    if failures:
+        raise SystemExit(f"{failures} number format case(s) parsed wrongly")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: near-duplicate prescription matching (PerceptualIndex).
+
+Renders prescriptions on one clinic template and checks two things:
+
+- different prescriptions on the same template (other medicines, or a single
+  changed dose) must never match each other, even with identical capture
+  noise: reusing another prescription's analysis is a patient-safety bug
+- re-uploads of the same prescription (re-encoded, downscaled, brighter,
+  a PNG screenshot) should match; a second photo taken at a slightly
+  different angle is expected to miss, since the thumbnails are compared
+  pixel by pixel
+
+For every pair it prints the dHash distance, the thumbnail tile difference
+and the outcome, and exits non-zero on any false match. Thresholds come from
+the PRESCRIPTION_PHASH_* variables, as in the app.
+
+Usage (from Backend/):
+    python benchmarks/bench_perceptual_cache.py
+"""
+import io
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageEnhance
+
+from cache_store import MemoryCache, TieredCache
+from corpus import page_image
+from perceptual_cache import PerceptualIndex, hamming, tile_difference
+
+TEMPLATE_HEAD = [
+    "DR. A. MEHTA MBBS MD - CITY CARE CLINIC",
+    "12 Park Street, Kolkata    Reg. No. 45821    Ph 033-2222-1111",
+    "",
+    "Patient: ____________________    Age: ____    Date: ____________",
+    "",
+    "Rx",
+]
+TEMPLATE_FOOT = ["", "", "Signature: ______________", "Next visit after 7 days"]
+PRESCRIPTIONS = {
+    "fever": ["1. Tab Dolo 650mg      1-0-1  x 5 days", "2. Tab Pantop 40mg     1-0-0  before food",
+              "3. Syp Ascoril 10ml    1-1-1"],
+    "fever_dose": ["1. Tab Dolo 650mg      1-0-0  x 5 days", "2. Tab Pantop 40mg     1-0-0  before food",
+                   "3. Syp Ascoril 10ml    1-1-1"],
+    "diabetes": ["1. Tab Glycomet 500mg  1-0-1  after food", "2. Tab Telma 40mg      0-0-1",
+                 "3. Tab Atorva 10mg     0-0-1"],
+    "infection": ["1. Cap Amoxyclav 625mg 1-0-1  x 7 days", "2. Tab Cetirizine 10mg 0-0-1",
+                  "3. Tab Dolo 650mg      SOS"],
+}
+SIZE = (1200, 1600)
+
+
+def photo(name: str, seed: int = 0) -> Image.Image:
+    """A phone photo of prescription `name`; capture noise and tilt depend only on `seed`."""
+    lines = TEMPLATE_HEAD + PRESCRIPTIONS[name] + TEMPLATE_FOOT
+    return page_image(lines, SIZE, random.Random(seed), photo=True)
+
+
+def reencoded(image: Image.Image, fmt: str = "JPEG", **options) -> Image.Image:
+    out = io.BytesIO()
+    image.save(out, fmt, **options)
+    out.seek(0)
+    return Image.open(out)
+
+
+def retakes(image: Image.Image):
+    yield "jpeg q60", reencoded(image, quality=60)
+    yield "downscaled 50%", reencoded(image.resize((image.width // 2, image.height // 2)), quality=85)
+    yield "brighter", reencoded(ImageEnhance.Brightness(image).enhance(1.15), quality=85)
+    yield "png screenshot", reencoded(image.resize((540, 720)), "PNG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=3, help="Capture-noise seeds per prescription")
+    args = parser.parse_args()
+
+    index = PerceptualIndex.from_env()
+    print(f"dHash {index.hash_size}x{index.hash_size}, threshold {index.threshold}; "
+          f"thumbnail {index.signature_size}px, max tile difference {index.max_difference}\n")
+
+    def compare(label: str, first: Image.Image, second: Image.Image, should_match: bool) -> bool:
+        index.cache = TieredCache(MemoryCache(maxsize=10, ttl=index.ttl))
+        a, b = index.fingerprint(first), index.fingerprint(second)
+        index.add("bench", "user", a, {"name": label})
+        outcome, _ = index.lookup("bench", "user", b)
+        ok = (outcome == "hit") == should_match
+        print(f"{label:<46}{hamming(a.hash, b.hash):>6}{tile_difference(a.signature, b.signature, index.signature_size):>8}"
+              f"  {outcome:<9}{'' if ok else 'FALSE MATCH' if not should_match else 'missed'}")
+        return outcome == "hit"
+
+    print(f"{'pair':<46}{'dHash':>6}{'tiles':>8}  outcome")
+    false_matches = pairs = 0
+    names = list(PRESCRIPTIONS)
+    for seed in range(args.seeds):
+        for i, first in enumerate(names):
+            for second in names[i + 1:]:
+                pairs += 1
+                false_matches += compare(f"{first} vs {second} (seed {seed})", photo(first, seed), photo(second, seed), False)
+
+    hits = total = 0
+    for name in names:
+        original = photo(name)
+        for label, copy in retakes(original):
+            total += 1
+            hits += compare(f"{name}: {label}", original, copy, True)
+        total += 1
+        hits += compare(f"{name}: second photo", original, photo(name, seed=1), True)
+
+    print(f"\nfalse matches: {false_matches}/{pairs}   re-uploads matched: {hits}/{total}")
+    if false_matches:
+        raise SystemExit("different prescriptions matched: lower PRESCRIPTION_PHASH_MAX_DIFFERENCE")
+
+
+if __name__ == "__main__":
+    main()
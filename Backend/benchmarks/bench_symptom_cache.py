@@ -0,0 +1,109 @@
+"""
+Benchmark: symptom result cache hit rate and latency on a realistic query mix.
+
+Replays --requests symptom descriptions through DoctorAssistant.analyze
+against FakeGenaiClient. Queries are drawn Zipf-style from --common common
+complaints ("fever and headache"), each written in a random phrasing (word
+order, case, punctuation, "I have ..."), mixed with --unique-share one-off
+detailed descriptions. Three settings are compared:
+
+- off:       no cache (every request calls the model)
+- exact:     cache keyed on the case-folded, whitespace-collapsed text
+- signature: cache keyed on symptom_signature() (SYMPTOM_CACHE=1)
+
+For each: hit rate, model calls and mean/p95 latency.
+
+Usage (from Backend/):
+    python benchmarks/bench_symptom_cache.py --requests 2000 --latency fixed:0.3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# genai.Client refuses an empty key; the fake never sends it anywhere.
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+# The default governor's rate limits would throttle the replay, not the cache
+os.environ["GEMINI_RPM"] = "0"
+os.environ["GEMINI_TPM"] = "0"
+
+from fake_genai import FakeGenaiClient, LatencyModel, PassThroughFlight
+from cache_store import MemoryCache, TieredCache
+from doctor_agent import DoctorAssistant
+
+SYMPTOMS = ["fever", "dry cough", "sore throat", "headache", "runny nose", "fatigue", "body ache", "nausea",
+            "dizziness", "chest tightness", "sneezing", "chills", "loss of appetite", "vomiting", "diarrhea",
+            "back pain", "joint pain", "rash", "itching", "stomach pain"]
+OPENERS = ("", "", "I have ", "i have ", "Having ", "I am suffering from ", "I feel ")
+JOINERS = (" and ", ", ", " & ", ", and ")
+DETAILS = ("since yesterday", "for 3 days", "after eating out", "worse at night", "with a temperature of 101F",
+           "after a long flight", "that started this morning", "for two weeks")
+
+
+class ExactTextAssistant(DoctorAssistant):
+    """DoctorAssistant whose cache key is the literal text (case and whitespace folded), for comparison."""
+
+    def _cache_key(self, symptoms):
+        return f"exact|{self.model}|{' '.join(symptoms.casefold().split())}" if self.cache is not None else None
+
+
+def phrase(words, rng: random.Random) -> str:
+    words = list(words)
+    rng.shuffle(words)
+    text = words[0] if len(words) == 1 else rng.choice(JOINERS).join(words[:-1]) + rng.choice(JOINERS) + words[-1]
+    text = rng.choice(OPENERS) + text + rng.choice(("", "", ".", "!"))
+    return text.capitalize() if rng.random() < 0.5 else text
+
+
+def workload(requests: int, common: int, unique_share: float, rng: random.Random):
+    complaints = [tuple(rng.sample(SYMPTOMS, rng.randint(1, 3))) for _ in range(common)]
+    weights = [1 / (rank + 1) for rank in range(common)]
+    queries = []
+    for _ in range(requests):
+        if rng.random() < unique_share:
+            queries.append(phrase(rng.sample(SYMPTOMS, rng.randint(2, 4)), rng) + " " + rng.choice(DETAILS))
+        else:
+            queries.append(phrase(rng.choices(complaints, weights)[0], rng))
+    return queries
+
+
+def run(assistant_class, cached: bool, queries, latency: str) -> dict:
+    client = FakeGenaiClient(LatencyModel(latency))
+    cache = TieredCache(MemoryCache(maxsize=5000, ttl=86400)) if cached else None
+    assistant = assistant_class(single_flight=PassThroughFlight(), cache=cache)
+    assistant.client = client
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        assistant.analyze(query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    stats = assistant.cache_stats() or {}
+    return {"hit_rate": stats.get("hit_rate") or 0.0, "calls": len(client.calls["symptoms"]),
+            "mean_ms": statistics.fmean(timings) * 1000, "p95_ms": timings[int(len(timings) * 0.95)] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--common", type=int, default=40, help="Distinct common complaints")
+    parser.add_argument("--unique-share", type=float, default=0.2, help="Share of one-off detailed descriptions")
+    parser.add_argument("--latency", default="fixed:0.01", help="Simulated model latency (LatencyModel spec)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queries = workload(args.requests, args.common, args.unique_share, random.Random(args.seed))
+    print(f"{args.requests} requests, {len(set(queries))} distinct texts, latency {args.latency}\n")
+    print(f"{'cache':<11}{'hit rate':>9}{'calls':>7}{'mean ms':>9}{'p95 ms':>8}")
+    for label, assistant_class, cached in (("off", DoctorAssistant, False), ("exact", ExactTextAssistant, True),
+                                           ("signature", DoctorAssistant, True)):
+        result = run(assistant_class, cached, queries, args.latency)
+        print(f"{label:<11}{result['hit_rate']:>9.1%}{result['calls']:>7}{result['mean_ms']:>9.1f}{result['p95_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
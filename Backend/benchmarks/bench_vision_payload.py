@@ -0,0 +1,146 @@
+"""
+Benchmark: Vision payload size, upload time and token estimate, before/after ImageOptimizer.
+
+Generates a fixture set of prescription-like images (12 MP phone photos as
+JPEG and PNG, one with an EXIF rotation, plus a small screenshot), runs each
+through PrescriptionReaderAgent with a stubbed model that records the
+payload, and reports bytes, simulated upload time, estimated image tokens
+and a fidelity check (PSNR against the original at the optimized size).
+
+Usage (from Backend/):
+    python benchmarks/bench_vision_payload.py --bandwidth-mbps 10
+"""
+import os
+import io
+import sys
+import math
+import json
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-stub-key")
+
+from PIL import Image, ImageDraw, ImageChops, ImageFilter, ImageOps, ImageStat
+from image_optimizer import ImageOptimizer
+from prescription_reader import PrescriptionReaderAgent
+
+
+def make_photo(width: int, height: int, seed: int) -> Image.Image:
+    """Paper-on-desk style photo: noisy background, slightly tinted page, handwritten-ish lines."""
+    rnd = random.Random(seed)
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    base = Image.blend(Image.new("RGB", (width, height), (196, 170, 140)), noise, 0.25)
+    draw = ImageDraw.Draw(base)
+    margin_x, margin_y = width // 10, height // 12
+    draw.rectangle([margin_x, margin_y, width - margin_x, height - margin_y], fill=(244, 242, 236))
+    y = margin_y + 80
+    for line in ["Rx", "Paracetamol 500 mg  1-0-1", "Amoxicillin 250 mg caps  1-1-1", "Cetirizine 10 mg  0-0-1"] * 4:
+        draw.text((margin_x + 60 + rnd.randint(-10, 10), y), line, fill=(20, 30, 90), font_size=max(24, height // 40))
+        y += height // 22
+    return base.filter(ImageFilter.GaussianBlur(0.6))
+
+
+def encode(image: Image.Image, fmt: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def build_fixtures():
+    photo = make_photo(4032, 3024, seed=1)
+    rotated = photo.rotate(90, expand=True)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # camera held sideways; viewer must rotate 90 degrees clockwise
+    screenshot = make_photo(1170, 2532, seed=2).resize((1170, 2532))
+    return [
+        ("photo_12mp.jpg", encode(photo, "JPEG", quality=95)),
+        ("photo_12mp.png", encode(photo, "PNG")),
+        ("photo_12mp_exif_rotated.jpg", encode(rotated, "JPEG", quality=95, exif=exif)),
+        ("screenshot.png", encode(screenshot, "PNG")),
+    ]
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Gemini bills 258 tokens for small images, otherwise 258 per 768x768 tile."""
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def psnr(reference: Image.Image, candidate: Image.Image) -> float:
+    """Luma PSNR of the payload against the upright original at the payload's size."""
+    reference = ImageOps.exif_transpose(reference).convert("L").resize(candidate.size, Image.Resampling.LANCZOS)
+    diff = ImageChops.difference(reference, candidate.convert("L"))
+    mse = ImageStat.Stat(diff).rms[0] ** 2
+    return float("inf") if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+class LegacyEncoder:
+    """The pre-optimizer behaviour: re-save in the original format with Pillow defaults."""
+
+    def optimize(self, image, original_size=None, label="image"):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image.format or "JPEG")
+        return buffer.getvalue(), f"image/{(image.format or 'jpeg').lower()}"
+
+
+class RecordingModels:
+    """Stubbed model: records the image payload and returns a fixed extraction."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def generate_content(self, model, contents, config=None):
+        part = contents[1]
+        self.payloads.append((part.inline_data.data, part.inline_data.mime_type))
+        return SimpleNamespace(text=json.dumps({"medicines": [{"name": "Paracetamol 500 mg", "form": "Tablets"}]}))
+
+
+def run(label: str, fixtures, optimizer, bandwidth_mbps: float):
+    agent = PrescriptionReaderAgent(image_optimizer=optimizer)
+    models = RecordingModels()
+    agent.client = SimpleNamespace(models=models)
+
+    print(f"\n== {label} ==", flush=True)
+    print(f"{'fixture':32} {'orig KB':>9} {'sent KB':>9} {'upload ms':>10} {'tokens':>7} {'prep ms':>8} {'PSNR dB':>8}")
+    totals = [0, 0, 0]
+    for name, data in fixtures:
+        start = time.perf_counter()
+        result = agent._extract_medicines(agent._open_image(data), len(data))
+        prep_ms = (time.perf_counter() - start) * 1000
+        assert "error" not in result, result
+
+        payload, _ = models.payloads[-1]
+        sent = Image.open(io.BytesIO(payload))
+        original = Image.open(io.BytesIO(data))
+        upload_ms = len(payload) * 8 / (bandwidth_mbps * 1e6) * 1000
+        tokens = estimate_image_tokens(*sent.size)
+        totals[0] += len(data)
+        totals[1] += len(payload)
+        totals[2] += upload_ms
+        print(f"{name:32} {len(data) / 1024:9.0f} {len(payload) / 1024:9.0f} {upload_ms:10.0f} {tokens:7d} {prep_ms:8.0f} {psnr(original, sent):8.1f}")
+    print(f"{'TOTAL':32} {totals[0] / 1024:9.0f} {totals[1] / 1024:9.0f} {totals[2]:10.0f}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bandwidth-mbps", type=float, default=10.0, help="Simulated uplink to the Gemini API")
+    args = parser.parse_args()
+
+    fixtures = build_fixtures()
+    baseline = run("legacy re-encode (original format, no resize)", fixtures, LegacyEncoder(), args.bandwidth_mbps)
+    optimized = run("ImageOptimizer defaults", fixtures, ImageOptimizer(), args.bandwidth_mbps)
+    documents = run("document mode (grayscale + autocontrast, WebP)", fixtures,
+                    ImageOptimizer(output_format="WEBP", grayscale=True, autocontrast=True), args.bandwidth_mbps)
+
+    for label, totals in (("defaults", optimized), ("document mode", documents)):
+        print(f"\n{label}: {100 * (1 - totals[1] / baseline[1]):.0f}% fewer bytes, "
+              f"{baseline[2] - totals[2]:.0f} ms less simulated upload time across the set")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Synthetic document corpus for offline benchmarks.
+
+Builds lab reports in every format the loaders accept, in memory and
+deterministically from a seed:
+
+- text PDFs (small and long), written directly as PDF objects so no PDF
+  library is needed
+- scanned PDFs (page images only) and mixed PDFs (text pages + scans)
+- DOCX reports with a results table
+- phone photos (large JPEG) and screenshots (small PNG) of a report
+- plain-text reports
+
+No real patient data is involved.
+"""
+import io
+import random
+from typing import Dict, List, Tuple
+
+LAB_PANEL = [
+    ("Hemoglobin", "g/dL", 12.0, 17.5), ("WBC", "10^3/uL", 4.0, 11.0), ("Platelets", "10^3/uL", 150, 450),
+    ("Glucose (Fasting)", "mg/dL", 70, 100), ("HbA1c", "%", 4.0, 5.6), ("Total Cholesterol", "mg/dL", 125, 200),
+    ("LDL", "mg/dL", 0, 100), ("HDL", "mg/dL", 40, 60), ("Triglycerides", "mg/dL", 0, 150),
+    ("Creatinine", "mg/dL", 0.6, 1.3), ("Urea", "mg/dL", 15, 45), ("ALT", "U/L", 7, 56), ("AST", "U/L", 10, 40),
+    ("TSH", "uIU/mL", 0.4, 4.0), ("Vitamin D", "ng/mL", 30, 100), ("Sodium", "mmol/L", 135, 145),
+    ("Potassium", "mmol/L", 3.5, 5.1), ("Calcium", "mg/dL", 8.5, 10.5),
+]
+
+# Corpus entry kinds, each with (filename, generator kwargs)
+KINDS = {
+    "text_pdf": ("report.pdf", {"pages": 2}),
+    "text_pdf_long": ("report_long.pdf", {"pages": 25}),
+    "scanned_pdf": ("scan.pdf", {"pages": 3}),
+    "mixed_pdf": ("mixed.pdf", {"text_pages": 2, "scanned_pages": 2}),
+    "docx": ("report.docx", {"rows": 18}),
+    "photo_jpeg": ("photo.jpg", {"size": (4032, 3024)}),
+    "screenshot_png": ("screenshot.png", {"size": (1080, 1920)}),
+    "text": ("report.txt", {}),
+}
+
+# Files the prescription route accepts
+PRESCRIPTION_KINDS = ("photo_jpeg", "screenshot_png")
+
+
+def report_lines(rng: random.Random, rows: int = len(LAB_PANEL), page: int = 1) -> List[str]:
+    """One page of a lab report as plain text lines."""
+    lines = [
+        "CITY DIAGNOSTICS LABORATORY",
+        f"Patient: Test Patient {rng.randint(100, 999)}    MRN: {rng.randint(100000, 999999)}    Page {page}",
+        "Collected: 2024-05-01    Reported: 2024-05-02    Ref. by: Dr. Bench",
+        "",
+        f"{'TEST':<22}{'RESULT':>10}  {'UNIT':<10}{'REFERENCE':<14}FLAG",
+    ]
+    for i in range(rows):
+        name, unit, low, high = LAB_PANEL[i % len(LAB_PANEL)]
+        value = round(rng.uniform(low * 0.7, high * 1.3), 1)
+        flag = "H" if value > high else "L" if value < low else ""
+        lines.append(f"{name:<22}{value:>10}  {unit:<10}{f'{low}-{high}':<14}{flag}")
+    lines += ["", "Interpretation: values flagged H/L are outside the reference range.", "*** End of page ***"]
+    return lines
+
+
+def text_pdf(pages: List[List[str]]) -> bytes:
+    """Minimal PDF 1.4 with one Helvetica text stream per page."""
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree id is known
+    pages_id = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in pages:
+        text = ["BT /F1 10 Tf 14 TL 50 780 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            text.append(f"({escaped}) Tj T*")
+        text.append("ET")
+        stream = "\n".join(text).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+    return out.getvalue()
+
+
+def page_image(lines: List[str], size: Tuple[int, int], rng: random.Random, photo: bool = False):
+    """Renders report lines onto a page image; `photo` adds the tint and noise of a phone capture."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    width, height = size
+    background = (236, 230, 214) if photo else (255, 255, 255)
+    image = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(image)
+    step = max(12, height // (len(lines) + 10))
+    scale = max(1, width // 600)
+    for row, line in enumerate(lines):
+        y = step * (row + 3)
+        # Default bitmap font is tiny; draw onto a strip and scale it up for large pages
+        strip = Image.new("L", (len(line) * 6 + 4, 12), 255)
+        ImageDraw.Draw(strip).text((2, 0), line, fill=0)
+        strip = strip.resize((strip.width * scale, strip.height * scale))
+        image.paste((20, 20, 20), (width // 12, y), strip.point(lambda p: 255 - p))
+    if photo:
+        for _ in range(400):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.point((x, y), fill=(rng.randint(150, 200),) * 3)
+        image = image.rotate(rng.uniform(-2, 2), expand=False, fillcolor=background).filter(ImageFilter.GaussianBlur(1))
+    return image
+
+
+def scanned_pdf(pages: List[List[str]], rng: random.Random, dpi: int = 150) -> bytes:
+    """Image-only PDF, as produced by a scanner (A4 at `dpi`)."""
+    size = (int(8.27 * dpi), int(11.69 * dpi))
+    images = [page_image(lines, size, rng, photo=True).convert("L") for lines in pages]
+    out = io.BytesIO()
+    images[0].save(out, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+
+def mixed_pdf(text_pages: List[List[str]], scanned_pages: List[List[str]], rng: random.Random) -> bytes:
+    """Text pages followed by scanned pages, like a report with attached scans."""
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for data in (text_pdf(text_pages), scanned_pdf(scanned_pages, rng)):
+        for page in PdfReader(io.BytesIO(data)).pages:
+            writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def docx_report(rng: random.Random, rows: int) -> bytes:
+    from docx import Document
+
+    document = Document()
+    lines = report_lines(rng, rows)
+    for line in lines[:3]:
+        document.add_paragraph(line)
+    table = document.add_table(rows=1, cols=4)
+    for cell, title in zip(table.rows[0].cells, ("Test", "Result", "Unit", "Reference")):
+        cell.text = title
+    for i in range(rows):
+        name, unit, low, high = LAB_PANEL[i % len(LAB_PANEL)]
+        for cell, value in zip(table.add_row().cells, (name, str(round(rng.uniform(low, high * 1.2), 1)), unit, f"{low}-{high}")):
+            cell.text = value
+    document.add_paragraph(lines[-2])
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def image_report(rng: random.Random, size: Tuple[int, int], fmt: str) -> bytes:
+    out = io.BytesIO()
+    image = page_image(report_lines(rng), size, rng, photo=fmt == "JPEG")
+    image.save(out, fmt, **({"quality": 92} if fmt == "JPEG" else {"optimize": True}))
+    return out.getvalue()
+
+
+def build_document(kind: str, seed: int = 0) -> Tuple[str, bytes]:
+    """Returns (filename, bytes) for one corpus entry of `kind`."""
+    filename, options = KINDS[kind]
+    rng = random.Random(f"{kind}:{seed}")
+    if kind.startswith("text_pdf"):
+        data = text_pdf([report_lines(rng, page=p + 1) for p in range(options["pages"])])
+    elif kind == "scanned_pdf":
+        data = scanned_pdf([report_lines(rng, page=p + 1) for p in range(options["pages"])], rng)
+    elif kind == "mixed_pdf":
+        data = mixed_pdf(
+            [report_lines(rng, page=p + 1) for p in range(options["text_pages"])],
+            [report_lines(rng, page=p + 1) for p in range(options["scanned_pages"])],
+            rng,
+        )
+    elif kind == "docx":
+        data = docx_report(rng, options["rows"])
+    elif kind == "photo_jpeg":
+        data = image_report(rng, options["size"], "JPEG")
+    elif kind == "screenshot_png":
+        data = image_report(rng, options["size"], "PNG")
+    else:
+        data = "\n".join(report_lines(rng)).encode("utf-8")
+    return filename, data
+
+
+def build_corpus(kinds=None, variants: int = 1) -> Dict[str, List[Tuple[str, bytes]]]:
+    """
+    {kind: [(filename, bytes), ...]} with `variants` distinct documents per kind.
+
+    Variants differ in content (and so in SHA-256), which keeps content-hash
+    caches from turning repeated uploads into hits.
+    """
+    return {kind: [build_document(kind, seed) for seed in range(variants)] for kind in (kinds or KINDS)}
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    target = sys.argv[1] if len(sys.argv) > 1 else "benchmark_corpus"
+    os.makedirs(target, exist_ok=True)
+    for kind, documents in build_corpus().items():
+        for filename, data in documents:
+            path = os.path.join(target, f"{kind}_{filename}")
+            with open(path, "wb") as f:
+                f.write(data)
+            print(f"{len(data) / 1024:10.1f} KB  {path}")
@@ -0,0 +1,297 @@
+"""
+Fake google-genai client for offline benchmarks.
+
+Answers generate_content (sync, async and streaming) with schema-valid JSON
+for every agent, after sleeping for a latency drawn from a configurable
+distribution. Responses carry usage_metadata like the real API, so the
+governor and any token accounting behave as in production.
+
+Plug it in with `install_fake_client(app_module, FakeGenaiClient(...))`.
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# Call kinds, used for per-kind latency overrides and stage reporting
+KINDS = ("extraction", "consultation", "symptoms", "prescription_ocr", "prescription_knowledge")
+
+
+class LatencyModel:
+    """
+    Seconds to wait per simulated call.
+
+    Spec strings: "zero", "fixed:S", "uniform:MIN:MAX", "lognormal:MEDIAN:SIGMA"
+    (seconds; lognormal gives the long right tail real LLM calls show).
+    """
+
+    def __init__(self, spec: str = "lognormal:0.5:0.35", seed: Optional[int] = None):
+        self.spec = spec
+        parts = spec.split(":")
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        expected = {"zero": 0, "fixed": 1, "uniform": 2, "lognormal": 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError(f"Invalid latency spec '{spec}'. Use zero, fixed:S, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA.")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "zero":
+                return 0.0
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._random.uniform(*self.params)
+            median, sigma = self.params
+            return self._random.lognormvariate(0, sigma) * median
+
+
+def _text_of(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_text_of(item) for item in contents)
+    return getattr(contents, "text", None) or ""
+
+
+def _has_inline_data(contents: Any) -> bool:
+    if isinstance(contents, (list, tuple)):
+        return any(_has_inline_data(item) for item in contents)
+    return getattr(contents, "inline_data", None) is not None
+
+
+def _prompt_tokens(contents: Any) -> int:
+    if isinstance(contents, (list, tuple)):
+        return sum(_prompt_tokens(item) for item in contents)
+    if getattr(contents, "inline_data", None) is not None:
+        return 258
+    return max(1, len(_text_of(contents)) // 4)
+
+
+def classify(contents: Any, config: Any) -> str:
+    """Which agent call this is, from the response schema and prompt."""
+    schema = getattr(config, "response_schema", None)
+    name = getattr(schema, "__name__", "")
+    if name == "MedicalRecord":
+        return "extraction"
+    if name == "ConsultationSummaryJSON":
+        return "consultation"
+    if name == "SymptomAnalysisResult":
+        return "symptoms"
+    if _has_inline_data(contents):
+        return "prescription_ocr"
+    if "INPUT:" in _text_of(contents):
+        return "prescription_knowledge"
+    return "consultation"
+
+
+# --- Schema-valid response builders ---
+
+LAB_ITEMS = ["Hemoglobin", "WBC", "Platelets", "Glucose", "HbA1c", "LDL", "HDL", "Triglycerides",
+             "Creatinine", "ALT", "AST", "TSH", "Vitamin D", "Sodium", "Potassium", "Urea"]
+MEDICINES = [("Paracetamol 500mg", "Tablets"), ("Amoxicillin 250mg", "Capsules"), ("Cetirizine", "Tablets"),
+             ("Pantoprazole 40mg", "Tablets"), ("Azithromycin", "Tablets"), ("Cough Syrup DX", "Syrup"),
+             ("Clotrimazole", "Cream"), ("Ciprofloxacin", "Drops")]
+
+
+def medical_record(prompt_tokens: int, rng: random.Random) -> str:
+    from multimodel_medical_agent import MedicalRecord
+
+    rows = min(40, 3 + prompt_tokens // 200)
+    results = []
+    for i in range(rows):
+        item = LAB_ITEMS[i % len(LAB_ITEMS)] + ("" if i < len(LAB_ITEMS) else f" ({i // len(LAB_ITEMS) + 1})")
+        results.append({"item": item, "value": round(rng.uniform(1, 300), 1), "unit": "mg/dL",
+                        "flag": rng.choice(["High", "Low", "Normal", "Normal"])})
+    record = MedicalRecord.model_validate({
+        "meta": {"doc_type": "Diagnostic", "confidence": 0.93},
+        "patient": {"name": "Test Patient", "id": "MRN-0001", "dob": "1980-01-01"},
+        "provider": {"name": "Dr. Bench", "facility": "Offline Lab"},
+        "content": {"diagnostic": {"test_name": "Comprehensive Panel", "collection_date": "2024-05-01", "results": results}},
+        "summary": f"Panel with {rows} results; {sum(r['flag'] != 'Normal' for r in results)} outside the reference range.",
+    })
+    return record.model_dump_json()
+
+
+def consultation_summary(rng: random.Random) -> str:
+    from patient_advisor import ConsultationSummaryJSON
+
+    findings = [{"parameter_name": item, "status": rng.choice(["High", "Low", "Normal"]),
+                 "interpretation": f"{item} is outside the usual range; discuss it with your doctor."}
+                for item in rng.sample(LAB_ITEMS, 4)]
+    return ConsultationSummaryJSON.model_validate({
+        "overall_summary": "Most values are in range. A few findings need follow-up with your doctor.",
+        "key_findings": findings,
+        "lifestyle_recommendations": ["Walk 30 minutes daily.", "Limit fried and sugary food.", "Sleep 7-8 hours."],
+        "when_to_see_doctor": ["Chest pain or shortness of breath.", "Persistent fatigue for more than two weeks."],
+    }).model_dump_json()
+
+
+def symptom_analysis(rng: random.Random) -> str:
+    from doctor_agent import SymptomAnalysisResult
+
+    return SymptomAnalysisResult.model_validate({
+        "disclaimer_and_urgency": "This is not a diagnosis. Seek emergency care for chest pain or difficulty breathing.",
+        "current_condition_analysis": "The symptoms suggest a mild viral infection with inflammation of the airways.",
+        "possible_medical_problems": rng.sample(["Common cold", "Influenza", "Sinusitis", "Bronchitis", "Allergic rhinitis"], 3),
+        "immediate_actions": ["Rest and stay hydrated.", "Monitor your temperature twice a day."],
+        "recommended_specialist": "General Practitioner (GP)",
+        "final_statement": "Connect the doctor/hospital near your location.",
+    }).model_dump_json()
+
+
+def prescription_ocr(rng: random.Random) -> str:
+    medicines = rng.sample(MEDICINES, rng.randint(2, 5))
+    return json.dumps({"medicines": [{"name": name, "form": form} for name, form in medicines]})
+
+
+def prescription_knowledge(prompt: str) -> str:
+    # Explain exactly the medicines the agent asked about, keyed by name
+    start = prompt.index("INPUT:") + len("INPUT:")
+    data, _ = json.JSONDecoder().raw_decode(prompt[start:].lstrip())
+    return json.dumps({
+        medicine.get("name", "Unknown"): {
+            "purpose": "Relieves the symptoms it was prescribed for.",
+            "side_effects": "Nausea, dizziness, headache.",
+            "interactions": "Avoid alcohol while taking it.",
+        }
+        for medicine in data.get("medicines", [])
+    })
+
+
+class FakeModels:
+    """Implements models.generate_content; `aio` wraps it with the async signatures."""
+
+    def __init__(self, owner: "FakeGenaiClient"):
+        self.owner = owner
+
+    def generate_content(self, model: str, contents: Any, config: Any = None) -> Any:
+        kind, delay = self.owner.plan(contents, config)
+        time.sleep(delay)
+        return self.owner.respond(kind, model, contents, delay)
+
+
+class FakeAsyncModels:
+    def __init__(self, owner: "FakeGenaiClient"):
+        self.owner = owner
+
+    async def generate_content(self, model: str, contents: Any, config: Any = None) -> Any:
+        kind, delay = self.owner.plan(contents, config)
+        await asyncio.sleep(delay)
+        return self.owner.respond(kind, model, contents, delay)
+
+    async def generate_content_stream(self, model: str, contents: Any, config: Any = None) -> Any:
+        kind, delay = self.owner.plan(contents, config)
+        response = self.owner.respond(kind, model, contents, delay)
+        chunk_size = self.owner.stream_chunk_chars
+        chunks = [response.text[i:i + chunk_size] for i in range(0, len(response.text), chunk_size)] or [""]
+
+        async def stream():
+            # Time to first chunk ~ half the call, the rest spread over the chunks
+            await asyncio.sleep(delay / 2)
+            for index, text in enumerate(chunks):
+                if index:
+                    await asyncio.sleep(delay / 2 / len(chunks))
+                last = index == len(chunks) - 1
+                yield SimpleNamespace(text=text, usage_metadata=response.usage_metadata if last else None)
+
+        return stream()
+
+
+class FakeGenaiClient:
+    """
+    Drop-in stand-in for genai.Client (models / aio.models) with simulated latency.
+
+    Args:
+        latency: Default LatencyModel for every call.
+        overrides: Per-kind LatencyModels (keys from KINDS).
+        seed: Seed for the generated content.
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None, overrides: Optional[Dict[str, LatencyModel]] = None,
+                 seed: int = 7, stream_chunk_chars: int = 24):
+        self.latency = latency or LatencyModel()
+        self.overrides = overrides or {}
+        self.stream_chunk_chars = stream_chunk_chars
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, List[float]] = {kind: [] for kind in KINDS}
+        self.models = FakeModels(self)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self))
+
+    def plan(self, contents: Any, config: Any):
+        kind = classify(contents, config)
+        return kind, self.overrides.get(kind, self.latency).sample()
+
+    def respond(self, kind: str, model: str, contents: Any, delay: float) -> Any:
+        prompt_tokens = _prompt_tokens(contents)
+        with self._lock:
+            self.calls[kind].append(delay)
+            rng = random.Random(self._random.random())
+        if kind == "extraction":
+            text = medical_record(prompt_tokens, rng)
+        elif kind == "consultation":
+            text = consultation_summary(rng)
+        elif kind == "symptoms":
+            text = symptom_analysis(rng)
+        elif kind == "prescription_ocr":
+            text = prescription_ocr(rng)
+        else:
+            text = prescription_knowledge(_text_of(contents))
+        output_tokens = max(1, len(text) // 4)
+        return SimpleNamespace(
+            text=text,
+            model_version=model,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = {kind: [] for kind in KINDS}
+
+
+def parse_latency_args(specs: List[str], seed: int):
+    """["lognormal:0.5:0.3", "extraction=fixed:1.2"] -> (default LatencyModel, {kind: LatencyModel})."""
+    default, overrides = LatencyModel(seed=seed), {}
+    for offset, spec in enumerate(specs or []):
+        if "=" in spec:
+            kind, spec = spec.split("=", 1)
+            if kind not in KINDS:
+                raise ValueError(f"Unknown call kind '{kind}'. Choose from: {', '.join(KINDS)}.")
+            overrides[kind] = LatencyModel(spec, seed=seed + offset + 1)
+        else:
+            default = LatencyModel(spec, seed=seed)
+    return default, overrides
+
+
+def install_fake_client(app_module: Any, client: FakeGenaiClient, coalesce: bool = True) -> None:
+    """
+    Builds every agent in `app_module` and points it at `client`.
+
+    With coalesce=False, the agents' single-flight layer is bypassed so that
+    repeated corpus files each cost a full pipeline run.
+    """
+    for name in app_module.AGENT_CLASSES:
+        agent = app_module.get_agent(name)
+        agent.client = client
+        if not coalesce:
+            agent.single_flight = PassThroughFlight()
+
+
+class PassThroughFlight:
+    """SingleFlight stand-in that never coalesces."""
+
+    def do(self, key, fn, result_type=None):
+        return fn()
+
+    async def do_async(self, key, fn, result_type=None):
+        return await fn()
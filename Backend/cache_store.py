@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional
+from cachetools import TTLCache
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU tier with TTL and size-based eviction.
+
+    `maxsize` is measured with `getsizeof` (defaults to one unit per entry),
+    so passing `getsizeof=len` bounds the tier by total string length.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600, getsizeof: Optional[Callable[[Any], int]] = None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            try:
+                self._cache[key] = value
+            except ValueError:
+                # Single value larger than the whole tier; never cache it.
+                pass
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._cache),
+                "size": self._cache.currsize,
+                "maxsize": self._cache.maxsize,
+            }
+
+
+class SQLiteCache:
+    """
+    On-disk tier shared by every worker process on the host.
+
+    Values are stored as text. Expired rows are skipped on read and purged on
+    write; when the table grows past `max_entries` the least recently used
+    rows are deleted.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, max_entries: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets gunicorn workers read while another writes.
+        # Connections are never reused across a fork (e.g. agents preloaded in the master).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite read failed: {e}")
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            conn.execute("DELETE FROM cache WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite write failed: {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"[Cache] SQLite delete failed: {e}")
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM cache")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "path": self.path,
+        }
+
+
+class TieredCache:
+    """
+    Memory tier in front of an optional disk tier.
+
+    Reads check memory first, then disk (promoting disk hits into memory).
+    Writes go to both tiers. Values must be strings when a disk tier is used.
+    """
+
+    def __init__(self, memory: MemoryCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+def tiered_cache_from_env(prefix: str, maxsize: int = 256, ttl: float = 3600, getsizeof: Optional[Callable[[Any], int]] = None) -> TieredCache:
+    """
+    Builds a TieredCache configured from environment variables:
+
+    - {prefix}_CACHE_MAXSIZE: memory tier capacity (entries, or units of `getsizeof`)
+    - {prefix}_CACHE_TTL: entry lifetime in seconds (both tiers)
+    - {prefix}_CACHE_PATH: SQLite file for the shared disk tier (disabled when unset)
+    - {prefix}_CACHE_DISK_ENTRIES: disk tier capacity in entries
+    """
+    maxsize = int(os.getenv(f"{prefix}_CACHE_MAXSIZE", maxsize))
+    ttl = float(os.getenv(f"{prefix}_CACHE_TTL", ttl))
+    memory = MemoryCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+
+    disk = None
+    path = os.getenv(f"{prefix}_CACHE_PATH")
+    if path:
+        disk_entries = int(os.getenv(f"{prefix}_CACHE_DISK_ENTRIES", 5000))
+        disk = SQLiteCache(path, ttl=ttl, max_entries=disk_entries)
+
+    return TieredCache(memory, disk)
@@ -1,10 +1,18 @@
 import os
-import json
+import re
+import time
+import contextlib
 from dotenv import load_dotenv
-from google import genai
 from google.genai import types
 from pydantic import BaseModel, Field # NEW: Import Pydantic
-from typing import List, Optional # NEW: Import List
+from typing import Any, AsyncIterator, List, Optional, Tuple # NEW: Import List
+from sse_stream import JsonFieldStream
+from cache_store import TieredCache, tiered_cache_from_env
+from genai_client import get_genai_client
+from gemini_governor import GeminiGovernor, default_governor
+from single_flight import SingleFlight, default_single_flight, flight_key
+from structured_output import ModelCallError, ModelOutputError, parse_response, validate_json
+import telemetry
 
 load_dotenv()
 
@@ -19,6 +27,46 @@ class SymptomAnalysisResult(BaseModel):
     recommended_specialist: str = Field(..., description="The most appropriate specialist or hospital department to visit.")
     final_statement: str = Field(..., description="Must be the exact phrase: 'Connect the doctor/hospital near your location.'")
 
+# --- Symptom signature (result cache key) ---
+
+# Changes whenever the prompt or SymptomAnalysisResult changes, so cached
+# results from older versions are not served
+SYMPTOM_CACHE_VERSION = "2"
+
+# Function words and pronouns only. Severity ("very", "slight") and duration
+# ("for", "since", "ago") words stay in the signature: "slight chest pain" and
+# "very severe chest pain" need different triage.
+SYMPTOM_STOP_WORDS = frozenset("""
+a an the and or nor but i me my myself im you your he she him her his it its we us our they them their
+this that these those am is are was were be been being have has had having do does did
+m s ve re ll d with of to in on at by some any
+""".split())
+# A negation binds to the next content word and to words joined to it by
+# "or"/"nor" ("no fever or chills"), so "no fever, headache" and
+# "fever, no headache" keep different signatures
+NEGATIONS = frozenset({"no", "not", "without", "never", "denies", "deny"})
+
+
+def symptom_signature(symptoms: str) -> str:
+    """
+    Order- and phrasing-insensitive form of a symptom description:
+    "Fever and headache!" and "headache, fever" both give "fever headache".
+    Returns "" when nothing but stop words remain.
+    """
+    text = re.sub(r"n['\u2019]t\b", " not", symptoms.casefold())
+    words = set()
+    negated = last_negated = False
+    for token in re.findall(r"[a-z0-9]+", text):
+        if token in NEGATIONS:
+            negated = True
+        elif token in ("or", "nor"):
+            negated = negated or last_negated
+        elif token not in SYMPTOM_STOP_WORDS:
+            words.add("no-" + token if negated else token)
+            negated, last_negated = False, negated
+    return " ".join(sorted(words))
+
+
 class DoctorAssistant:
     """
     AI Agent for preliminary symptom analysis and guidance.
@@ -26,23 +74,66 @@ class DoctorAssistant:
     a safe, structured, non-diagnostic response.
     """
 
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
+    def __init__(self, model_name: str = "gemini-2.5-flash", governor: Optional[GeminiGovernor] = None,
+                 single_flight: Optional[SingleFlight] = None, cache: Optional[TieredCache] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = get_genai_client(self.api_key)
         self.model = model_name
+        # Shared rate limits, retries and circuit breaker for outbound Gemini calls
+        self.governor = governor or default_governor
+        # Concurrent identical symptom strings share one call
+        self.single_flight = single_flight or default_single_flight
+        # Opt-in (SYMPTOM_CACHE=1) results keyed on the normalized symptom
+        # signature, so "fever and headache" and "Headache, fever" share one call
+        if cache is None and os.getenv("SYMPTOM_CACHE", "0") == "1":
+            cache = tiered_cache_from_env("SYMPTOM", maxsize=5000, ttl=86400)
+        self.cache = cache
 
-    def analyze(self, symptoms: str) -> str:
-        """
-        Analyzes user-provided symptoms and generates a structured advisory response in JSON format.
-        
-        Args:
-            symptoms: A string describing the user's symptoms.
-            
-        Returns:
-            A JSON string conforming to the SymptomAnalysisResult schema.
-        """
-        
-        prompt = f"""
+    def _cache_key(self, symptoms: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        signature = symptom_signature(symptoms)
+        return f"symptom:{SYMPTOM_CACHE_VERSION}|{self.model}|{signature}" if signature else None
+
+    def _cached(self, cache_key: Optional[str]) -> Optional[SymptomAnalysisResult]:
+        if cache_key is None:
+            return None
+        with telemetry.span("cache", agent="symptom"):
+            cached = self.cache.get(cache_key)
+            try:
+                result = validate_json(SymptomAnalysisResult, cached) if cached is not None else None
+            except ModelOutputError as e:
+                # Corrupt or written by an older schema: drop it and analyze again
+                print(f"[Cache] Discarding invalid symptom cache entry: {e.message}")
+                self.cache.delete(cache_key)
+                result = None
+        telemetry.record_symptom_cache("hit" if result is not None else "miss")
+        return result
+
+    def _store(self, cache_key: Optional[str], result: SymptomAnalysisResult) -> SymptomAnalysisResult:
+        # Only validated results reach the cache
+        if cache_key is not None:
+            self.cache.set(cache_key, result.model_dump_json())
+        return result
+
+    def cache_stats(self) -> Optional[dict]:
+        """Lookups served from the cache (memory or disk tier) and the hit rate; None when caching is off."""
+        if self.cache is None:
+            return None
+        stats = self.cache.stats()
+        memory, disk = stats["memory"], stats.get("disk")
+        hits = memory["hits"] + (disk["hits"] if disk else 0)
+        # A memory miss that the disk tier serves is a hit
+        misses = disk["misses"] if disk else memory["misses"]
+        return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+                "entries": memory["entries"]}
+
+    def _flight_key(self, symptoms: str) -> str:
+        # Case and whitespace differences do not change the analysis
+        return flight_key("symptoms", self.model, " ".join(symptoms.casefold().split()))
+
+    def _build_prompt(self, symptoms: str) -> str:
+        return f"""
         ### SYSTEM ROLE: Structured Medical Advisor
         You are an expert medical assistant providing preliminary, non-diagnostic guidance. Your response must be highly structured, cautious, and helpful. You MUST start your analysis by generating the **disclaimer_and_urgency** field first.
 
@@ -54,19 +145,118 @@ class DoctorAssistant:
         2. Ensure the "final_statement" field contains the exact phrase: "Connect the doctor/hospital near your location."
         """
 
+    def _generation_config(self) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            temperature=0.7,
+            # NEW: Request strict JSON output using the Pydantic schema
+            response_mime_type="application/json",
+            response_schema=SymptomAnalysisResult
+        )
+
+    def analyze(self, symptoms: str) -> SymptomAnalysisResult:
+        """
+        Analyzes user-provided symptoms and generates a structured advisory response.
+        
+        Args:
+            symptoms: A string describing the user's symptoms.
+            
+        Returns:
+            The validated SymptomAnalysisResult.
+
+        Raises:
+            ModelCallError or ModelOutputError (both AgentError).
+        """
+        cache_key = self._cache_key(symptoms)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+        return self.single_flight.do(self._flight_key(symptoms), lambda: self._store(cache_key, self._analyze(symptoms)),
+                                     result_type=SymptomAnalysisResult)
+
+    @staticmethod
+    def _parse(response) -> SymptomAnalysisResult:
+        with telemetry.span("validate", agent="symptom"):
+            return parse_response(response, SymptomAnalysisResult)
+
+    def _analyze(self, symptoms: str) -> SymptomAnalysisResult:
+        try:
+            with telemetry.span("llm", agent="symptom"):
+                response = self.governor.generate_content(
+                    self.client,
+                    model=self.model,
+                    contents=self._build_prompt(symptoms),
+                    config=self._generation_config()
+                )
+        except Exception as e:
+            raise ModelCallError(f"Error analyzing symptoms: {str(e)}") from e
+        # The response schema is SymptomAnalysisResult, so the SDK has usually parsed it already
+        return self._parse(response)
+
+    async def analyze_async(self, symptoms: str) -> SymptomAnalysisResult:
+        """Async variant of analyze() using the genai async client."""
+        cache_key = self._cache_key(symptoms)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+
+        async def analyze():
+            return self._store(cache_key, await self._analyze_async(symptoms))
+
+        return await self.single_flight.do_async(self._flight_key(symptoms), analyze, result_type=SymptomAnalysisResult)
+
+    async def _analyze_async(self, symptoms: str) -> SymptomAnalysisResult:
+        try:
+            with telemetry.span("llm", agent="symptom"):
+                response = await self.governor.generate_content_async(
+                    self.client,
+                    model=self.model,
+                    contents=self._build_prompt(symptoms),
+                    config=self._generation_config()
+                )
+        except Exception as e:
+            raise ModelCallError(f"Error analyzing symptoms: {str(e)}") from e
+        return self._parse(response)
+
+    async def analyze_stream_async(self, symptoms: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streams the analysis with generate_content_stream.
+
+        Yields:
+            ("field", {"name": ..., "value": ...}) as each schema field completes
+            (disclaimer_and_urgency first, as the prompt requires), then
+            ("result", SymptomAnalysisResult). Raises ModelCallError or
+            ModelOutputError on failure. A cached result is replayed field by
+            field without a model call.
+        """
+        cache_key = self._cache_key(symptoms)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            for name, value in cached.model_dump().items():
+                yield "field", {"name": name, "value": value}
+            yield "result", cached
+            return
+
+        scanner = JsonFieldStream()
+        start = time.perf_counter()
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.7,
-                    # NEW: Request strict JSON output using the Pydantic schema
-                    response_mime_type="application/json",
-                    response_schema=SymptomAnalysisResult
+            with telemetry.agent_scope("symptom"):
+                stream = await self.governor.generate_content_stream_async(
+                    self.client,
+                    model=self.model,
+                    contents=self._build_prompt(symptoms),
+                    config=self._generation_config()
                 )
-            )
-            # The model returns a JSON string that conforms to the schema
-            return response.text
+            async with contextlib.aclosing(stream):
+                async for chunk in stream:
+                    if not chunk.text:
+                        continue
+                    for name, value in scanner.feed(chunk.text):
+                        yield "field", {"name": name, "value": value}
         except Exception as e:
-            # Handle error and return a JSON string containing the error for reliable parsing in the Flask app
-            return json.dumps({"error": f"Error analyzing symptoms: {str(e)}"})
\ No newline at end of file
+            raise ModelCallError(f"Error analyzing symptoms: {str(e)}") from e
+        # Includes the time the client took to consume each field
+        telemetry.observe_stage("llm_stream", time.perf_counter() - start, agent="symptom")
+
+        with telemetry.span("validate", agent="symptom"):
+            result = validate_json(SymptomAnalysisResult, scanner.text)
+        yield "result", self._store(cache_key, result)
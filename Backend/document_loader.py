@@ -1,96 +1,235 @@
 import os
 import io
-from typing import Union, List, Any
-from pypdf import PdfReader
-import docx
-from PIL import Image
+from typing import TYPE_CHECKING, Union, List, Dict, Any, BinaryIO, Optional, Tuple
 from google.genai import types
+from upload_buffer import UploadedFile
+from image_optimizer import ImageOptimizer
+
+# pypdf, lxml and PIL are imported by the loader that needs them, so a
+# worker only pays for the formats it actually receives.
+if TYPE_CHECKING:
+    from pypdf import PdfReader
+
+# Downscale/re-encode settings for images sent to Vision (VISION_* env vars).
+DEFAULT_IMAGE_OPTIMIZER = ImageOptimizer.from_env()
+
+# A loader source is a file path or a binary file-like object positioned anywhere.
+Source = Union[str, BinaryIO]
 
 class SmartLoader:
     """
     Handles loading of various file types for the Medical Agent.
     Strategies:
-    - DOCX: Always text extraction.
-    - PDF:  Try text extraction first. If text is sparse (scanned), use Multimodal (Vision).
+    - DOCX: Always text extraction (paragraphs and table rows, streamed).
+    - PDF:  Per page: text pages are sent as extracted text, sparse/scanned pages
+            are sent to Multimodal (Vision) as a trimmed PDF.
     - IMG:  Always Multimodal (Vision).
     """
+
+    # A page with fewer extracted characters than this is treated as scanned.
+    MIN_CHARS_PER_PAGE = 50
+    # For PDFs longer than this, sample a few pages first and, if all of them
+    # are scanned, send the whole file to Vision without extracting the rest.
+    SAMPLE_THRESHOLD_PAGES = 20
+    SAMPLE_PAGES = 5
     
     @staticmethod
-    def load_docx(file_path: str) -> str:
-        """Extracts text from a .docx file."""
-        doc = docx.Document(file_path)
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return "\n".join(full_text)
+    def strategy(payload: Union[str, types.Part, List[Union[str, types.Part]]]) -> str:
+        """Which strategy produced a payload: "text", "vision" or "mixed" (text pages + scans)."""
+        parts = payload if isinstance(payload, list) else [payload]
+        has_text = any(isinstance(part, str) for part in parts)
+        has_vision = any(not isinstance(part, str) for part in parts)
+        return "mixed" if has_text and has_vision else "vision" if has_vision else "text"
+
+    @staticmethod
+    def _read_all(source: Source) -> bytes:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return f.read()
+        source.seek(0)
+        return source.read()
 
     @staticmethod
-    def load_pdf(file_path: str) -> Union[str, types.Part]:
+    def load_docx(source: Source) -> str:
+        """Extracts paragraphs and tables (one " | "-delimited line per row) from a .docx file."""
+        from docx_reader import docx_to_text
+
+        return docx_to_text(source)
+
+    @staticmethod
+    def _is_sparse(text: str) -> bool:
+        return len(text.strip()) < SmartLoader.MIN_CHARS_PER_PAGE
+
+    @staticmethod
+    def _has_images(page) -> bool:
+        """Blank or short typed pages have no image XObjects and are not worth a Vision pass."""
+        try:
+            return len(page["/Resources"]["/XObject"]) > 0
+        except (KeyError, TypeError):
+            return False
+
+    @staticmethod
+    def _sample_indices(page_count: int, samples: int) -> List[int]:
+        """Evenly spaced page indices, always including the first and last page."""
+        if samples >= page_count:
+            return list(range(page_count))
+        if samples <= 1:
+            return [0]
+        step = (page_count - 1) / (samples - 1)
+        return sorted({round(i * step) for i in range(samples)})
+
+    @staticmethod
+    def _pdf_part(reader: "PdfReader", page_indices: List[int]) -> types.Part:
+        """Builds a PDF containing only the given pages, for Gemini Vision."""
+        from pypdf import PdfWriter
+
+        writer = PdfWriter()
+        for idx in page_indices:
+            writer.add_page(reader.pages[idx])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return types.Part.from_bytes(data=buffer.getvalue(), mime_type="application/pdf")
+
+    @staticmethod
+    def split_pdf_part(part: types.Part, pages_per_chunk: int) -> Optional[List[Tuple[int, int, types.Part]]]:
         """
-        Smart PDF Loader:
-        1. Tries to extract text using pypdf.
-        2. If text length is sufficient, returns text (Save tokens).
-        3. If text is sparse (likely scanned), returns raw PDF bytes for Gemini Vision.
+        Splits a Vision PDF payload into consecutive page groups.
+
+        Returns [(first_page, last_page, part), ...] (1-based, inclusive), or
+        None when `part` is not a PDF or has no more than `pages_per_chunk` pages.
         """
+        from pypdf import PdfReader
+
+        inline = getattr(part, "inline_data", None)
+        if pages_per_chunk <= 0 or inline is None or inline.mime_type != "application/pdf":
+            return None
         try:
-            reader = PdfReader(file_path)
-            text_content = ""
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text_content += extracted + "\n"
-            
-            # HEURISTIC: If we extracted less than 50 chars per page on average, 
-            # it's likely a scanned document or image-heavy. Use Vision.
-            if len(text_content) < (50 * len(reader.pages)):
-                print(f"[Loader] PDF '{os.path.basename(file_path)}' appears scanned. Using Gemini Vision.")
-                with open(file_path, "rb") as f:
-                    pdf_bytes = f.read()
-                return types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")
-            
-            print(f"[Loader] PDF '{os.path.basename(file_path)}' processed as text.")
-            return text_content
+            reader = PdfReader(io.BytesIO(inline.data))
+            page_count = len(reader.pages)
+            if page_count <= pages_per_chunk:
+                return None
+            return [
+                (start + 1, min(start + pages_per_chunk, page_count),
+                 SmartLoader._pdf_part(reader, list(range(start, min(start + pages_per_chunk, page_count)))))
+                for start in range(0, page_count, pages_per_chunk)
+            ]
+        except Exception as e:
+            print(f"Error splitting PDF: {e}")
+            return None
+
+    @staticmethod
+    def load_pdf(source: Source, name: Optional[str] = None) -> Union[str, types.Part, List[Union[str, types.Part]]]:
+        """
+        Smart PDF Loader (page-level hybrid):
+        1. Extracts text per page with pypdf and classifies each page as text or sparse.
+        2. All text pages -> returns the text (Save tokens).
+        3. All sparse pages (likely scanned) -> returns raw PDF bytes for Gemini Vision.
+        4. Mixed -> returns [text of the text pages, trimmed PDF of the sparse pages].
+        Long PDFs are sampled first; if every sampled page is sparse the whole
+        file goes to Vision without extracting the remaining pages.
+        """
+        from pypdf import PdfReader
+
+        name = os.path.basename(name or (source if isinstance(source, str) else "upload.pdf"))
+        try:
+            reader = PdfReader(source)
+            page_count = len(reader.pages)
+
+            page_texts: Dict[int, str] = {}
+            if page_count > SmartLoader.SAMPLE_THRESHOLD_PAGES:
+                sample = SmartLoader._sample_indices(page_count, SmartLoader.SAMPLE_PAGES)
+                for idx in sample:
+                    page_texts[idx] = reader.pages[idx].extract_text() or ""
+                if all(SmartLoader._is_sparse(page_texts[idx]) for idx in sample):
+                    print(f"[Loader] PDF '{name}' sampled {len(sample)}/{page_count} pages, all scanned. Using Gemini Vision.")
+                    return types.Part.from_bytes(data=SmartLoader._read_all(source), mime_type="application/pdf")
+
+            for idx in range(page_count):
+                if idx not in page_texts:
+                    page_texts[idx] = reader.pages[idx].extract_text() or ""
+
+            sparse_pages = [idx for idx in range(page_count) if SmartLoader._is_sparse(page_texts[idx])]
+
+            if len(sparse_pages) == page_count:
+                print(f"[Loader] PDF '{name}' appears scanned. Using Gemini Vision.")
+                return types.Part.from_bytes(data=SmartLoader._read_all(source), mime_type="application/pdf")
+
+            # In an otherwise typed document, sparse pages without images are
+            # blank or near-blank; keep their text instead of sending them to Vision.
+            sparse_pages = [idx for idx in sparse_pages if SmartLoader._has_images(reader.pages[idx])]
+
+            if not sparse_pages:
+                print(f"[Loader] PDF '{name}' processed as text.")
+                return "\n".join(page_texts[idx] for idx in range(page_count) if page_texts[idx])
+
+            # Mixed document: keep page order visible to the model.
+            attached_page = {idx: pos + 1 for pos, idx in enumerate(sparse_pages)}
+            sections = []
+            for idx in range(page_count):
+                if idx in attached_page:
+                    sections.append(f"--- Page {idx + 1} (scanned; see attached PDF page {attached_page[idx]}) ---")
+                else:
+                    sections.append(f"--- Page {idx + 1} ---\n{page_texts[idx]}")
+            print(f"[Loader] PDF '{name}' mixed: {page_count - len(sparse_pages)} text page(s), {len(sparse_pages)} scanned page(s) sent to Gemini Vision.")
+            return ["\n".join(sections), SmartLoader._pdf_part(reader, sparse_pages)]
 
         except Exception as e:
             print(f"Error reading PDF: {e}")
             return ""
 
     @staticmethod
-    def load_image(file_path: str) -> types.Part:
-        """Loads an image for Gemini Vision."""
+    def load_image(source: Source, optimizer: Optional[ImageOptimizer] = None) -> types.Part:
+        """Loads an image for Gemini Vision, downscaled and re-encoded by the ImageOptimizer."""
+        from PIL import Image
+
         try:
-            # Verify it's a valid image
-            with Image.open(file_path) as img:
+            img_bytes = SmartLoader._read_all(source)
+
+            # Verify it's a valid image (from the bytes already in memory)
+            with Image.open(io.BytesIO(img_bytes)) as img:
                 img.verify() 
             
-            with open(file_path, "rb") as f:
-                img_bytes = f.read()
-            
-            # Determine mime type (default to jpeg if unknown/png)
-            mime_type = "image/jpeg"
-            if file_path.lower().endswith(".png"):
-                mime_type = "image/png"
+            optimizer = optimizer or DEFAULT_IMAGE_OPTIMIZER
+            label = os.path.basename(source) if isinstance(source, str) else "upload"
+            payload, mime_type = optimizer.optimize(img_bytes, label=label)
                 
-            return types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
+            return types.Part.from_bytes(data=payload, mime_type=mime_type)
         except Exception as e:
             print(f"Error reading Image: {e}")
             return None
 
-    def process_file(self, file_path: str) -> Union[str, types.Part, None]:
-        """Main entry point to route file to correct handler."""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-            
-        ext = os.path.splitext(file_path)[1].lower()
+    def process_file(self, source: Union[Source, bytes, UploadedFile], filename: Optional[str] = None) -> Union[str, types.Part, List[Union[str, types.Part]], None]:
+        """
+        Main entry point to route file to correct handler.
+
+        Args:
+            source: A file path, raw bytes, a binary file-like object or an UploadedFile.
+            filename: Used to pick the loader when `source` carries no name of its own.
+        """
+        if isinstance(source, UploadedFile):
+            filename = filename or source.filename
+            source = source.open()
+        elif isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        elif isinstance(source, str):
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"File not found: {source}")
+            filename = filename or source
+        else:
+            filename = filename or getattr(source, "name", "")
+
+        ext = os.path.splitext(filename or "")[1].lower()
         
         if ext == ".docx":
-            return self.load_docx(file_path)
+            return self.load_docx(source)
         elif ext == ".pdf":
-            return self.load_pdf(file_path)
+            return self.load_pdf(source, name=filename)
         elif ext in [".jpg", ".jpeg", ".png"]:
-            return self.load_image(file_path)
+            return self.load_image(source)
         elif ext == ".txt":
-            with open(file_path, "r") as f:
-                return f.read()
+            if isinstance(source, str):
+                with open(source, "r") as f:
+                    return f.read()
+            return self._read_all(source).decode("utf-8", errors="replace")
         else:
             raise ValueError(f"Unsupported file format: {ext}")
\ No newline at end of file
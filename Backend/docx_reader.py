@@ -0,0 +1,104 @@
+"""
+Streaming DOCX text extraction.
+
+Reads word/document.xml straight from the zip with lxml iterparse instead
+of building the python-docx object model. Paragraphs become one line each,
+and each table row becomes one " | "-delimited line, so lab results kept in
+tables reach the model. Processed elements are freed as the parser moves
+on, so memory stays bounded on very large documents.
+"""
+import zipfile
+from typing import BinaryIO, Iterator, List, Union
+
+from lxml import etree
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+P, T, TAB, BR, CR = W + "p", W + "t", W + "tab", W + "br", W + "cr"
+TBL, TR, TC = W + "tbl", W + "tr", W + "tc"
+# Text boxes are stored twice (DrawingML + a VML fallback); only the first copy is read
+FALLBACK = MC + "Fallback"
+
+CELL_SEPARATOR = " | "
+
+
+def _text(element) -> str:
+    """Text of a paragraph or a whole cell: runs joined, tabs/breaks/paragraph starts as spaces."""
+    parts = [node.text or "" if node.tag == T else " " for node in element.iter(T, TAB, BR, CR, P)]
+    return " ".join("".join(parts).split())
+
+
+def _release(element) -> None:
+    """Frees a processed element and the already-processed siblings before it."""
+    element.clear(keep_tail=False)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_docx_lines(source: Union[str, BinaryIO]) -> Iterator[str]:
+    """
+    Yields the document body in reading order: one line per non-empty
+    paragraph and one "cell | cell | ..." line per non-empty table row.
+
+    A table nested in a cell is flattened into that cell's text, its rows
+    separated by "; ".
+    """
+    with zipfile.ZipFile(source) as archive, archive.open("word/document.xml") as xml:
+        # Per open table: the finished cells of the current row, and the rows of
+        # nested tables waiting to be folded into the enclosing cell
+        rows: List[List[str]] = []
+        nested: List[List[str]] = []
+        fallback_depth = 0
+        for event, element in etree.iterparse(xml, events=("start", "end"), tag=(P, TC, TR, TBL, FALLBACK)):
+            tag = element.tag
+            if tag == FALLBACK:
+                fallback_depth += 1 if event == "start" else -1
+                if event == "end":
+                    _release(element)
+                continue
+            if fallback_depth:
+                continue
+            if event == "start":
+                if tag == TBL:
+                    rows.append([])
+                    nested.append([])
+                continue
+
+            if tag == P:
+                # Cell paragraphs are read with their cell
+                if not rows:
+                    text = _text(element)
+                    if text:
+                        yield text
+                    _release(element)
+            elif tag == TC:
+                text = _text(element)
+                if nested[-1]:
+                    text = " ".join(["; ".join(nested[-1]), text]).strip()
+                    nested[-1] = []
+                rows[-1].append(text)
+                _release(element)
+            elif tag == TR:
+                cells, rows[-1] = rows[-1], []
+                if any(cells):
+                    line = CELL_SEPARATOR.join(cells)
+                    if len(rows) > 1:
+                        nested[-2].append(line)
+                    else:
+                        yield line
+                _release(element)
+            elif tag == TBL:
+                rows.pop()
+                nested.pop()
+                if rows:
+                    # Nested: the enclosing cell's other paragraphs are still unread
+                    element.clear(keep_tail=False)
+                else:
+                    _release(element)
+
+
+def docx_to_text(source: Union[str, BinaryIO]) -> str:
+    return "\n".join(iter_docx_lines(source))
@@ -0,0 +1,297 @@
+"""
+Local drug-name normalization for OCR'd prescriptions.
+
+Maps names as the vision model read them ("Paracetmol 500", "AMOXYCILLIN",
+"Tab. Dolo-650") to a canonical generic name and strength, with a
+confidence score, using the bundled lexicon in data/drug_lexicon.tsv:
+
+1. exact match on a normalized name or alias (dict lookup)
+2. prefix match for truncated names ("Amoxicil"), on a sorted key array
+   searched with bisect (the same queries as a trie, in flat memory)
+3. fuzzy match: candidates sharing the most character trigrams, ranked by
+   bounded Damerau-Levenshtein distance
+
+Only exact name or alias hits, and near-exact matches (by default at most
+one edit and a confidence of 0.95), are substitutes for the name as read.
+Other matches are suggestions: similar names are often different drugs
+(Prednisone and Prednisolone).
+
+Results for repeated names come from an LRU cache.
+"""
+import os
+import re
+import bisect
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drug_lexicon.tsv")
+
+# Dose form and packaging words that do not identify the drug
+FORM_WORDS = {
+    "tab", "tabs", "tablet", "tablets", "cap", "caps", "capsule", "capsules", "syp", "syr", "syrup", "susp",
+    "suspension", "inj", "injection", "drop", "drops", "cream", "oint", "ointment", "gel", "lotion", "sachet",
+    "powder", "inhaler", "respules", "spray", "solution", "sol", "soln", "eye", "ear", "nasal", "oral", "dt",
+    "md", "mt", "sr", "er", "xr", "cr", "od", "ds", "la", "xl", "retard",
+    # strength units, read separately by parse_strength()
+    "mg", "mcg", "ug", "g", "gm", "ml", "iu", "unit", "units", "w", "v",
+}
+# A number only counts as a strength with its unit: "Dolo 650" or a "1-0-1"
+# dosing schedule carries no unit and is not read as one
+STRENGTH = re.compile(
+    r"(?<![a-z\d.])(?P<amount>\d+(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)*)\s*(?P<unit>mcg|µg|ug|mg|gm|g|ml|iu|units?|%)(?![a-z])", re.I)
+UNIT_NAMES = {"µg": "mcg", "ug": "mcg", "gm": "g", "unit": "IU", "units": "IU", "iu": "IU"}
+
+
+# Another ingredient in the name ("Metformin + Glimepiride", "X and Y")
+COMBINATION = re.compile(r"[+&]|\b(?:and|with|plus)\b", re.I)
+
+# OCR reads "o" and "l" inside a word as "0" and "1": "P0ntop1"
+OCR_DIGITS = re.compile(r"(?<=[a-z])[01]+(?=[a-z])")
+OCR_LETTERS = str.maketrans("01", "ol")
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase letters-only words, form words dropped: "Tab. DOLO-650" -> "dolo"."""
+    text = OCR_DIGITS.sub(lambda m: m.group().translate(OCR_LETTERS), text.casefold())
+    words = re.sub(r"[^a-z]+", " ", text).split()
+    return " ".join(word for word in words if word not in FORM_WORDS)
+
+
+def parse_strength(text: str) -> Optional[str]:
+    """"500mg" -> "500 mg", "625 MG" -> "625 mg", "500/125 mg" -> "500/125 mg"; None without a unit ("Dolo 650", "1-0-1")."""
+    match = STRENGTH.search(text)
+    if match is None:
+        return None
+    amount = re.sub(r"\s+", "", match.group("amount"))
+    unit = UNIT_NAMES.get(match.group("unit").casefold(), match.group("unit").casefold())
+    return f"{amount}{unit}" if unit == "%" else f"{amount} {unit}"
+
+
+def _trigrams(key: str) -> List[str]:
+    padded = f"  {key.replace(' ', '')} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            cost = char_a != char_b
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class DrugMatch:
+    """A normalized drug name."""
+
+    __slots__ = ("name", "strength", "confidence", "method", "matched", "distance", "substitute")
+
+    def __init__(self, name: str, strength: Optional[str], confidence: float, method: str, matched: str,
+                 distance: int = 0, substitute: bool = True):
+        self.name = name
+        self.strength = strength
+        self.confidence = confidence
+        # exact, prefix or fuzzy
+        self.method = method
+        # The lexicon key that matched
+        self.matched = matched
+        # Edits between the name as read and the matched key (0 for exact matches)
+        self.distance = distance
+        # True when the canonical name may replace the name as read; otherwise
+        # the match is only a suggestion
+        self.substitute = substitute
+
+    @property
+    def display_name(self) -> str:
+        """Canonical name with strength: "Paracetamol 500 mg"."""
+        return f"{self.name} {self.strength}" if self.strength else self.name
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"name": self.name, "strength": self.strength, "display_name": self.display_name,
+                "confidence": self.confidence, "method": self.method}
+
+    def __repr__(self) -> str:
+        kind = "" if self.substitute else ", suggestion"
+        return f"DrugMatch({self.display_name!r}, {self.confidence}, {self.method!r}{kind})"
+
+
+class DrugLexicon:
+    """
+    In-memory index of canonical drug names and their aliases.
+
+    Args:
+        entries: (canonical name, aliases) pairs.
+        min_confidence: Matches scoring below this are not returned.
+        substitute_confidence: Non-exact matches need this confidence, and at
+            most `substitute_max_edits` edits, to replace the name as read.
+        substitute_max_edits: See `substitute_confidence`.
+        cache_size: Normalized names kept in the lookup LRU.
+    """
+
+    MIN_KEY = 3
+    MIN_PREFIX = 5
+    MAX_CANDIDATES = 8
+    MIN_PROBE = 6
+    PROBE_BUDGET = 6000
+
+    def __init__(self, entries: Iterable[Tuple[str, Iterable[str]]], min_confidence: float = 0.75,
+                 substitute_confidence: float = 0.95, substitute_max_edits: int = 1, cache_size: int = 4096):
+        self.min_confidence = min_confidence
+        self.substitute_confidence = substitute_confidence
+        self.substitute_max_edits = substitute_max_edits
+        self.canonical: List[str] = []
+        # Normalized key -> canonical index, for exact and prefix matches
+        self.keys: Dict[str, int] = {}
+        words = set()
+        for canonical, aliases in entries:
+            index = len(self.canonical)
+            self.canonical.append(canonical)
+            for name in (canonical, *aliases):
+                key = normalize_name(name)
+                # One- and two-letter keys ("P-500") would match stray words
+                if len(key.replace(" ", "")) >= self.MIN_KEY:
+                    if " " not in key:
+                        words.add(key)
+                    self.keys.setdefault(key, index)
+                    self.keys.setdefault(key.replace(" ", ""), index)
+        # Single-word keys as written (not the space-stripped forms), for prefix matches:
+        # "amoxicil" completes "amoxicillin", not the "amoxicillin clavulanate" combination
+        self.sorted_keys = sorted(words)
+        # Trigram -> key ids (uint32 arrays keep tens of thousands of entries compact)
+        self._key_list = list(self.keys)
+        postings: Dict[str, array] = {}
+        for key_id, key in enumerate(self._key_list):
+            for gram in set(_trigrams(key)):
+                postings.setdefault(gram, array("I")).append(key_id)
+        self.postings = postings
+        self._match = lru_cache(maxsize=cache_size)(self._match_key)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_LEXICON_PATH, **kwargs) -> "DrugLexicon":
+        """Reads a lexicon TSV: canonical name, TAB, comma-separated aliases; '#' lines are comments."""
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                canonical, _, aliases = line.partition("\t")
+                entries.append((canonical.strip(), [alias.strip() for alias in aliases.split(",") if alias.strip()]))
+        return cls(entries, **kwargs)
+
+    @classmethod
+    def from_env(cls) -> "DrugLexicon":
+        return cls.load(
+            os.getenv("DRUG_LEXICON_PATH", DEFAULT_LEXICON_PATH),
+            min_confidence=float(os.getenv("DRUG_LEXICON_MIN_CONFIDENCE", 0.75)),
+            substitute_confidence=float(os.getenv("DRUG_LEXICON_SUBSTITUTE_CONFIDENCE", 0.95)),
+            substitute_max_edits=int(os.getenv("DRUG_LEXICON_SUBSTITUTE_MAX_EDITS", 1)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.canonical)
+
+    def _prefix(self, key: str) -> Optional[Tuple[int, str]]:
+        """The canonical entry all keys starting with `key` belong to, if there is exactly one."""
+        start = bisect.bisect_left(self.sorted_keys, key)
+        found, first = None, None
+        for candidate in self.sorted_keys[start:start + 64]:
+            if not candidate.startswith(key):
+                break
+            index = self.keys[candidate]
+            if found is not None and index != found:
+                return None
+            found = index
+            if first is None or len(candidate) < len(first):
+                first = candidate
+        return (found, first) if found is not None else None
+
+    def _fuzzy(self, key: str) -> Optional[Tuple[int, str, float, int]]:
+        compact = key.replace(" ", "")
+        # Candidates come from the query's rarest trigrams: names sharing those
+        # are the likely matches, and common ones ("ine", "tan") would pull in
+        # thousands of keys. At least MIN_PROBE lists are read, then more until
+        # PROBE_BUDGET key ids have been counted.
+        grams = sorted((len(self.postings[gram]), gram) for gram in set(_trigrams(key)) if gram in self.postings)
+        shared: Counter = Counter()
+        counted = 0
+        for probed, (size, gram) in enumerate(grams):
+            if probed >= self.MIN_PROBE and counted + size > self.PROBE_BUDGET:
+                break
+            shared.update(self.postings[gram])
+            counted += size
+        if not shared:
+            return None
+        best = None
+        for key_id, _ in shared.most_common(self.MAX_CANDIDATES):
+            candidate = self._key_list[key_id]
+            other = candidate.replace(" ", "")
+            longest = max(len(compact), len(other))
+            limit = int(longest * (1 - self.min_confidence))
+            distance = edit_distance(compact, other, limit)
+            if distance > limit:
+                continue
+            confidence = 1 - distance / longest
+            if best is None or confidence > best[2]:
+                best = (self.keys[candidate], candidate, confidence, distance)
+        return best
+
+    def _match_key(self, key: str) -> Optional[Tuple[int, str, float, str, int]]:
+        """(canonical index, matched key, confidence, method, edit distance), or None."""
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys.get(key.replace(" ", ""))
+        if index is not None:
+            return index, key, 1.0, "exact", 0
+        if len(key) >= self.MIN_PREFIX:
+            prefix = self._prefix(key)
+            if prefix is not None:
+                confidence = round(0.8 + 0.2 * len(key) / len(prefix[1]), 3)
+                if confidence >= self.min_confidence:
+                    return prefix[0], prefix[1], confidence, "prefix", len(prefix[1]) - len(key)
+        fuzzy = self._fuzzy(key)
+        if fuzzy is not None:
+            return fuzzy[0], fuzzy[1], round(fuzzy[2], 3), "fuzzy", fuzzy[3]
+        return None
+
+    def _is_combination(self, text: str, key: str) -> bool:
+        """Names more than one ingredient: a "+"/"and" or another known drug after the first word."""
+        return bool(COMBINATION.search(text)) or any(word in self.keys for word in key.split()[1:])
+
+    def match(self, text: str) -> Optional[DrugMatch]:
+        """
+        Canonical name and strength for an OCR'd medicine name, or None when
+        nothing scores above min_confidence. Check `substitute` before using
+        the canonical name in place of the name as read.
+        """
+        key = normalize_name(text)
+        if len(key.replace(" ", "")) < self.MIN_KEY:
+            return None
+        found, first_word_only = self._match(key), False
+        if (found is None or found[2] < 1.0) and " " in key and not self._is_combination(text, key):
+            # Brand plus extra words ("Augmentin Duo"): the first word alone, at a
+            # discount and only as a suggestion, since the rest is not matched.
+            # Never for combinations: "Metformin Glimepiride" is not Metformin.
+            first_word = key.split(" ", 1)[0]
+            first = self._match(first_word) if len(first_word) >= self.MIN_KEY else None
+            if first is not None and first[2] * 0.9 > (found[2] if found else 0):
+                found, first_word_only = (first[0], first[1], round(first[2] * 0.9, 3), first[3], first[4]), True
+        if found is None or found[2] < self.min_confidence:
+            return None
+        index, matched, confidence, method, distance = found
+        substitute = not first_word_only and (
+            method == "exact" or (confidence >= self.substitute_confidence and distance <= self.substitute_max_edits))
+        return DrugMatch(self.canonical[index], parse_strength(text), confidence, method, matched, distance, substitute)
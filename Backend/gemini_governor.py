@@ -0,0 +1,560 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from tenacity import (
+    AsyncRetrying, Retrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_random_exponential,
+)
+
+import telemetry
+
+# HTTP statuses worth retrying: quota exhaustion and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Gemini bills each inline image (and roughly each PDF page) as a fixed token block
+INLINE_PART_TOKENS = 258
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling Gemini while a model's circuit breaker is open."""
+
+
+def _outcome(exc: BaseException) -> str:
+    """Outcome label for a failed call in the exported metrics."""
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(exc, (GeneratorExit, asyncio.CancelledError)):
+        return "cancelled"
+    return "error"
+
+
+def is_retryable(exc: BaseException) -> bool:
+    # Imported here so the app can report governor stats without loading google-genai
+    import httpx
+    from google.genai import errors
+
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Rough prompt size for rate limiting: ~4 characters per token, a fixed block per inline file."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(item) for item in contents)
+    if getattr(contents, "text", None):
+        return max(1, len(contents.text) // 4)
+    if getattr(contents, "inline_data", None) is not None or getattr(contents, "file_data", None) is not None:
+        return INLINE_PART_TOKENS
+    if getattr(contents, "parts", None):
+        return estimate_tokens(contents.parts)
+    return INLINE_PART_TOKENS
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills at `rate` per second up to `capacity`.
+
+    `reserve()` takes the tokens immediately (the balance may go negative) and
+    returns how long the caller must wait before using them. Callers are
+    therefore served in arrival order and the long-run rate never exceeds
+    `rate`, however large a single request is.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Returns (positive) or charges (negative) tokens once the real cost is known."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive retryable failures and rejects
+    calls for `reset_timeout` seconds. Then one probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self, model: str) -> None:
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Gemini circuit open for '{model}' after repeated failures; retry in {remaining:.0f}s."
+                    )
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    raise CircuitOpenError(f"Gemini circuit half-open for '{model}'; a probe call is in flight.")
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """Frees the half-open probe slot after a non-retryable error (not a quota/server failure)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class ModelLimiter:
+    """Request/token buckets, circuit breaker and counters for one model."""
+
+    def __init__(self, model: str, rpm: float, tpm: float, burst_seconds: float,
+                 failure_threshold: int, reset_timeout: float):
+        self.model = model
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * burst_seconds)) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, max(1.0, tpm / 60.0 * burst_seconds)) if tpm > 0 else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "rejected_open_circuit": 0,
+            "throttled": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "tokens_used": 0, "queue_depth": 0, "in_flight": 0,
+        }
+
+    def count(self, **deltas: float) -> None:
+        with self.lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def record_wait(self, seconds: float) -> None:
+        with self.lock:
+            self.counters["throttled"] += 1
+            self.counters["wait_seconds_total"] += seconds
+            self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], seconds)
+
+    def reserve(self, estimated_tokens: int) -> float:
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def settle(self, estimated_tokens: int, response: Any) -> None:
+        """Corrects the token bucket with the usage Gemini reported for the call."""
+        usage = getattr(response, "usage_metadata", None)
+        used = getattr(usage, "total_token_count", None) if usage is not None else None
+        if used is None:
+            used = estimated_tokens
+        self.count(tokens_used=used)
+        if self.tokens:
+            self.tokens.adjust(estimated_tokens - used)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.counters)
+        stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 4)
+        stats["wait_seconds_max"] = round(stats["wait_seconds_max"], 4)
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / stats["throttled"], 4) if stats["throttled"] else 0.0
+        stats["circuit"] = self.breaker.state
+        stats["requests_available"] = round(self.requests.available, 2) if self.requests else None
+        stats["tokens_available"] = round(self.tokens.available) if self.tokens else None
+        return stats
+
+
+class ConcurrencySlots:
+    """
+    Counting semaphore shared by threads and event loops.
+
+    Sync callers block in `acquire()`; async callers await `acquire_async()`
+    without blocking their loop. Both draw from the same `limit`, so mixed
+    sync and async traffic never exceeds it. Waiters are served in arrival
+    order: `release()` hands the slot straight to the oldest waiter.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+        # threading.Event (sync waiter) or (loop, future) (async waiter)
+        self._waiters: deque = deque()
+
+    def _try_acquire(self, waiter: Any) -> bool:
+        with self._lock:
+            if self.in_use < self.limit and not self._waiters:
+                self.in_use += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def acquire(self) -> None:
+        event = threading.Event()
+        if not self._try_acquire(event):
+            event.wait()
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        if self._try_acquire(waiter):
+            return
+        future = waiter[1]
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            # Granted just before the cancellation landed: give the slot back.
+            # A grant still on its way to the loop sees the cancelled future and
+            # passes the slot on itself (_grant).
+            if not queued and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self.in_use -= 1
+                return
+            waiter = self._waiters.popleft()
+        # The slot passes to the waiter; in_use is unchanged
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # The waiter's loop is closed
+                self.release()
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class GeminiGovernor:
+    """
+    Shared gate for every outbound Gemini call in the process.
+
+    Each call (sync, async or streaming) goes through the same steps:
+    1. Circuit check. Open circuits fail fast with CircuitOpenError.
+    2. Concurrency slot (`max_concurrency` calls in flight).
+    3. Per-model request and token buckets. The caller waits for its
+       reservation, so throughput levels off at the quota instead of
+       alternating between bursts and 429 storms.
+    4. The call itself. Quota (429), 5xx and network errors are retried with
+       jittered exponential backoff up to `max_attempts`.
+    Token reservations use an estimate of the prompt size and are corrected
+    from `usage_metadata` after each response.
+
+    Configured from the environment by `from_env()`:
+    - GEMINI_RPM / GEMINI_TPM: default per-model limits (0 disables a bucket)
+    - GEMINI_MODEL_LIMITS: JSON overrides, e.g. {"gemini-2.5-pro": {"rpm": 150, "tpm": 2000000}}
+    - GEMINI_BURST_SECONDS: bucket size, in seconds of quota (default 5)
+    - GEMINI_MAX_CONCURRENCY, GEMINI_MAX_ATTEMPTS, GEMINI_BACKOFF_MAX
+    - GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET
+    """
+
+    def __init__(self, rpm: float = 1000, tpm: float = 1_000_000, model_limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 burst_seconds: float = 5.0, max_concurrency: int = 32, max_attempts: int = 4,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 breaker_failures: int = 5, breaker_reset: float = 30.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = model_limits or {}
+        self.burst_seconds = burst_seconds
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+        # One cap for sync, async and streaming calls alike
+        self._slots = ConcurrencySlots(max_concurrency)
+
+    @classmethod
+    def from_env(cls) -> "GeminiGovernor":
+        return cls(
+            rpm=float(os.getenv("GEMINI_RPM", 1000)),
+            tpm=float(os.getenv("GEMINI_TPM", 1_000_000)),
+            model_limits=json.loads(os.getenv("GEMINI_MODEL_LIMITS", "{}")),
+            burst_seconds=float(os.getenv("GEMINI_BURST_SECONDS", 5)),
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 32)),
+            max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", 4)),
+            backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", 30)),
+            breaker_failures=int(os.getenv("GEMINI_BREAKER_FAILURES", 5)),
+            breaker_reset=float(os.getenv("GEMINI_BREAKER_RESET", 30)),
+        )
+
+    def limiter(self, model: str) -> ModelLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                limits = self.model_limits.get(model, {})
+                self._limiters[model] = ModelLimiter(
+                    model,
+                    rpm=float(limits.get("rpm", self.rpm)),
+                    tpm=float(limits.get("tpm", self.tpm)),
+                    burst_seconds=self.burst_seconds,
+                    failure_threshold=self.breaker_failures,
+                    reset_timeout=self.breaker_reset,
+                )
+            return self._limiters[model]
+
+    def _retry_args(self, limiter: ModelLimiter) -> Dict[str, Any]:
+        def before_sleep(state: RetryCallState) -> None:
+            limiter.count(retries=1)
+            print(f"[Governor] {limiter.model}: attempt {state.attempt_number} failed "
+                  f"({state.outcome.exception()}); retrying in {state.upcoming_sleep:.2f}s.")
+
+        return {
+            "retry": retry_if_exception(is_retryable),
+            "stop": stop_after_attempt(self.max_attempts),
+            "wait": wait_random_exponential(multiplier=self.backoff_base, max=self.backoff_max),
+            "before_sleep": before_sleep,
+            "reraise": True,
+        }
+
+    def _on_error(self, limiter: ModelLimiter, exc: BaseException) -> None:
+        if isinstance(exc, CircuitOpenError):
+            limiter.count(rejected_open_circuit=1)
+        elif is_retryable(exc):
+            if limiter.breaker.record_failure():
+                print(f"[Governor] {limiter.model}: circuit opened for {limiter.breaker.reset_timeout:g}s.")
+        else:
+            limiter.breaker.release_probe()
+
+    # --- Sync ---
+
+    def _attempt(self, limiter: ModelLimiter, call: Callable[[], Any], estimated_tokens: int) -> Any:
+        limiter.breaker.before_call(limiter.model)
+        limiter.count(queue_depth=1)
+        try:
+            self._slots.acquire()
+            try:
+                wait = limiter.reserve(estimated_tokens)
+                if wait > 0:
+                    limiter.record_wait(wait)
+                    time.sleep(wait)
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            limiter.count(queue_depth=-1)
+
+        limiter.count(in_flight=1)
+        try:
+            response = call()
+        except BaseException as e:
+            self._on_error(limiter, e)
+            raise
+        finally:
+            limiter.count(in_flight=-1)
+            self._slots.release()
+        limiter.breaker.record_success()
+        limiter.settle(estimated_tokens, response)
+        return response
+
+    def generate_content(self, client: Any, *, model: str, contents: Any, config: Any = None) -> Any:
+        """Governed `client.models.generate_content`."""
+        limiter = self.limiter(model)
+        estimated_tokens = estimate_tokens(contents)
+        call = lambda: client.models.generate_content(model=model, contents=contents, config=config)
+        labels, start = telemetry.llm_labels(model), time.perf_counter()
+        limiter.count(calls=1)
+        try:
+            response = Retrying(**self._retry_args(limiter))(self._attempt, limiter, call, estimated_tokens)
+        except BaseException as e:
+            if isinstance(e, CircuitOpenError):
+                self._on_error(limiter, e)
+            limiter.count(failed=1)
+            telemetry.record_llm_call(labels, time.perf_counter() - start, _outcome(e))
+            raise
+        limiter.count(succeeded=1)
+        telemetry.record_llm_call(labels, time.perf_counter() - start, "success", response)
+        return response
+
+    # --- Async ---
+
+    async def _attempt_async(self, limiter: ModelLimiter, call: Callable[[], Any], estimated_tokens: int,
+                             opened: Optional[list] = None) -> Any:
+        """One attempt; with `opened`, the slot stays held and the response is also appended to it."""
+        limiter.breaker.before_call(limiter.model)
+        limiter.count(queue_depth=1)
+        try:
+            await self._slots.acquire_async()
+            try:
+                wait = limiter.reserve(estimated_tokens)
+                if wait > 0:
+                    limiter.record_wait(wait)
+                    await asyncio.sleep(wait)
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            limiter.count(queue_depth=-1)
+
+        limiter.count(in_flight=1)
+        try:
+            response = await call()
+        except BaseException as e:
+            self._on_error(limiter, e)
+            limiter.count(in_flight=-1)
+            self._slots.release()
+            raise
+        if opened is not None:
+            opened.append(response)
+        else:
+            limiter.count(in_flight=-1)
+            self._slots.release()
+            limiter.breaker.record_success()
+            limiter.settle(estimated_tokens, response)
+        return response
+
+    async def generate_content_async(self, client: Any, *, model: str, contents: Any, config: Any = None) -> Any:
+        """Governed `client.aio.models.generate_content`."""
+        limiter = self.limiter(model)
+        estimated_tokens = estimate_tokens(contents)
+        call = lambda: client.aio.models.generate_content(model=model, contents=contents, config=config)
+        labels, start = telemetry.llm_labels(model), time.perf_counter()
+        limiter.count(calls=1)
+        try:
+            response = await AsyncRetrying(**self._retry_args(limiter))(
+                self._attempt_async, limiter, call, estimated_tokens
+            )
+        except BaseException as e:
+            if isinstance(e, CircuitOpenError):
+                self._on_error(limiter, e)
+            limiter.count(failed=1)
+            telemetry.record_llm_call(labels, time.perf_counter() - start, _outcome(e))
+            raise
+        limiter.count(succeeded=1)
+        telemetry.record_llm_call(labels, time.perf_counter() - start, "success", response)
+        return response
+
+    async def generate_content_stream_async(self, client: Any, *, model: str, contents: Any,
+                                            config: Any = None) -> AsyncIterator[Any]:
+        """
+        Governed `client.aio.models.generate_content_stream`.
+
+        The stream is opened on first iteration, so a stream that is never
+        iterated never takes a concurrency slot. Opening is retried like a
+        normal call; errors after the first chunk are not (the caller has
+        already used partial output). The slot is held until the stream is
+        exhausted or closed: iterate it under `contextlib.aclosing` to release
+        it as soon as the consumer stops.
+        """
+        call = lambda: client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+        # Labels are taken now: later chunks may be pulled from another context
+        return self._stream(self.limiter(model), call, estimate_tokens(contents), telemetry.llm_labels(model))
+
+    async def _stream(self, limiter: ModelLimiter, call: Callable[[], Any], estimated_tokens: int,
+                      labels: Dict[str, str]) -> AsyncIterator[Any]:
+        start = time.perf_counter()
+        limiter.count(calls=1)
+        opened: list = []
+        try:
+            stream = await AsyncRetrying(**self._retry_args(limiter))(
+                self._attempt_async, limiter, call, estimated_tokens, opened
+            )
+        except BaseException as e:
+            if opened:
+                # Opened, then interrupted before the stream was handed over
+                limiter.count(in_flight=-1)
+                self._slots.release()
+                limiter.breaker.release_probe()
+            if isinstance(e, CircuitOpenError):
+                self._on_error(limiter, e)
+            limiter.count(failed=1)
+            telemetry.record_llm_call(labels, time.perf_counter() - start, _outcome(e))
+            raise
+
+        last_chunk = None
+        try:
+            async for chunk in stream:
+                last_chunk = chunk
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError) as e:
+            # The consumer stopped early (e.g. client disconnect); not a Gemini failure
+            limiter.breaker.release_probe()
+            telemetry.record_llm_call(labels, time.perf_counter() - start, _outcome(e))
+            raise
+        except BaseException as e:
+            self._on_error(limiter, e)
+            limiter.count(failed=1)
+            telemetry.record_llm_call(labels, time.perf_counter() - start, _outcome(e))
+            raise
+        else:
+            limiter.breaker.record_success()
+            limiter.count(succeeded=1)
+            telemetry.record_llm_call(labels, time.perf_counter() - start, "success", last_chunk)
+        finally:
+            limiter.count(in_flight=-1)
+            self._slots.release()
+            # The final chunk carries the usage for the whole response
+            limiter.settle(estimated_tokens, last_chunk)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            "max_concurrency": self.max_concurrency,
+            "slots_in_use": self._slots.in_use,
+            "models": {limiter.model: limiter.stats() for limiter in limiters},
+        }
+
+
+# Process-wide governor used by all agents unless one is injected
+default_governor = GeminiGovernor.from_env()
@@ -0,0 +1,207 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+# Trace events emitted by httpcore when a new connection is set up
+_CONNECT_EVENT = "connection.connect_tcp.complete"
+_TLS_EVENT = "connection.start_tls.complete"
+
+
+class PoolStats:
+    """Counts HTTP requests and new connections, so connection reuse can be observed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def record(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def trace_event(self, event_name: str) -> None:
+        if event_name == _CONNECT_EVENT:
+            self.record(connections_opened=1)
+        elif event_name == _TLS_EVENT:
+            self.record(tls_handshakes=1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            reused = max(0, self.requests - self.connections_opened)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "requests_on_reused_connections": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            }
+
+
+def _cap_connect_timeout(request: httpx.Request, connect_timeout: float) -> None:
+    # genai sends one float timeout per call, which httpx applies to every phase;
+    # a dead host should still fail fast on connect.
+    timeout = dict(request.extensions.get("timeout") or {})
+    if timeout.get("connect") is None or timeout["connect"] > connect_timeout:
+        timeout["connect"] = connect_timeout
+    request.extensions["timeout"] = timeout
+
+
+class TracedTransport(httpx.HTTPTransport):
+    """HTTP transport that feeds PoolStats from httpcore trace events."""
+
+    def __init__(self, stats: PoolStats, connect_timeout: float, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.connect_timeout = connect_timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.record(requests=1)
+        _cap_connect_timeout(request, self.connect_timeout)
+        request.extensions["trace"] = lambda event_name, info: self.stats.trace_event(event_name)
+        return super().handle_request(request)
+
+    def pool_state(self) -> Dict[str, int]:
+        return _pool_state(getattr(self, "_pool", None))
+
+
+class AsyncTracedTransport(httpx.AsyncHTTPTransport):
+    """Async counterpart of TracedTransport (trace callbacks must be coroutines here)."""
+
+    def __init__(self, stats: PoolStats, connect_timeout: float, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.connect_timeout = connect_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.record(requests=1)
+        _cap_connect_timeout(request, self.connect_timeout)
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            self.stats.trace_event(event_name)
+
+        request.extensions["trace"] = trace
+        return await super().handle_async_request(request)
+
+    def pool_state(self) -> Dict[str, int]:
+        return _pool_state(getattr(self, "_pool", None))
+
+
+def _pool_state(pool: Any) -> Dict[str, int]:
+    connections = list(getattr(pool, "connections", []) or [])
+    return {
+        "open": len(connections),
+        "idle": sum(1 for conn in connections if conn.is_idle()),
+        "http2": sum(1 for conn in connections if getattr(conn, "info", lambda: "")().startswith("HTTP/2")),
+    }
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (optional: pip install "httpx[http2]")
+        return True
+    except ImportError:
+        return False
+
+
+class GenaiClientFactory:
+    """
+    Builds one genai.Client per API key and shares it across every agent in the process.
+
+    All agents then use the same sync and async httpx pools. Chained calls, such
+    as extraction followed by consultation, reuse warm keep-alive connections
+    and TLS sessions instead of each agent opening its own.
+
+    Configured from the environment by `from_env()`:
+    - GENAI_MAX_CONNECTIONS (default 100), GENAI_MAX_KEEPALIVE (default 20)
+    - GENAI_KEEPALIVE_EXPIRY: idle seconds before a pooled connection is closed (default 60)
+    - GENAI_HTTP2: auto (default: HTTP/2 when the `h2` package is installed), 1 or 0
+    - GENAI_TIMEOUT: per-call timeout in seconds, also sent to the API as its deadline (default 120)
+    - GENAI_CONNECT_TIMEOUT: cap on connection setup in seconds (default 10)
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 60.0,
+                 http2: Optional[bool] = None, timeout: float = 120.0, connect_timeout: float = 10.0):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2_available() if http2 is None else http2 and http2_available()
+        if http2 and not self.http2:
+            print("[GenAI] HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1.")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.stats = PoolStats()
+        self._clients: Dict[str, Tuple[Any, TracedTransport, AsyncTracedTransport]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "GenaiClientFactory":
+        return cls(
+            max_connections=int(os.getenv("GENAI_MAX_CONNECTIONS", 100)),
+            max_keepalive=int(os.getenv("GENAI_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("GENAI_KEEPALIVE_EXPIRY", 60)),
+            http2={"1": True, "0": False}.get(os.getenv("GENAI_HTTP2", "auto")),
+            timeout=float(os.getenv("GENAI_TIMEOUT", 120)),
+            connect_timeout=float(os.getenv("GENAI_CONNECT_TIMEOUT", 10)),
+        )
+
+    def get(self, api_key: Optional[str] = None) -> Any:
+        """Returns the shared genai.Client for `api_key` (default: GOOGLE_API_KEY)."""
+        api_key = api_key if api_key is not None else os.getenv("GOOGLE_API_KEY", "")
+        with self._lock:
+            entry = self._clients.get(api_key)
+            if entry is None:
+                entry = self._clients[api_key] = self._build(api_key)
+            return entry[0]
+
+    def _build(self, api_key: str) -> Tuple[Any, TracedTransport, AsyncTracedTransport]:
+        from google import genai
+        from google.genai import types
+
+        transport = TracedTransport(self.stats, self.connect_timeout, limits=self.limits, http2=self.http2)
+        async_transport = AsyncTracedTransport(self.stats, self.connect_timeout, limits=self.limits, http2=self.http2)
+        # Pool limits live on the transports; the clients only route through them.
+        http_options = types.HttpOptions(
+            timeout=int(self.timeout * 1000),
+            httpx_client=httpx.Client(transport=transport),
+            httpx_async_client=httpx.AsyncClient(transport=async_transport),
+        )
+        client = genai.Client(api_key=api_key, http_options=http_options)
+        return client, transport, async_transport
+
+    def pool_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self._clients.values())
+        return {
+            "clients": len(entries),
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "timeout": self.timeout,
+            **self.stats.snapshot(),
+            "sync_pool": _sum_pool_states(transport.pool_state() for _, transport, _ in entries),
+            "async_pool": _sum_pool_states(transport.pool_state() for _, _, transport in entries),
+        }
+
+
+def _sum_pool_states(states) -> Dict[str, int]:
+    total = {"open": 0, "idle": 0, "http2": 0}
+    for state in states:
+        for key in total:
+            total[key] += state[key]
+    return total
+
+
+# Process-wide factory shared by all agents
+default_client_factory = GenaiClientFactory.from_env()
+
+
+def get_genai_client(api_key: Optional[str] = None) -> Any:
+    """The process-wide genai.Client for `api_key`, built on first use."""
+    return default_client_factory.get(api_key)
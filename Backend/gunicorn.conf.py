@@ -0,0 +1,22 @@
+# Gunicorn settings for the backend.
+#   gunicorn app:app            (picks up this file automatically from Backend/)
+#
+# Request threads only wait on futures while the LLM calls run concurrently on
+# each worker's shared event loop (see async_runtime.py), so a few processes
+# with many cheap threads hold hundreds of in-flight consultations.
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "128"))
+# Multi-page scans can spend tens of seconds in extraction + consultation.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+keepalive = 5
+
+# Agents are built on first use, so workers boot without importing google-genai.
+# GUNICORN_PRELOAD=1 instead imports the app and builds every agent once in the
+# master; workers fork with them loaded (copy-on-write) and serve immediately.
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+if preload_app:
+    os.environ.setdefault("PRELOAD_AGENTS", "1")
@@ -0,0 +1,121 @@
+import os
+import io
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+# PIL is imported on first use; building the default optimizer at import time stays cheap.
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class ImageOptimizer:
+    """
+    Shrinks images before they are sent to Gemini Vision.
+
+    Pipeline: EXIF auto-rotate -> downscale to `max_long_edge` -> optional
+    grayscale/autocontrast (for documents) -> re-encode as JPEG or WebP at
+    `quality`. If the result is not smaller than the original and no
+    rotation/resize was needed, the original bytes are kept.
+
+    Configured from the environment by `from_env()`:
+    - VISION_MAX_EDGE (default 2048), VISION_FORMAT (JPEG|WEBP, default JPEG),
+      VISION_QUALITY (default 85), VISION_GRAYSCALE / VISION_AUTOCONTRAST (0|1)
+    """
+
+    MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+    def __init__(self, max_long_edge: int = 2048, output_format: str = "JPEG", quality: int = 85,
+                 grayscale: bool = False, autocontrast: bool = False):
+        self.max_long_edge = max_long_edge
+        self.output_format = output_format.upper()
+        self.quality = quality
+        self.grayscale = grayscale
+        self.autocontrast = autocontrast
+
+    @classmethod
+    def from_env(cls) -> "ImageOptimizer":
+        return cls(
+            max_long_edge=int(os.getenv("VISION_MAX_EDGE", 2048)),
+            output_format=os.getenv("VISION_FORMAT", "JPEG"),
+            quality=int(os.getenv("VISION_QUALITY", 85)),
+            grayscale=os.getenv("VISION_GRAYSCALE", "0") == "1",
+            autocontrast=os.getenv("VISION_AUTOCONTRAST", "0") == "1",
+        )
+
+    def optimize(self, source: Union[bytes, "Image.Image"], original_size: Optional[int] = None,
+                 label: str = "image") -> Tuple[bytes, str]:
+        """
+        Returns (payload_bytes, mime_type) ready for types.Part.from_bytes.
+
+        Args:
+            source: Encoded image bytes or an opened PIL image.
+            original_size: Size of the original upload in bytes when `source` is a PIL image
+                (used for the savings log and the keep-original check).
+            label: Name used in the log line.
+        """
+        from PIL import Image, ImageOps
+
+        original_bytes = source if isinstance(source, (bytes, bytearray)) else None
+        image = Image.open(io.BytesIO(original_bytes)) if original_bytes is not None else source
+        original_format = image.format
+        if original_bytes is not None:
+            original_size = len(original_bytes)
+
+        changed = False
+        if image.getexif().get(0x0112, 1) != 1:  # EXIF Orientation
+            image = ImageOps.exif_transpose(image)
+            changed = True
+
+        if max(image.size) > self.max_long_edge:
+            image = image.copy() if not changed else image
+            image.thumbnail((self.max_long_edge, self.max_long_edge), Image.Resampling.LANCZOS)
+            changed = True
+
+        if self.grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = self._flatten(image)
+        if self.autocontrast:
+            image = ImageOps.autocontrast(image, cutoff=1)
+
+        buffer = io.BytesIO()
+        save_args = {"quality": self.quality}
+        if self.output_format == "JPEG":
+            save_args["optimize"] = True
+        elif self.output_format == "WEBP":
+            save_args["method"] = 4
+        image.save(buffer, format=self.output_format, **save_args)
+        payload = buffer.getvalue()
+        mime_type = self.MIME_TYPES.get(self.output_format, "image/jpeg")
+
+        # Flat, text-only scans can be smaller as PNG than as JPEG even after resizing.
+        if original_format == "PNG" and original_size and len(payload) > original_size:
+            png_buffer = io.BytesIO()
+            image.save(png_buffer, format="PNG", optimize=True)
+            if png_buffer.tell() < len(payload):
+                payload, mime_type = png_buffer.getvalue(), "image/png"
+
+        keep_original = (
+            original_bytes is not None
+            and not changed
+            and not (self.grayscale or self.autocontrast)
+            and len(payload) >= len(original_bytes)
+            and original_format in self.MIME_TYPES
+        )
+        if keep_original:
+            payload, mime_type = bytes(original_bytes), self.MIME_TYPES[original_format]
+
+        if original_size:
+            saved = original_size - len(payload)
+            print(f"[Optimizer] {label}: {original_size / 1024:.0f} KB -> {len(payload) / 1024:.0f} KB, "
+                  f"saved {saved / 1024:.0f} KB ({100 * saved / original_size:.0f}%), {image.size[0]}x{image.size[1]} {mime_type}")
+        return payload, mime_type
+
+    @staticmethod
+    def _flatten(image: "Image.Image") -> "Image.Image":
+        """Converts palette/alpha images to RGB on a white background (JPEG has no alpha)."""
+        from PIL import Image
+
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
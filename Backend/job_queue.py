@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class QueueFull(RuntimeError):
+    """Raised when the job queue already holds its maximum number of pending jobs."""
+
+
+class JobStore(ABC):
+    """
+    Storage interface for job records. Implement these methods to back jobs
+    with a persistent store (SQLite, Redis, ...) and pass it to JobQueue.
+
+    A job record is a plain dict:
+        id, status ("queued" | "running" | "succeeded" | "failed"),
+        created_at, started_at, finished_at, stages ({stage: seconds}),
+        result, error
+    """
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields: Any) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A snapshot of the job record: callers may read it while the job keeps running."""
+
+    @abstractmethod
+    def purge_expired(self, ttl: float) -> int:
+        """Deletes finished jobs older than `ttl` seconds; returns how many were removed."""
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local store; jobs are lost on restart and not shared between workers."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = job
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            # The worker keeps adding to the live stages dict; copy it so the
+            # response can be serialized while the job runs
+            return {**job, "stages": dict(job["stages"])}
+
+    def purge_expired(self, ttl: float) -> int:
+        cutoff = time.time() - ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.get("finished_at") and job["finished_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class JobQueue:
+    """
+    Bounded worker pool for long-running analyses.
+
+    `submit(fn)` returns a job id immediately; `fn(stages)` runs on one of
+    `max_workers` threads and must return the JSON-serializable result
+    (pydantic objects included; see structured_output.to_jsonable). It
+    records per-stage durations into the `stages` dict it receives. Jobs
+    beyond `max_pending` queued/running are rejected with QueueFull.
+    Finished jobs expire `ttl` seconds after completion.
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, max_workers: int = 4,
+                 max_pending: int = 100, ttl: float = 3600):
+        self.store = store or InMemoryJobStore()
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, store: Optional[JobStore] = None) -> "JobQueue":
+        return cls(
+            store=store,
+            max_workers=int(os.getenv("JOB_WORKERS", 4)),
+            max_pending=int(os.getenv("JOB_MAX_PENDING", 100)),
+            ttl=float(os.getenv("JOB_TTL", 3600)),
+        )
+
+    def submit(self, fn: Callable[[Dict[str, float]], Any], on_done: Optional[Callable[[], None]] = None) -> str:
+        """
+        Queues `fn` and returns the job id.
+
+        Args:
+            fn: The pipeline; called with a dict to fill with per-stage timings.
+            on_done: Cleanup hook run after the job finishes (e.g. releasing the upload buffer).
+        """
+        self.store.purge_expired(self.ttl)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"Job queue is full ({self.max_pending} pending jobs). Retry later.")
+            self._pending += 1
+
+        job_id = uuid.uuid4().hex
+        self.store.create({
+            "id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "stages": {},
+            "result": None,
+            "error": None,
+        })
+        # The job keeps the submitting request's context (telemetry labels)
+        self._executor.submit(contextvars.copy_context().run, self._run, job_id, fn, on_done)
+        return job_id
+
+    def _run(self, job_id: str, fn: Callable[[Dict[str, float]], Any], on_done: Optional[Callable[[], None]]) -> None:
+        stages: Dict[str, float] = {}
+        # In-memory stores keep this dict (get() returns copies), so GET /jobs/<id> sees stages as they finish.
+        self.store.update(job_id, status="running", started_at=time.time(), stages=stages)
+        try:
+            result = fn(stages)
+            self.store.update(job_id, status="succeeded", result=result, stages=stages, finished_at=time.time())
+        except Exception as e:
+            self.store.update(job_id, status="failed", error=str(e), stages=stages, finished_at=time.time())
+        finally:
+            with self._lock:
+                self._pending -= 1
+            if on_done is not None:
+                on_done()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job and job.get("finished_at") and job["finished_at"] < time.time() - self.ttl:
+            return None
+        return job
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+
+@contextmanager
+def timed_stage(stages: Optional[Dict[str, float]], name: str):
+    """Adds the wall-clock duration of the block to stages[name] (seconds). No-op when stages is None."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stages is not None:
+            stages[name] = round(stages.get(name, 0.0) + time.perf_counter() - start, 4)
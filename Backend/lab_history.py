@@ -0,0 +1,257 @@
+"""
+Longitudinal lab results per patient.
+
+Every report analyzed for a known patient (a `patient_id` sent by the
+client) has its LabResult rows stored in a local SQLite file, so later
+reports can be compared with earlier ones without re-uploading them:
+
+- trends(): a patient's values for some or all items over a date range,
+  with the latest change and its direction, in one indexed query
+- latest_before(): each item's most recent earlier value, used by the
+  incremental consultation mode to send the consultant only what changed
+
+Patient ids are chosen by the client, so every history also belongs to the
+caller that wrote it (PatientKey): a caller with another user scope sees a
+separate, empty history under the same patient id.
+
+Rows are keyed by (owner, patient_id, item_key, collection_date):
+re-analyzing the same report replaces its rows instead of duplicating them.
+Reports without a collection date are not stored, since their place in the
+series is unknown, and neither are results with no value, or with neither a
+unit nor a flag (no sign of a reference range): those are usually not
+measurements. The table is clustered on that key (WITHOUT ROWID), so every
+query here is one range scan of it, already in (item, date) order.
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from lab_parser import to_iso_date
+
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# A change smaller than this share of the previous value counts as stable
+STABLE_CHANGE = 0.02
+
+
+class PatientKey(NamedTuple):
+    """A patient's history: the caller's user scope and the patient id it sent."""
+
+    owner: str
+    patient_id: str
+
+
+def item_key(name: str) -> str:
+    """Matching key for an item name: "HbA1c", "HBA1C" and "Hb A1c" -> "hba1c"."""
+    return re.sub(r"[^a-z0-9]+", "", name.casefold())
+
+
+def report_date(record) -> Optional[str]:
+    """The report's collection date (ISO), or None when it has none."""
+    diagnostic = record.content.diagnostic
+    collected = to_iso_date(diagnostic.collection_date) if diagnostic is not None else None
+    return collected if collected and ISO_DATE.fullmatch(collected) else None
+
+
+def _storable(result) -> bool:
+    """A measurement worth a trend point: a value, and a unit or a flag from a reference range."""
+    return result.value is not None and bool(result.unit or result.flag) and bool(item_key(result.item))
+
+
+def _same_value(a: Optional[float], b: Optional[float]) -> bool:
+    if a is None or b is None:
+        return a is b
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+
+
+def _direction(previous: Optional[float], latest: Optional[float]) -> Optional[str]:
+    if previous is None or latest is None:
+        return None
+    if abs(latest - previous) <= STABLE_CHANGE * abs(previous):
+        return "stable"
+    return "up" if latest > previous else "down"
+
+
+class LabHistoryStore:
+    """
+    SQLite store of LabResult rows, shared by every worker process on the host.
+
+    Args:
+        path: SQLite file (created with its directory if missing).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(lab_results)")]
+            if columns and "owner" not in columns:
+                # Rows written before histories were scoped by caller cannot be
+                # attributed to one; keep them aside instead of serving them
+                conn.execute("ALTER TABLE lab_results RENAME TO lab_results_unscoped")
+                print("[History] Moved unscoped lab history rows to table lab_results_unscoped; they are not served.")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lab_results ("
+                " owner TEXT NOT NULL,"
+                " patient_id TEXT NOT NULL,"
+                " item_key TEXT NOT NULL,"
+                " collection_date TEXT NOT NULL,"
+                " item TEXT NOT NULL,"
+                " value REAL,"
+                " unit TEXT,"
+                " flag TEXT,"
+                " recorded_at REAL NOT NULL,"
+                " PRIMARY KEY (owner, patient_id, item_key, collection_date)"
+                ") WITHOUT ROWID"
+            )
+
+    @classmethod
+    def from_env(cls) -> Optional["LabHistoryStore"]:
+        """The store at LAB_HISTORY_PATH; None (history disabled) when it is unset."""
+        path = os.getenv("LAB_HISTORY_PATH")
+        return cls(path) if path else None
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process, as in SQLiteCache
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def record(self, patient: PatientKey, record) -> int:
+        """
+        Stores a MedicalRecord's lab results for the patient; returns the
+        number of rows written (0 for a report without a collection date).
+        """
+        diagnostic = record.content.diagnostic
+        date, now = report_date(record), time.time()
+        if diagnostic is None or date is None:
+            return 0
+        rows = [(*patient, item_key(result.item), date, result.item, result.value, result.unit, result.flag, now)
+                for result in diagnostic.results if _storable(result)]
+        if not rows:
+            return 0
+        conn = self._connect()
+        # One transaction per report (the connection autocommits otherwise)
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO lab_results"
+                " (owner, patient_id, item_key, collection_date, item, value, unit, flag, recorded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def latest_before(self, patient: PatientKey, item_keys: Iterable[str], date: str) -> Dict[str, Dict[str, Any]]:
+        """item_key -> the item's most recent row dated before `date`, for the given items."""
+        keys = sorted(set(item_keys))
+        if not keys:
+            return {}
+        # SQLite returns the other columns from the row holding MAX(collection_date)
+        rows = self._connect().execute(
+            "SELECT item_key, item, value, unit, flag, MAX(collection_date) FROM lab_results"
+            f" WHERE owner = ? AND patient_id = ? AND item_key IN ({', '.join('?' * len(keys))}) AND collection_date < ?"
+            " GROUP BY item_key",
+            (*patient, *keys, date)
+        ).fetchall()
+        return {key: {"item": item, "value": value, "unit": unit, "flag": flag, "date": collected}
+                for key, item, value, unit, flag, collected in rows}
+
+    def trends(self, patient: PatientKey, items: Optional[List[str]] = None, start: Optional[str] = None,
+               end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        The patient's results per item (all items when `items` is empty),
+        optionally limited to collection dates in [start, end], oldest first,
+        with the latest change and its direction (up, down or stable).
+        """
+        sql = "SELECT item_key, item, collection_date, value, unit, flag FROM lab_results WHERE owner = ? AND patient_id = ?"
+        params: List[Any] = list(patient)
+        keys = sorted({item_key(item) for item in items or []} - {""})
+        if keys:
+            sql += f" AND item_key IN ({', '.join('?' * len(keys))})"
+            params += keys
+        if start:
+            sql += " AND collection_date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND collection_date <= ?"
+            params.append(end)
+        # Primary key order: no sort step
+        sql += " ORDER BY item_key, collection_date"
+
+        # item_key -> [name as last reported, points]
+        series: Dict[str, List[Any]] = {}
+        for key, item, collected, value, unit, flag in self._connect().execute(sql, params):
+            entry = series.setdefault(key, [item, []])
+            entry[0] = item
+            entry[1].append({"date": collected, "value": value, "unit": unit, "flag": flag})
+
+        trends = []
+        for item, points in series.values():
+            latest = points[-1]
+            previous = points[-2] if len(points) > 1 else None
+            change = None
+            # Values in different units are not compared
+            if previous is not None and latest["value"] is not None and previous["value"] is not None \
+                    and (latest["unit"] or "").casefold() == (previous["unit"] or "").casefold():
+                change = latest["value"] - previous["value"]
+            values = [point["value"] for point in points if point["value"] is not None]
+            trends.append({
+                "item": item,
+                "unit": latest["unit"],
+                "points": points,
+                "latest": latest,
+                "previous": previous,
+                "change": round(change, 6) if change is not None else None,
+                "change_pct": round(100 * change / previous["value"], 2) if change is not None and previous["value"] else None,
+                "direction": _direction(previous["value"], latest["value"]) if change is not None else None,
+                "min": min(values) if values else None,
+                "max": max(values) if values else None,
+            })
+        return trends
+
+    def incremental_analysis(self, patient: PatientKey, record) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        (consultant input, summary) for the incremental mode. The input is the
+        record as JSON with only the lab results that are new or changed since
+        each item's previous value, each carrying that previous value; the
+        items that did not change are listed by name only. An undated report
+        cannot be placed in the history and is sent in full.
+        """
+        analysis = record.model_dump(mode="json")
+        diagnostic = record.content.diagnostic
+        date = report_date(record)
+        if diagnostic is None or not diagnostic.results or date is None:
+            changed = len(diagnostic.results) if diagnostic is not None else 0
+            return analysis, {"changed": changed, "unchanged": 0, "previous_report": None}
+
+        previous = self.latest_before(patient, (item_key(result.item) for result in diagnostic.results), date)
+        changed, unchanged = [], []
+        for result in diagnostic.results:
+            before = previous.get(item_key(result.item))
+            if before is not None and _same_value(result.value, before["value"]) and result.flag == before["flag"] \
+                    and (result.unit or "").casefold() == (before["unit"] or "").casefold():
+                unchanged.append(result.item)
+                continue
+            row = result.model_dump(mode="json")
+            if before is not None:
+                row["previous"] = {"value": before["value"], "unit": before["unit"], "flag": before["flag"], "date": before["date"]}
+            changed.append(row)
+
+        analysis["content"]["diagnostic"]["results"] = changed
+        if unchanged:
+            analysis["content"]["diagnostic"]["unchanged_since_previous_report"] = unchanged
+        last = max((before["date"] for before in previous.values()), default=None)
+        if last is not None:
+            analysis["history_note"] = (f"Only results that are new or changed since the patient's earlier reports "
+                                        f"(latest {last}) are listed, with their previous values.")
+        return analysis, {"changed": len(changed), "unchanged": len(unchanged), "previous_report": last}
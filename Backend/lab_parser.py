@@ -0,0 +1,383 @@
+"""
+Deterministic lab-value extraction from loader text.
+
+Many text PDFs (and DOCX tables) from large labs list results one per row:
+"Test  Value  Unit  Reference range  Flag". LabTextParser reads those rows
+with regex layouts from a plug-in registry, picks up the usual header
+fields (patient, MRN, dates, referring doctor) and reports how much of the
+document it understood, so the extractor can skip the LLM call for
+confident parses or send it only the unparsed remainder.
+
+Register another layout with:
+
+    @register_layout
+    class MyLabLayout(LabLayout):
+        name = "my_lab"
+        def parse_row(self, line): ...
+"""
+import os
+import re
+import datetime
+from typing import Dict, List, Optional, Type
+
+# Bump when parsing rules change; part of the extraction cache key.
+LAB_PARSER_VERSION = "3"
+
+# Grouped thousands, western ("11,800", "250,000") or Indian lakh ("2,50,000")
+GROUPED_NUMBER = r"\d{1,3}(?:,\d{2,3})*,\d{3}(?:\.\d+)?"
+# Otherwise a decimal point, or a decimal comma followed by one or two digits ("4,5")
+NUMBER = rf"(?:{GROUPED_NUMBER}|\d+(?:\.\d+|,\d{{1,2}}(?!\d))?)"
+# A unit: a ratio or power ("g/dL", "10^3/uL", "x10^9/L", "mL/min/1.73m2"), "%" or a bare unit name
+BARE_UNITS = r"g|mg|ug|µg|ng|pg|fL|U|IU|mIU|uIU|mEq|mmHg|sec|secs|s|min|ratio|index|cells|copies|ppm"
+UNIT = rf"(?:x\s?)?[\w^µμ.*]+(?:/[\w^µμ.]+)+|%|(?:{BARE_UNITS})\b"
+RANGE = rf"(?P<low>{NUMBER})\s*(?:-|–|to)\s*(?P<high>{NUMBER})|(?P<lt><|<=|≤)\s*(?P<upper>{NUMBER})|(?P<gt>>|>=|≥)\s*(?P<lower>{NUMBER})"
+FLAG = r"H|L|HH|LL|HIGH|LOW|High|Low|Normal|NORMAL|N|\*"
+
+FLAG_NAMES = {"H": "High", "HH": "High", "HIGH": "High", "*": None,
+              "L": "Low", "LL": "Low", "LOW": "Low", "N": "Normal", "NORMAL": "Normal"}
+
+# Column header words, page markers and similar lines that carry no data
+HEADER_WORDS = {"test", "tests", "investigation", "parameter", "analyte", "result", "results", "value",
+                "unit", "units", "reference", "range", "interval", "flag", "normal", "biological"}
+NOISE = re.compile(r"^(?:-{2,}\s*page\s+\d+.*|\*+\s*end of (?:page|report)\s*\**|page\s+\d+(?:\s+of\s+\d+)?|[-=_*\s]+)$", re.I)
+# A line that looks like it holds a result: a name, then a (possibly qualified) number.
+# Sentences ending in a full stop are treated as notes.
+CANDIDATE = re.compile(rf"^[^\d\s].*?[\s:|][<>≤≥]?=?\s*{NUMBER}(?!.*\.$)")
+MAX_ITEM_WORDS = 6
+# Labels of numbered header/letterhead lines that are not tests: addresses
+# ("Plot 42, Sector 14, Gurgaon 122001"), ward/room/bed, contact numbers and
+# IDs. No "ph" for phone: pH is a test.
+NON_RESULT_LABEL = re.compile(
+    r"\b(?:plot|sector|street|road|lane|avenue|nagar|colony|floor|flat|house|building|apartment|district|"
+    r"pin(?:code)?|zip|postal|ward|room|bed|cabin|opd|ipd|phone|mobile|mob|tel|telephone|fax|contact|"
+    r"id|no|number|reg(?:istration)?|receipt|bill|invoice|barcode|accession|age|page)\b",
+    re.I,
+)
+
+FIELD_PATTERNS = {
+    "patient_name": re.compile(r"\bpatient(?:\s+name)?\s*:\s*(?P<value>.+?)(?=\s{2,}|\s+(?:MRN|ID|Age|Sex|DOB)\b|$)", re.I),
+    "patient_id": re.compile(r"\b(?:MRN|UHID|patient\s+id|lab\s+no\.?|sample\s+id)\s*[:#]?\s*(?P<value>[\w-]+)", re.I),
+    "dob": re.compile(r"\b(?:DOB|date\s+of\s+birth)\s*:\s*(?P<value>[\d/.-]+)", re.I),
+    "collection_date": re.compile(r"\b(?:collected(?:\s+on)?|collection\s+date|sample\s+date|specimen\s+date)\s*:\s*(?P<value>[\d/.-]+)", re.I),
+    "reported": re.compile(r"\breported(?:\s+on)?\s*:\s*(?P<value>[\d/.-]+)", re.I),
+    "doctor": re.compile(r"\b(?:ref(?:erred)?\.?\s*by|referring\s+(?:doctor|physician)|consultant)\s*:\s*(?P<value>.+?)(?=\s{2,}|$)", re.I),
+}
+FACILITY = re.compile(r"\b(?:LAB(?:ORATORY|ORATORIES|S)?|DIAGNOSTICS?|PATHOLOGY|HOSPITAL|CLINIC|HEALTHCARE)\b")
+
+
+def _number(text: str) -> float:
+    if re.fullmatch(GROUPED_NUMBER, text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+
+def _unambiguous(*texts: Optional[str]) -> bool:
+    """
+    False when a row mixes a decimal comma ("4,5") with a decimal point or
+    grouped thousands: then it is unclear which convention the lab used.
+    """
+    texts = [text for text in texts if text]
+    if not any("," in text and not re.fullmatch(GROUPED_NUMBER, text) for text in texts):
+        return True
+    return not any("." in text or re.fullmatch(GROUPED_NUMBER, text) for text in texts)
+
+
+def to_iso_date(text: Optional[str]) -> Optional[str]:
+    """2024-05-01, 01/05/2024 or 01-05-2024 (day first) as an ISO date; other text unchanged."""
+    if not text:
+        return None
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y"):
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return text
+
+
+class LabRow:
+    """One parsed result row."""
+
+    __slots__ = ("item", "value", "unit", "low", "high", "flag", "line")
+
+    def __init__(self, item: str, value: float, unit: Optional[str] = None, low: Optional[float] = None,
+                 high: Optional[float] = None, flag: Optional[str] = None, line: str = ""):
+        self.item = item
+        self.value = value
+        self.unit = unit
+        self.low = low
+        self.high = high
+        self.flag = flag
+        self.line = line
+
+    @property
+    def is_result(self) -> bool:
+        """
+        A measurement, not just "label number": it has a unit or a reference
+        range. "Ward 3" or "Room 12" read as rows otherwise.
+        """
+        return bool(self.unit) or self.low is not None or self.high is not None
+
+    @property
+    def status(self) -> Optional[str]:
+        """High/Low/Normal: the printed flag, else derived from the reference range."""
+        if self.flag:
+            return self.flag
+        if self.high is not None and self.value > self.high:
+            return "High"
+        if self.low is not None and self.value < self.low:
+            return "Low"
+        if self.low is not None or self.high is not None:
+            return "Normal"
+        return None
+
+    def __repr__(self) -> str:
+        return f"LabRow({self.item!r}, {self.value!r}, {self.unit!r}, {self.status!r})"
+
+
+class LabLayout:
+    """
+    A row format. parse_row() returns a LabRow, or None when the line is not
+    a row of this layout. A new instance parses each document, so layouts may
+    keep per-document state (e.g. column order from a header row).
+    """
+
+    name = "base"
+
+    def parse_row(self, line: str) -> Optional[LabRow]:
+        raise NotImplementedError
+
+    @staticmethod
+    def _row_from_match(match: "re.Match", line: str) -> Optional[LabRow]:
+        item = " ".join(match.group("item").split()).strip(" .:-")
+        if not item or item.lower() in HEADER_WORDS or len(item.split()) > MAX_ITEM_WORDS \
+                or NON_RESULT_LABEL.search(item):
+            return None
+        if not _unambiguous(*match.group("value", "low", "high", "upper", "lower")):
+            return None
+        low = high = None
+        if match.group("low"):
+            low, high = _number(match.group("low")), _number(match.group("high"))
+        elif match.group("upper"):
+            high = _number(match.group("upper"))
+        elif match.group("lower"):
+            low = _number(match.group("lower"))
+        flag = match.group("flag")
+        return LabRow(item, _number(match.group("value")), match.group("unit"), low, high,
+                      FLAG_NAMES.get(flag.upper(), flag) if flag else None, line)
+
+
+LAYOUTS: Dict[str, Type[LabLayout]] = {}
+
+
+def register_layout(layout: Type[LabLayout]) -> Type[LabLayout]:
+    """Adds a layout to the registry (usable as a class decorator)."""
+    LAYOUTS[layout.name] = layout
+    return layout
+
+
+@register_layout
+class ColumnLayout(LabLayout):
+    """Aligned columns: "Hemoglobin   9.7  g/dL   12.0-17.5   L" (any whitespace between columns)."""
+
+    name = "columns"
+    pattern = re.compile(
+        rf"^(?P<item>[^\d\s|:][^:|]*?)\s+(?P<value>{NUMBER})(?:\s*(?P<unit>{UNIT}))?"
+        rf"(?:\s+\(?(?:{RANGE})\)?)?(?:\s+(?P<flag>{FLAG}))?\s*$"
+    )
+
+    def parse_row(self, line: str) -> Optional[LabRow]:
+        match = self.pattern.match(line) if "|" not in line else None
+        return self._row_from_match(match, line) if match else None
+
+
+@register_layout
+class ColonLayout(LabLayout):
+    """Label-colon rows: "Hemoglobin: 9.7 g/dL (Ref: 12.0-17.5) Low"."""
+
+    name = "colon"
+    pattern = re.compile(
+        rf"^(?P<item>[^\d\s|:][^:|]*?)\s*:\s*(?P<value>{NUMBER})(?:\s*(?P<unit>{UNIT}))?"
+        rf"(?:\s*[\[(]?\s*(?:ref(?:erence)?(?:\s+range)?\s*:?\s*)?(?:{RANGE})\s*[\])]?)?(?:\s+(?P<flag>{FLAG}))?\s*$",
+        re.I,
+    )
+
+    def parse_row(self, line: str) -> Optional[LabRow]:
+        match = self.pattern.match(line)
+        return self._row_from_match(match, line) if match else None
+
+
+@register_layout
+class PipeTableLayout(LabLayout):
+    """
+    Table rows as written by docx_reader: "Hemoglobin | 9.7 | g/dL | 12.0-17.5".
+
+    Column roles come from a header row ("Test | Result | Unit | Reference")
+    when one is seen, otherwise from the order test, result, unit, range, flag.
+    """
+
+    name = "pipe_table"
+    ROLES = {"item": ("test", "investigation", "parameter", "analyte", "name", "description"),
+             "value": ("result", "value", "observed"),
+             "unit": ("unit",),
+             "range": ("reference", "range", "interval", "normal", "biological"),
+             "flag": ("flag", "status", "remark")}
+    VALUE = re.compile(rf"^(?P<value>{NUMBER})(?:\s*(?P<unit>{UNIT}))?$")
+    RANGE_CELL = re.compile(rf"^\(?(?:{RANGE})\)?$")
+
+    def __init__(self):
+        self.columns = ["item", "value", "unit", "range", "flag"]
+
+    def _header_roles(self, cells: List[str]) -> Optional[List[Optional[str]]]:
+        roles = []
+        for cell in cells:
+            words = cell.lower().split()
+            roles.append(next((role for role, names in self.ROLES.items() if any(w in names for w in words)), None))
+        return roles if "item" in roles and "value" in roles else None
+
+    def parse_row(self, line: str) -> Optional[LabRow]:
+        if " | " not in line:
+            return None
+        cells = [cell.strip() for cell in line.split(" | ")]
+        roles = self._header_roles(cells)
+        if roles:
+            self.columns = roles
+            return None
+        fields = {role: cell for role, cell in zip(self.columns, cells) if role and cell}
+        item, value = fields.get("item"), self.VALUE.match(fields.get("value", ""))
+        if not item or not value or item.lower() in HEADER_WORDS or NON_RESULT_LABEL.search(item):
+            return None
+        unit = fields.get("unit") or value.group("unit")
+        low = high = None
+        range_match = self.RANGE_CELL.match(fields.get("range", ""))
+        if range_match and not _unambiguous(value.group("value"), *range_match.group("low", "high", "upper", "lower")):
+            return None
+        if range_match:
+            if range_match.group("low"):
+                low, high = _number(range_match.group("low")), _number(range_match.group("high"))
+            elif range_match.group("upper"):
+                high = _number(range_match.group("upper"))
+            elif range_match.group("lower"):
+                low = _number(range_match.group("lower"))
+        flag = fields.get("flag")
+        flag = FLAG_NAMES.get(flag.upper(), flag) if flag else None
+        return LabRow(" ".join(item.split()), _number(value.group("value")), unit, low, high, flag, line)
+
+
+class LabParse:
+    """Result of parsing one document's text."""
+
+    def __init__(self, layout: Optional[str], rows: List[LabRow], fields: Dict[str, str],
+                 unparsed_rows: List[str], notes: List[str], facility: Optional[str]):
+        self.layout = layout
+        self.rows = rows
+        self.fields = fields
+        # Lines that look like results but matched no layout
+        self.unparsed_rows = unparsed_rows
+        # Other unrecognized text (interpretation, comments, addresses)
+        self.notes = notes
+        self.facility = facility
+
+    @property
+    def coverage(self) -> float:
+        """Share of result-like lines that were parsed."""
+        total = len(self.rows) + len(self.unparsed_rows)
+        return len(self.rows) / total if total else 0.0
+
+    def remainder(self) -> str:
+        """Everything except the parsed rows, for an LLM pass over what the parser did not read."""
+        return "\n".join(self.unparsed_rows + self.notes)
+
+
+class LabTextParser:
+    """
+    Parses loader text with every registered layout and keeps the one that
+    reads the most rows.
+
+    `min_results` and `min_coverage` decide whether a parse is confident
+    enough to replace the LLM extraction (see is_confident()); notes longer
+    than `max_note_chars` are still sent to the LLM.
+    """
+
+    def __init__(self, layouts: Optional[List[Type[LabLayout]]] = None, min_results: int = 3,
+                 min_coverage: float = 0.9, max_note_chars: int = 400):
+        self.layouts = layouts
+        self.min_results = min_results
+        self.min_coverage = min_coverage
+        self.max_note_chars = max_note_chars
+
+    @classmethod
+    def from_env(cls) -> "LabTextParser":
+        return cls(
+            min_results=int(os.getenv("LOCAL_EXTRACTION_MIN_RESULTS", 3)),
+            min_coverage=float(os.getenv("LOCAL_EXTRACTION_MIN_COVERAGE", 0.9)),
+            max_note_chars=int(os.getenv("LOCAL_EXTRACTION_MAX_NOTE_CHARS", 400)),
+        )
+
+    @staticmethod
+    def _is_header(line: str) -> bool:
+        """A column-header line: mostly header words ("TEST RESULT UNIT REFERENCE FLAG"), no numbers."""
+        words = re.findall(r"[a-z]+", line.lower())
+        known = sum(1 for word in words if word in HEADER_WORDS)
+        return known >= 2 and known * 2 >= len(words) and not re.search(NUMBER, line)
+
+    @staticmethod
+    def _fields(line: str, fields: Dict[str, str]) -> bool:
+        """Records header fields found in `line`; True when the line held any."""
+        found = False
+        for name, pattern in FIELD_PATTERNS.items():
+            match = pattern.search(line)
+            if match:
+                found = True
+                fields.setdefault(name, match.group("value").strip())
+        return found
+
+    @staticmethod
+    def _is_label_line(line: str) -> bool:
+        """An address, ward/room or ID line: the text before its first number names no test."""
+        head = re.split(r"\d", line, maxsplit=1)[0]
+        return bool(NON_RESULT_LABEL.search(head))
+
+    def _parse_with(self, layout: LabLayout, lines: List[str]) -> LabParse:
+        rows: List[LabRow] = []
+        fields: Dict[str, str] = {}
+        unparsed: List[str] = []
+        notes: List[str] = []
+        facility = None
+        for line in lines:
+            if not line or NOISE.match(line) or self._is_header(line):
+                continue
+            if self._fields(line, fields):
+                continue
+            row = layout.parse_row(line)
+            if row is not None and row.is_result:
+                rows.append(row)
+            elif line.isupper() and FACILITY.search(line) and (facility is None and not rows or line.title() == facility):
+                # Letterhead; repeated on every page of long reports
+                facility = line.title()
+            elif CANDIDATE.match(line) and not self._is_label_line(line):
+                # Includes "name number" rows without unit or range: left to the model
+                unparsed.append(line)
+            elif line not in notes:
+                notes.append(line)
+        return LabParse(layout.name, rows, fields, unparsed, notes, facility)
+
+    def parse(self, text: str) -> LabParse:
+        lines = [" ".join(line.split()) if " | " in line else line.strip() for line in text.splitlines()]
+        best = None
+        for layout_class in self.layouts or LAYOUTS.values():
+            result = self._parse_with(layout_class(), lines)
+            if best is None or (len(result.rows), result.coverage) > (len(best.rows), best.coverage):
+                best = result
+        return best if best is not None else LabParse(None, [], {}, [], [line for line in lines if line], None)
+
+    def is_confident(self, result: LabParse) -> bool:
+        """
+        Enough rows, and almost every result-like line was read. Only rows
+        with a unit or reference range are kept as rows, so "label number"
+        lines never make a parse confident.
+        """
+        return len(result.rows) >= self.min_results and result.coverage >= self.min_coverage
+
+    def needs_llm_for_remainder(self, result: LabParse) -> bool:
+        """Confident parse that still left results or substantial text unread."""
+        return bool(result.unparsed_rows) or sum(len(note) for note in result.notes) > self.max_note_chars
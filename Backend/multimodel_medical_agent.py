@@ -1,10 +1,13 @@
 import os
 import json
+import asyncio
+import hashlib
 import datetime
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List, Optional, Union
+from typing import Any, List, Optional, Tuple, Union
 from pydantic import BaseModel, Field
-from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
@@ -12,6 +15,14 @@ load_dotenv()
 
 # Import our loader
 from document_loader import SmartLoader
+from upload_buffer import UploadedFile
+from cache_store import TieredCache, tiered_cache_from_env
+from genai_client import get_genai_client
+from gemini_governor import GeminiGovernor, default_governor
+from single_flight import SingleFlight, default_single_flight
+from structured_output import LoaderError, ModelCallError, ModelOutputError, parse_response, validate_json
+from lab_parser import LAB_PARSER_VERSION, LabParse, LabTextParser, to_iso_date
+import telemetry
 
 # --- STRICT SCHEMA DEFINITION ---
 
@@ -71,14 +82,86 @@ class MedicalRecord(BaseModel):
     content: ContentSection
     summary: str
 
+# Changes whenever the MedicalRecord schema changes, so cached extractions from
+# an older schema are never served.
+MEDICAL_RECORD_SCHEMA_VERSION = hashlib.sha256(
+    json.dumps(MedicalRecord.model_json_schema(), sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+
+def _dedupe_key(value: Any) -> Any:
+    """Equality key for merging: case/whitespace-insensitive strings, field-wise for models."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, BaseModel):
+        return tuple(_dedupe_key(item) for _, item in value)
+    return value
+
+
+def _merge_parts(parts: List[Optional[BaseModel]]) -> Optional[BaseModel]:
+    """Field-wise merge of one section across partial records: first non-null value, lists unioned in order."""
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    fields = {}
+    for name in type(parts[0]).model_fields:
+        values = [getattr(part, name) for part in parts]
+        if isinstance(values[0], list):
+            seen, union = set(), []
+            for item in (item for value in values for item in value):
+                key = _dedupe_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    union.append(item)
+            fields[name] = union
+        else:
+            fields[name] = next((value for value in values if value is not None), None)
+    return type(parts[0])(**fields)
+
+
+def merge_records(records: List[MedicalRecord]) -> MedicalRecord:
+    """
+    Combines the partial records of one document's page groups, given in page order.
+
+    Lab results and list fields (e.g. diagnoses) are unioned without
+    duplicates, other fields take the first value found, and meta comes from
+    the most confident part (the earliest one on ties). The result depends
+    only on the records and their order, not on which call finished first.
+    """
+    return MedicalRecord(
+        meta=max(records, key=lambda record: record.meta.confidence).meta,
+        patient=_merge_parts([record.patient for record in records]),
+        provider=_merge_parts([record.provider for record in records]),
+        content=ContentSection(**{
+            name: _merge_parts([getattr(record.content, name) for record in records])
+            for name in ContentSection.model_fields
+        }),
+        summary=" ".join(dict.fromkeys(record.summary.strip() for record in records if record.summary.strip())),
+    )
+
 # --- AGENT ARCHITECTURE ---
 
 class MultimodalMedicalAgent:
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", cache: Optional[TieredCache] = None,
+                 governor: Optional[GeminiGovernor] = None, single_flight: Optional[SingleFlight] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = get_genai_client(self.api_key)
         self.model_name = model_name
         self.loader = SmartLoader()
+        # Content-addressed extraction cache (memory LRU + optional shared SQLite tier).
+        # Memory tier is bounded by total cached JSON length (default ~64 MB).
+        self.cache = cache if cache is not None else tiered_cache_from_env("EXTRACTION", maxsize=64 * 1024 * 1024, getsizeof=len)
+        # Shared rate limits, retries and circuit breaker for outbound Gemini calls
+        self.governor = governor or default_governor
+        # Concurrent uploads of the same file share one extraction
+        self.single_flight = single_flight or default_single_flight
+        # Text reports with plain result tables are read locally; the model only
+        # sees what the parser could not read (LOCAL_EXTRACTION=0 disables this)
+        self.lab_parser = LabTextParser.from_env() if os.getenv("LOCAL_EXTRACTION", "1") == "1" else None
+        # Scanned PDFs longer than this many pages are extracted in page groups
+        # of this size, up to `chunk_concurrency` at a time (0 = one call per file)
+        self.chunk_pages = int(os.getenv("EXTRACTION_CHUNK_PAGES", 8))
+        self.chunk_concurrency = max(1, int(os.getenv("EXTRACTION_CHUNK_CONCURRENCY", 4)))
 
         self.system_instruction = """
 ### ROLE
@@ -95,33 +178,313 @@ You are an expert Medical AI Agent. You accept input as raw text, images (scans)
 - Maintain patient privacy (Extract entities exactly).
 """
 
-    def analyze_file(self, file_path: str) -> str:
-        print(f"--- Processing: {file_path} ---")
+    def _cache_key(self, file_digest: str) -> str:
+        """Key = file bytes + everything that shapes the model output."""
+        parts = [
+            file_digest,
+            self.model_name,
+            hashlib.sha256(self.system_instruction.encode("utf-8")).hexdigest(),
+            MEDICAL_RECORD_SCHEMA_VERSION,
+        ]
+        if self.lab_parser is not None:
+            parser = self.lab_parser
+            parts.append(f"lab-parser:{LAB_PARSER_VERSION}:{parser.min_results}:{parser.min_coverage}:{parser.max_note_chars}")
+        if self.chunk_pages > 0:
+            parts.append(f"chunk-pages:{self.chunk_pages}")
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _file_digest(file_path: str) -> str:
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _flight_key(self, source: Union[str, UploadedFile]) -> Optional[str]:
+        try:
+            digest = source.sha256 if isinstance(source, UploadedFile) else self._file_digest(source)
+        except OSError:
+            return None
+        return "extract:" + self._cache_key(digest)
+
+    def _generation_config(self) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            system_instruction=self.system_instruction,
+            response_mime_type="application/json",
+            response_schema=MedicalRecord,
+            temperature=0.1
+        )
+
+    def _prepare_request(self, source: Union[str, UploadedFile]) -> Tuple[Optional[str], Optional[MedicalRecord], Any]:
+        """
+        Cache lookup + file loading shared by the sync and async paths.
+        `source` is a file path or an UploadedFile (already hashed while buffering).
+
+        Returns:
+            (cache_key, cached_record, contents): cached_record is returned
+            as-is when set; otherwise contents is the Gemini payload list.
+            Raises LoaderError when the file cannot be loaded.
+        """
+        # 0. Serve repeat uploads from the extraction cache
+        cache_key = None
+        try:
+            if isinstance(source, UploadedFile):
+                name, digest = source.filename, source.sha256
+            else:
+                name, digest = os.path.basename(source), self._file_digest(source)
+            cache_key = self._cache_key(digest)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"[Cache] Extraction cache hit for '{name}'.")
+                return cache_key, validate_json(MedicalRecord, cached), None
+        except OSError:
+            # Missing/unreadable files are reported by the loader below.
+            pass
+        except ModelOutputError:
+            # Entry written before extractions were validated; extract again.
+            pass
         
         # 1. Load File using SmartLoader
         try:
-            content_payload: Union[str, types.Part, None] = self.loader.process_file(file_path)
-            if content_payload is None:
-                return json.dumps({"error": "Failed to load file"})
+            with telemetry.span("load", agent="extractor"):
+                content_payload: Union[str, types.Part, List[Union[str, types.Part]], None] = self.loader.process_file(source)
+                if content_payload is not None:
+                    telemetry.record_document(SmartLoader.strategy(content_payload))
         except Exception as e:
-            return json.dumps({"error": f"Loader Error: {str(e)}"})
+            raise LoaderError(f"Loader Error: {str(e)}") from e
+        if content_payload is None:
+            raise LoaderError("Failed to load file")
 
-        # 2. Call Gemini
+        # content_payload can be a string (for text), types.Part (for image/pdf bytes)
+        # or a list of both (mixed PDFs: text pages + scanned pages)
+        if isinstance(content_payload, list):
+            return cache_key, None, content_payload
+        return cache_key, None, [content_payload]
+
+    def _local_extraction(self, cache_key: Optional[str], contents: Any) -> Tuple[Optional[MedicalRecord], Any, Optional[LabParse]]:
+        """
+        Runs the local lab parser over text-only payloads.
+
+        Returns:
+            (record, contents, parsed): record is set when the parser read the
+            whole document (it is cached like a model extraction). Otherwise
+            contents is what to send to the model: only the unparsed remainder
+            when `parsed` is set, the full document when it is None.
+        """
+        if self.lab_parser is None or not all(isinstance(part, str) for part in contents):
+            return None, contents, None
+        with telemetry.span("local_parse", agent="extractor"):
+            parsed = self.lab_parser.parse("\n".join(contents))
+        if not self.lab_parser.is_confident(parsed):
+            telemetry.record_local_extraction("llm", 0)
+            return None, contents, None
+        if not self.lab_parser.needs_llm_for_remainder(parsed):
+            telemetry.record_local_extraction("local", len(parsed.rows))
+            print(f"[Local] Extracted {len(parsed.rows)} lab results without a model call.")
+            record = self._record_from_parse(parsed)
+            if cache_key is not None:
+                self.cache.set(cache_key, record.model_dump_json())
+            return record, None, parsed
+        telemetry.record_local_extraction("remainder", len(parsed.rows))
+        print(f"[Local] Extracted {len(parsed.rows)} lab results; sending the unparsed remainder to the model.")
+        remainder = (f"{len(parsed.rows)} lab result rows of this document were already extracted and are omitted. "
+                     f"Classify the document and extract what remains:\n\n{parsed.remainder()}")
+        return None, [remainder], parsed
+
+    @staticmethod
+    def _lab_results(parsed: LabParse) -> List[LabResult]:
+        return [LabResult(item=row.item, value=row.value, unit=row.unit, flag=row.status) for row in parsed.rows]
+
+    @classmethod
+    def _record_from_parse(cls, parsed: LabParse) -> MedicalRecord:
+        """A Diagnostic MedicalRecord built from a complete local parse."""
+        results = cls._lab_results(parsed)
+        abnormal = [f"{r.item} {r.value:g}{f' {r.unit}' if r.unit else ''} ({r.flag})" for r in results if r.flag in ("High", "Low")]
+        summary = f"Lab report with {len(results)} results; " + (
+            f"{len(abnormal)} outside the reference range: {', '.join(abnormal)}." if abnormal else "all within the reference range.")
+        if parsed.notes:
+            summary += " " + " ".join(parsed.notes)
+        fields = parsed.fields
+        return MedicalRecord(
+            meta=MetaData(doc_type=DocType.DIAGNOSTIC, confidence=round(parsed.coverage, 2)),
+            patient=PatientInfo(name=fields.get("patient_name"), id=fields.get("patient_id"), dob=to_iso_date(fields.get("dob"))),
+            provider=ProviderInfo(name=fields.get("doctor"), facility=parsed.facility),
+            content=ContentSection(diagnostic=DiagnosticContent(
+                collection_date=to_iso_date(fields.get("collection_date")), results=results)),
+            summary=summary,
+        )
+
+    @classmethod
+    def _merge_parse(cls, record: MedicalRecord, parsed: LabParse) -> MedicalRecord:
+        """
+        Adds locally parsed results (first, in document order) to a remainder
+        extraction. Header fields also come from the parse: the header lines
+        were not in the remainder the model saw.
+        """
+        local = cls._record_from_parse(parsed)
+        diagnostic = record.content.diagnostic or DiagnosticContent()
+        seen = {result.item.casefold() for result in local.content.diagnostic.results}
+        diagnostic.results = local.content.diagnostic.results + [r for r in diagnostic.results if r.item.casefold() not in seen]
+        diagnostic.collection_date = local.content.diagnostic.collection_date or diagnostic.collection_date
+        record.content.diagnostic = diagnostic
+        for target, source in ((record.patient, local.patient), (record.provider, local.provider)):
+            for name, value in source:
+                if value is not None:
+                    setattr(target, name, value)
+        return record
+
+    def _store_response(self, cache_key: Optional[str], response, parsed: Optional[LabParse] = None) -> MedicalRecord:
+        """
+        Validates the response (raising ModelOutputError) and caches only valid extractions.
+        `parsed` is the local parse whose remainder the model extracted; its results are merged in.
+        """
+        with telemetry.span("validate", agent="extractor"):
+            record = parse_response(response, MedicalRecord)
+            if parsed is not None:
+                record = self._merge_parse(record, parsed)
+        if cache_key is not None:
+            self.cache.set(cache_key, response.text if parsed is None else record.model_dump_json())
+        return record
+
+    def _chunk_request(self, contents: Any) -> Optional[List[List[Any]]]:
+        """
+        Splits a Vision PDF payload longer than `chunk_pages` into page
+        groups; returns one contents list per group, or None to send it whole.
+
+        The payload is either a scanned PDF alone or, for mixed PDFs, the text
+        pages followed by a trimmed PDF of the scanned pages. In the mixed case
+        only the trimmed PDF is split: the first group also carries the text
+        (its page markers name the attached pages), later groups only their
+        attached pages.
+        """
+        if self.chunk_pages <= 0 or not contents or isinstance(contents[-1], str) \
+                or not all(isinstance(part, str) for part in contents[:-1]):
+            return None
+        with telemetry.span("split", agent="extractor"):
+            groups = SmartLoader.split_pdf_part(contents[-1], self.chunk_pages)
+        if not groups:
+            return None
+        pages, text = groups[-1][1], list(contents[:-1])
+        print(f"[Chunked] Extracting {pages} {'scanned ' if text else ''}pages in {len(groups)} groups of up to {self.chunk_pages} pages.")
+        if not text:
+            return [[f"Pages {first}-{last} of a {pages}-page document. Extract what appears on these pages.", part]
+                    for first, last, part in groups]
+        return [
+            (text if first == 1 else []) + [
+                f"Attached PDF pages {first}-{last} of the {pages} scanned pages of this document. "
+                f"Extract what appears on these pages{' and in the text above' if first == 1 else ''}.", part]
+            for first, last, part in groups
+        ]
+
+    def _store_chunks(self, cache_key: Optional[str], responses: List[Any]) -> MedicalRecord:
+        """Validates every page group's response and caches the merged record."""
+        with telemetry.span("validate", agent="extractor"):
+            record = merge_records([parse_response(response, MedicalRecord) for response in responses])
+        if cache_key is not None:
+            self.cache.set(cache_key, record.model_dump_json())
+        return record
+
+    def _call_model(self, contents: List[Any]) -> Any:
+        try:
+            return self.governor.generate_content(
+                self.client,
+                model=self.model_name,
+                contents=contents,
+                config=self._generation_config()
+            )
+        except Exception as e:
+            raise ModelCallError(f"API Error: {str(e)}") from e
+
+    async def _call_model_async(self, contents: List[Any]) -> Any:
         try:
-            # content_payload can be a string (for text) or types.Part (for image/pdf bytes)
-            contents_list = [content_payload] 
-            
-            response = self.client.models.generate_content(
+            return await self.governor.generate_content_async(
+                self.client,
                 model=self.model_name,
-                contents=contents_list, 
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                    response_mime_type="application/json",
-                    response_schema=MedicalRecord,
-                    temperature=0.1
-                )
+                contents=contents,
+                config=self._generation_config()
             )
-            return response.text
-            
         except Exception as e:
-            return json.dumps({"error": f"API Error: {str(e)}"})
\ No newline at end of file
+            raise ModelCallError(f"API Error: {str(e)}") from e
+
+    def _extract_chunks(self, chunks: List[List[Any]]) -> List[Any]:
+        """Runs the page-group calls on a thread pool; raises the first failure in page order."""
+        contexts = [contextvars.copy_context() for _ in chunks]
+        with telemetry.span("llm", agent="extractor"):
+            with ThreadPoolExecutor(max_workers=min(self.chunk_concurrency, len(chunks)), thread_name_prefix="extract-chunk") as pool:
+                return list(pool.map(lambda context, chunk: context.run(self._call_model, chunk), contexts, chunks))
+
+    async def _extract_chunks_async(self, chunks: List[List[Any]]) -> List[Any]:
+        """Async variant of _extract_chunks()."""
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+
+        async def extract(chunk: List[Any]) -> Any:
+            async with semaphore:
+                return await self._call_model_async(chunk)
+
+        with telemetry.span("llm", agent="extractor"):
+            responses = await asyncio.gather(*(extract(chunk) for chunk in chunks), return_exceptions=True)
+        for response in responses:
+            if isinstance(response, BaseException):
+                raise response
+        return responses
+
+    @staticmethod
+    def _display_name(source: Union[str, UploadedFile]) -> str:
+        return source.filename if isinstance(source, UploadedFile) else source
+
+    def analyze_file(self, source: Union[str, UploadedFile]) -> MedicalRecord:
+        """
+        Extracts a validated MedicalRecord from a file path or an UploadedFile.
+
+        Raises:
+            LoaderError, ModelCallError or ModelOutputError (all AgentError).
+        """
+        print(f"--- Processing: {self._display_name(source)} ---")
+        key = self._flight_key(source)
+        if key is None:
+            return self._analyze_file(source)
+        return self.single_flight.do(key, lambda: self._analyze_file(source), result_type=MedicalRecord)
+
+    def _analyze_file(self, source: Union[str, UploadedFile]) -> MedicalRecord:
+
+        cache_key, cached_record, contents_list = self._prepare_request(source)
+        if cached_record is not None:
+            return cached_record
+        local_record, contents_list, parsed = self._local_extraction(cache_key, contents_list)
+        if local_record is not None:
+            return local_record
+        chunks = self._chunk_request(contents_list)
+        if chunks:
+            return self._store_chunks(cache_key, self._extract_chunks(chunks))
+
+        # 2. Call Gemini
+        with telemetry.span("llm", agent="extractor"):
+            response = self._call_model(contents_list)
+        return self._store_response(cache_key, response, parsed)
+
+    async def analyze_file_async(self, source: Union[str, UploadedFile]) -> MedicalRecord:
+        """Async variant of analyze_file(); file loading runs in a worker thread."""
+        print(f"--- Processing (async): {self._display_name(source)} ---")
+        key = await asyncio.to_thread(self._flight_key, source)
+        if key is None:
+            return await self._analyze_file_async(source)
+        return await self.single_flight.do_async(key, lambda: self._analyze_file_async(source), result_type=MedicalRecord)
+
+    async def _analyze_file_async(self, source: Union[str, UploadedFile]) -> MedicalRecord:
+
+        cache_key, cached_record, contents_list = await asyncio.to_thread(self._prepare_request, source)
+        if cached_record is not None:
+            return cached_record
+        # Loading ran in a worker thread; label the rest of this request here too
+        telemetry.set_strategy(SmartLoader.strategy(contents_list))
+        local_record, contents_list, parsed = await asyncio.to_thread(self._local_extraction, cache_key, contents_list)
+        if local_record is not None:
+            return local_record
+        chunks = await asyncio.to_thread(self._chunk_request, contents_list)
+        if chunks:
+            return self._store_chunks(cache_key, await self._extract_chunks_async(chunks))
+
+        with telemetry.span("llm", agent="extractor"):
+            response = await self._call_model_async(contents_list)
+        return self._store_response(cache_key, response, parsed)
\ No newline at end of file
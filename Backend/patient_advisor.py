@@ -1,13 +1,34 @@
 import os
 import json
-from typing import Dict, Any, Union, Optional, List
+import time
+import contextlib
+from functools import lru_cache
+from typing import Dict, Any, AsyncIterator, Union, Optional, List, Tuple
 from pydantic import BaseModel, Field
-from google import genai
 from google.genai import types
+from jinja2 import Environment
+import markdown
 from dotenv import load_dotenv
+from sse_stream import JsonFieldStream
+from genai_client import get_genai_client
+from gemini_governor import GeminiGovernor, default_governor
+from single_flight import SingleFlight, default_single_flight, flight_key
+from prompt_compaction import PromptCompactor, compact_text
+from structured_output import ModelCallError, parse_response, validate_json
+import telemetry
 
 load_dotenv()
 
+# Patient profile fields sent to the consultant, in prompt order
+PROFILE_FIELDS = [("name", "Name"), ("age", "Age"), ("gender", "Gender"),
+                  ("history", "Medical History"), ("complaints", "Current Complaints")]
+# Form defaults that carry no information for the model
+PROFILE_PLACEHOLDERS = frozenset({"", "unknown", "none", "none provided", "n/a"})
+
+OUTPUT_FORMAT_HEADING = "### REQUIRED OUTPUT FORMAT"
+JSON_OUTPUT_FORMAT = """### REQUIRED OUTPUT FORMAT (JSON)
+Fill every field of the response schema. List key findings most critical first."""
+
 # --- Pydantic Schema for JSON Consultation Output (NEW) ---\n
 
 class KeyFinding(BaseModel):
@@ -27,6 +48,80 @@ class ConsultationSummaryJSON(BaseModel):
     disclaimer: str = Field(default="I am an AI assistant. This analysis is for informational purposes and does not replace professional medical advice.")
 
 
+class ConsultationBundle(BaseModel):
+    """A validated consultation with its locally rendered Markdown and HTML views."""
+    summary: ConsultationSummaryJSON
+    markdown: str
+    html: str
+
+
+# --- Local Markdown Rendering (mirrors the Markdown system instruction layout) ---
+
+# One template fragment per ConsultationSummaryJSON field, in schema order, so a
+# streamed consultation can emit each section as soon as its field is complete.
+CONSULTATION_MARKDOWN_SECTIONS = [
+    ("overall_summary", """## 🩺 Dr. AI Summary
+
+**1. The Big Picture**
+{{ summary.overall_summary }}
+
+"""),
+    ("key_findings", """**2. Key Findings (Explained)**
+{% for finding in summary.key_findings -%}
+- **{{ finding.parameter_name }}:** {{ finding.status }}
+  - *Interpretation:* {{ finding.interpretation }}
+{% if finding.image_tag %}
+{{ finding.image_tag }}
+
+{% endif %}
+{%- else -%}
+- No specific findings were reported.
+{% endfor %}
+"""),
+    ("lifestyle_recommendations", """**3. 🥗 Lifestyle & Dietary Recommendations**
+{% for tip in summary.lifestyle_recommendations -%}
+- {{ tip }}
+{% endfor %}
+"""),
+    ("when_to_see_doctor", """**4. ⚠️ When to see a Human Doctor**
+{% for flag in summary.when_to_see_doctor -%}
+- {{ flag }}
+{% endfor %}
+"""),
+    ("disclaimer", """---
+*Disclaimer: {{ summary.disclaimer }}*
+"""),
+]
+
+CONSULTATION_MARKDOWN_TEMPLATE = "".join(fragment for _, fragment in CONSULTATION_MARKDOWN_SECTIONS)
+
+
+def _template_env() -> Environment:
+    return Environment(autoescape=False, keep_trailing_newline=True)
+
+
+@lru_cache(maxsize=1)
+def _consultation_template():
+    """Compiles the consultation template once per process."""
+    return _template_env().from_string(CONSULTATION_MARKDOWN_TEMPLATE)
+
+
+@lru_cache(maxsize=None)
+def _consultation_section_template(field: str):
+    fragment = dict(CONSULTATION_MARKDOWN_SECTIONS)[field]
+    return _template_env().from_string(fragment)
+
+
+def render_consultation_markdown(summary: ConsultationSummaryJSON) -> str:
+    """Renders a ConsultationSummaryJSON into the same Markdown layout the model is asked to produce."""
+    return _consultation_template().render(summary=summary)
+
+
+def render_consultation_section(field: str, summary: Union[ConsultationSummaryJSON, Dict[str, Any]]) -> str:
+    """Renders the Markdown section for one field; `summary` may be a partial dict of fields."""
+    return _consultation_section_template(field).render(summary=summary)
+
+
 class PatientConsultantAgent:
     """
     Agent 2: The Medical Consultant (Synthesizer).
@@ -37,13 +132,18 @@ class PatientConsultantAgent:
     and professional medical summary.
     """
     
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", governor: Optional[GeminiGovernor] = None,
+                 single_flight: Optional[SingleFlight] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
         if not self.api_key:
             print("WARNING: GOOGLE_API_KEY not found in environment variables.")
             
-        self.client = genai.Client(api_key=self.api_key)
+        self.client = get_genai_client(self.api_key)
         self.model_name = model_name
+        # Shared rate limits, retries and circuit breaker for outbound Gemini calls
+        self.governor = governor or default_governor
+        # Concurrent identical consultations (same prompt and mode) share one call
+        self.single_flight = single_flight or default_single_flight
 
         # System instruction for MARKDOWN output (default behavior)
         self.markdown_system_instruction = """
@@ -82,73 +182,208 @@ You are a senior, empathetic, and professional Medical Consultant AI. Your task
 ---
 *Disclaimer: I am an AI assistant. This analysis is for informational purposes and does not replace professional medical advice.*
 """
+        self.markdown_system_instruction = compact_text(self.markdown_system_instruction)
+        # JSON mode: the response schema (field descriptions included) replaces the Markdown layout
+        guidelines = self.markdown_system_instruction.split(OUTPUT_FORMAT_HEADING)[0]
+        self.json_system_instruction = guidelines + JSON_OUTPUT_FORMAT
 
 
-    def generate_consultation(self, report_analysis: Union[Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
+    def _build_user_prompt(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None,
+                           json_output: bool = False) -> str:
         """
-        Generates the formatted consultation report.
+        Builds the synthesizer prompt shared by the Markdown and JSON modes.
 
-        Args:
-            report_analysis (dict or str): The structured JSON output from Agent 1 (MANDATORY).
-            patient_profile (dict, optional): Dict containing 'name', 'age', 'gender', 'history', 'complaints'. (OPTIONAL).
-            json_output (bool): If True, returns strict JSON conforming to ConsultationSummaryJSON schema.
-
-        Returns:
-            str: The Markdown formatted doctor's summary OR a JSON string.
+        Report data is sent as compact JSON without null/empty fields and the
+        profile lists only the fields that were provided; the estimated saving
+        (including the shorter JSON-mode system instruction) is logged per call.
         """
-        
-        # 1. Handle Optional Profile
-        if patient_profile:
-            age = patient_profile.get('age')
-            if not age:
-                age = 'Unknown'
-
-            profile_str = f"""
-            - Name: {patient_profile.get('name', 'Patient')}
-            - Age: {age}
-            - Gender: {patient_profile.get('gender', 'Unknown')}
-            - Medical History: {patient_profile.get('history', 'None provided')}
-            - Current Complaints: {patient_profile.get('complaints', 'None provided')}
-            """
+        compactor = PromptCompactor("consultant")
+
+        # 1. Handle Optional Profile (placeholders such as 'Unknown' say nothing)
+        profile = []
+        for field, label in PROFILE_FIELDS:
+            value = str((patient_profile or {}).get(field) or "").strip()
+            if value.lower() not in PROFILE_PLACEHOLDERS:
+                profile.append(f"- {label}: {value}")
+        if profile:
+            profile_str = compactor.lines(profile)
         else:
             profile_str = "No specific patient profile provided. Interpret the report based on general medical standards."
 
         # 2. Ensure Report Data is a string for the prompt
-        if isinstance(report_analysis, dict):
-            report_str = json.dumps(report_analysis, indent=2)
-        else:
-            report_str = str(report_analysis)
+        if isinstance(report_analysis, BaseModel):
+            report_analysis = report_analysis.model_dump(mode="json")
+        elif isinstance(report_analysis, str):
+            try:
+                report_analysis = json.loads(report_analysis)
+            except ValueError:
+                pass
+        report_str = compactor.json(report_analysis)
 
         # 3. Construct the Synthesizer Prompt
-        user_prompt = f"""
-        Please generate a consultation summary based on the following context:
-
-        ### PATIENT PROFILE
-        {profile_str}
-
-        ### INPUT DATA (From Report Analyser Agent)
-        {report_str}
-        """
+        prompt = "\n".join([
+            compactor.text("Please generate a consultation summary based on the following context:\n### PATIENT PROFILE"),
+            profile_str,
+            compactor.text("### INPUT DATA (From Report Analyser Agent)"),
+            report_str,
+        ])
+        if json_output:
+            compactor.fixed(self.markdown_system_instruction, self.json_system_instruction)
+        compactor.report()
+        return prompt
 
+    def _config_args(self, json_output: bool) -> Dict[str, Any]:
         config_args = {
             "system_instruction": self.markdown_system_instruction,
             "temperature": 0.4
         }
 
         if json_output:
-            # Override system instruction and set JSON schema for strict output
-            config_args["system_instruction"] = self.markdown_system_instruction.replace('REQUIRED OUTPUT FORMAT (Markdown)', 'REQUIRED OUTPUT FORMAT (JSON)').replace('## 🩺 Dr. AI Summary', 'Generate the JSON strictly following the schema:')
+            # The response schema defines the output, so the Markdown layout is not resent
+            config_args["system_instruction"] = self.json_system_instruction
             config_args["response_mime_type"] = "application/json"
             config_args["response_schema"] = ConsultationSummaryJSON
 
+        return config_args
+
+    def generate_consultation(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
+        """
+        Generates the formatted consultation report.
+
+        Args:
+            report_analysis (MedicalRecord, dict or str): The structured output from Agent 1 (MANDATORY).
+            patient_profile (dict, optional): Dict containing 'name', 'age', 'gender', 'history', 'complaints'. (OPTIONAL).
+            json_output (bool): If True, returns strict JSON conforming to ConsultationSummaryJSON schema.
+
+        Returns:
+            str: The Markdown formatted doctor's summary OR a JSON string.
+
+        Raises:
+            ModelCallError: the Gemini call failed.
+        """
+        user_prompt = self._build_user_prompt(report_analysis, patient_profile, json_output)
+        key = flight_key("consultation", self.model_name, json_output, user_prompt)
+        return self.single_flight.do(key, lambda: self._generate(user_prompt, json_output).text)
+
+    def generate_consultation_summary(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> ConsultationSummaryJSON:
+        """JSON-mode consultation as a validated ConsultationSummaryJSON (raises ModelCallError / ModelOutputError)."""
+        user_prompt = self._build_user_prompt(report_analysis, patient_profile, True)
+        key = flight_key("consultation_summary", self.model_name, user_prompt)
+        return self.single_flight.do(key, lambda: self._parse_summary(self._generate(user_prompt, True)),
+                                     result_type=ConsultationSummaryJSON)
+
+    def _generate(self, user_prompt: str, json_output: bool):
         # 4. Call Gemini
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=user_prompt,
-                config=types.GenerateContentConfig(**config_args)
-            )
-            return response.text
-            
+            with telemetry.span("llm", agent="consultant"):
+                return self.governor.generate_content(
+                    self.client,
+                    model=self.model_name,
+                    contents=user_prompt,
+                    config=types.GenerateContentConfig(**self._config_args(json_output))
+                )
+        except Exception as e:
+            raise ModelCallError(f"Error generating consultation: {str(e)}") from e
+
+    async def generate_consultation_async(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None, json_output: bool = False) -> str:
+        """Async variant of generate_consultation() using the genai async client."""
+        user_prompt = self._build_user_prompt(report_analysis, patient_profile, json_output)
+        key = flight_key("consultation", self.model_name, json_output, user_prompt)
+
+        async def generate() -> str:
+            return (await self._generate_async(user_prompt, json_output)).text
+        return await self.single_flight.do_async(key, generate)
+
+    async def generate_consultation_summary_async(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> ConsultationSummaryJSON:
+        """Async variant of generate_consultation_summary()."""
+        user_prompt = self._build_user_prompt(report_analysis, patient_profile, True)
+        key = flight_key("consultation_summary", self.model_name, user_prompt)
+
+        async def generate() -> ConsultationSummaryJSON:
+            return self._parse_summary(await self._generate_async(user_prompt, True))
+        return await self.single_flight.do_async(key, generate, result_type=ConsultationSummaryJSON)
+
+    async def _generate_async(self, user_prompt: str, json_output: bool):
+        try:
+            with telemetry.span("llm", agent="consultant"):
+                return await self.governor.generate_content_async(
+                    self.client,
+                    model=self.model_name,
+                    contents=user_prompt,
+                    config=types.GenerateContentConfig(**self._config_args(json_output))
+                )
+        except Exception as e:
+            raise ModelCallError(f"Error generating consultation: {str(e)}") from e
+
+    @staticmethod
+    def _parse_summary(response) -> ConsultationSummaryJSON:
+        with telemetry.span("validate", agent="consultant"):
+            return parse_response(response, ConsultationSummaryJSON)
+
+    @staticmethod
+    def _bundle(summary: ConsultationSummaryJSON) -> ConsultationBundle:
+        """Renders the Markdown/HTML views of a validated consultation locally."""
+        with telemetry.span("render", agent="consultant"):
+            summary_md = render_consultation_markdown(summary)
+            return ConsultationBundle(summary=summary, markdown=summary_md, html=markdown.markdown(summary_md))
+
+    def generate_consultation_bundle(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> ConsultationBundle:
+        """
+        Single round-trip consultation: one structured JSON call, with the
+        Markdown and HTML views rendered locally from the validated result.
+
+        Raises:
+            ModelCallError or ModelOutputError (both AgentError).
+        """
+        return self._bundle(self.generate_consultation_summary(report_analysis, patient_profile))
+
+    async def generate_consultation_bundle_async(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> ConsultationBundle:
+        """Async variant of generate_consultation_bundle()."""
+        return self._bundle(await self.generate_consultation_summary_async(report_analysis, patient_profile))
+
+    async def stream_consultation_async(self, report_analysis: Union[BaseModel, Dict, str], patient_profile: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streams a JSON-mode consultation, rendering each Markdown section as soon as
+        its field is complete.
+
+        Yields:
+            ("markdown", section_text) in section order, then ("result", ConsultationBundle).
+            Raises ModelCallError or ModelOutputError on failure.
+        """
+        user_prompt = self._build_user_prompt(report_analysis, patient_profile, json_output=True)
+        section_order = [field for field, _ in CONSULTATION_MARKDOWN_SECTIONS]
+        scanner = JsonFieldStream()
+        completed: Dict[str, Any] = {}
+        emitted = 0
+        start = time.perf_counter()
+
+        try:
+            with telemetry.agent_scope("consultant"):
+                stream = await self.governor.generate_content_stream_async(
+                    self.client,
+                    model=self.model_name,
+                    contents=user_prompt,
+                    config=types.GenerateContentConfig(**self._config_args(True))
+                )
+            async with contextlib.aclosing(stream):
+                async for chunk in stream:
+                    if not chunk.text:
+                        continue
+                    completed.update(scanner.feed(chunk.text))
+                    # Emit strictly in layout order, holding back fields that arrive early
+                    while emitted < len(section_order) and section_order[emitted] in completed:
+                        yield "markdown", render_consultation_section(section_order[emitted], completed)
+                        emitted += 1
         except Exception as e:
-            return f"Error generating consultation: {str(e)}"
\ No newline at end of file
+            raise ModelCallError(f"Error generating consultation: {str(e)}") from e
+        # Includes the time the client took to consume each section
+        telemetry.observe_stage("llm_stream", time.perf_counter() - start, agent="consultant")
+
+        with telemetry.span("validate", agent="consultant"):
+            summary = validate_json(ConsultationSummaryJSON, scanner.text)
+        bundle = self._bundle(summary)
+
+        # Sections the model left to schema defaults (e.g. the disclaimer)
+        for field in section_order[emitted:]:
+            yield "markdown", render_consultation_section(field, summary)
+        yield "result", bundle
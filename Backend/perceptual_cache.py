@@ -0,0 +1,190 @@
+"""
+Near-duplicate lookup for re-uploaded prescriptions.
+
+Re-encoding, resizing or re-sending the same photo changes every byte of the
+upload, so content-hash caching never hits. PerceptualIndex keys results on
+a difference hash (dHash) of the image instead. A hash match alone is not
+enough: different prescriptions written on the same clinic template differ
+only in a few handwritten lines and hash within a few bits of each other.
+Every candidate is therefore confirmed against a stored grayscale thumbnail,
+tile by tile, and reused only when no region of the page differs.
+
+Entries are also scoped per user, so one user's result is never served for
+another user's image, and expire after a short TTL.
+"""
+import os
+import json
+import time
+import zlib
+import base64
+import hashlib
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+
+from cache_store import TieredCache, tiered_cache_from_env
+
+
+# EXIF orientation -> transpose that displays the image upright (as in ImageOps.exif_transpose)
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_90,
+}
+# Orientations stored rotated by 90 degrees (width and height swapped)
+SWAPPED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def upright_thumbnail(image: Image.Image, size: Tuple[int, int], resample: int = Image.Resampling.BOX,
+                      reducing_gap: float = 2.0) -> Image.Image:
+    """
+    Grayscale thumbnail of `size` (width, height), turned upright. Only the
+    thumbnail is rotated, so phone photos stored rotated (EXIF orientation)
+    match their upright copies without transposing the full photo.
+    """
+    orientation = image.getexif().get(0x0112, 1)
+    stored_size = size[::-1] if orientation in SWAPPED_ORIENTATIONS else size
+    thumbnail = image.resize(stored_size, resample, reducing_gap=reducing_gap)
+    transpose = ORIENTATION_TRANSPOSE.get(orientation)
+    if transpose is not None:
+        thumbnail = thumbnail.transpose(transpose)
+    return thumbnail.convert("L")
+
+
+def dhash(image: Image.Image, hash_size: int = 16) -> int:
+    """
+    Difference hash: `hash_size`^2 bits, one per horizontally adjacent pair of
+    pixels in a (hash_size + 1) x hash_size grayscale thumbnail (1 = brighter
+    to the right). Insensitive to scale, compression, blur and brightness.
+    """
+    pixels = upright_thumbnail(image, (hash_size + 1, hash_size)).tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return bits
+
+
+def signature(image: Image.Image, size: int = 256) -> bytes:
+    """
+    A `size` x `size` grayscale thumbnail, contrast-stretched so exposure
+    differences cancel out. Bilinear (antialiased) resampling keeps it stable
+    across re-encoded and downscaled copies, where BOX drifts by a pixel.
+    """
+    thumbnail = upright_thumbnail(image, (size, size), Image.Resampling.BILINEAR, reducing_gap=3.0)
+    return ImageOps.autocontrast(thumbnail, cutoff=1).tobytes()
+
+
+def tile_difference(a: bytes, b: bytes, size: int = 256, tile: int = 4) -> int:
+    """
+    Largest mean absolute difference (0-255) over the `tile` x `tile` blocks
+    of two signatures. A changed dose or strength raises its own blocks even
+    when the rest of the page is identical, which a whole-image mean would hide.
+    """
+    difference = ImageChops.difference(Image.frombytes("L", (size, size), a), Image.frombytes("L", (size, size), b))
+    return max(difference.resize((size // tile, size // tile), Image.Resampling.BOX).tobytes())
+
+
+class Fingerprint(NamedTuple):
+    """What PerceptualIndex stores and compares for one image."""
+
+    hash: int
+    signature: bytes
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class PerceptualIndex:
+    """
+    Recent results per user scope, looked up by perceptual hash and confirmed
+    by thumbnail comparison.
+
+    Each scope holds up to `per_scope` entries (least recently matched are
+    dropped first) as one value in `cache`, so the number of scopes is bounded
+    by the cache's own LRU, and scopes are shared across workers when the
+    cache has a disk tier.
+
+    Args:
+        cache: Storage for the per-scope entry lists (JSON strings).
+        threshold: Largest dHash Hamming distance for a candidate.
+        hash_size: dHash grid size (hash bits = hash_size^2).
+        max_difference: Largest tile difference (0-255) of a confirmed match.
+        signature_size: Side of the thumbnail compared to confirm a candidate.
+        per_scope: Entries kept per scope.
+        ttl: Entry lifetime in seconds.
+    """
+
+    def __init__(self, cache: TieredCache, threshold: int = 10, hash_size: int = 16, max_difference: int = 16,
+                 signature_size: int = 256, per_scope: int = 10, ttl: float = 1800):
+        self.cache = cache
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.max_difference = max_difference
+        self.signature_size = signature_size
+        self.per_scope = per_scope
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls) -> "PerceptualIndex":
+        ttl = float(os.getenv("PRESCRIPTION_PHASH_TTL", 1800))
+        return cls(
+            # maxsize = scopes kept in memory; the TTL refreshes on every write to a scope
+            cache=tiered_cache_from_env("PRESCRIPTION_PHASH", maxsize=1000, ttl=ttl),
+            threshold=int(os.getenv("PRESCRIPTION_PHASH_THRESHOLD", 10)),
+            hash_size=int(os.getenv("PRESCRIPTION_PHASH_SIZE", 16)),
+            max_difference=int(os.getenv("PRESCRIPTION_PHASH_MAX_DIFFERENCE", 16)),
+            per_scope=int(os.getenv("PRESCRIPTION_PHASH_PER_USER", 10)),
+            ttl=ttl,
+        )
+
+    def fingerprint(self, image: Image.Image) -> Fingerprint:
+        return Fingerprint(dhash(image, self.hash_size), signature(image, self.signature_size))
+
+    def _key(self, namespace: str, scope: str) -> str:
+        # Scopes come from request input; hashing bounds the key length
+        return "phash:" + hashlib.sha256(
+            f"{namespace}|{self.hash_size}|{self.signature_size}|{scope}".encode("utf-8")).hexdigest()
+
+    def _entries(self, key: str) -> List[List[Any]]:
+        """[[hash, signature, stored_at, value], ...], most recently matched first, expired entries removed."""
+        stored = self.cache.get(key)
+        if stored is None:
+            return []
+        cutoff = time.time() - self.ttl
+        return [entry for entry in json.loads(stored) if entry[2] > cutoff]
+
+    def _confirmed(self, fingerprint: Fingerprint, entry: List[Any]) -> bool:
+        stored = zlib.decompress(base64.b64decode(entry[1]))
+        return tile_difference(fingerprint.signature, stored, self.signature_size) <= self.max_difference
+
+    def lookup(self, namespace: str, scope: str, fingerprint: Fingerprint) -> Tuple[str, Optional[Tuple[int, Any]]]:
+        """
+        (outcome, match): outcome is "hit", "miss" or "rejected" (hash
+        candidates found, but none confirmed by the thumbnails); match is
+        (distance, value) of the closest confirmed entry, or None.
+        """
+        key = self._key(namespace, scope)
+        entries = self._entries(key)
+        candidates = sorted((hamming(fingerprint.hash, entry[0]), index) for index, entry in enumerate(entries))
+        candidates = [(distance, index) for distance, index in candidates if distance <= self.threshold]
+        if not candidates:
+            return "miss", None
+        for distance, index in candidates:
+            if self._confirmed(fingerprint, entries[index]):
+                break
+        else:
+            return "rejected", None
+        if index:
+            entries.insert(0, entries.pop(index))
+            self.cache.set(key, json.dumps(entries))
+        return "hit", (distance, entries[0][3])
+
+    def add(self, namespace: str, scope: str, fingerprint: Fingerprint, value: Any) -> None:
+        key = self._key(namespace, scope)
+        entries = [entry for entry in self._entries(key) if entry[0] != fingerprint.hash]
+        # Text pages are mostly blank paper: the thumbnail compresses to a few KB
+        stored = base64.b64encode(zlib.compress(fingerprint.signature)).decode("ascii")
+        entries.insert(0, [fingerprint.hash, stored, time.time(), value])
+        self.cache.set(key, json.dumps(entries[:self.per_scope]))
@@ -1,14 +1,32 @@
 import os
+import re
 import json
-from typing import Dict, Any
-from google import genai
+import asyncio
+import hashlib
+from typing import Dict, Any, Optional, Tuple, Union, BinaryIO
 from google.genai import types
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io # NEW: Import io for in-memory byte buffer
 from dotenv import load_dotenv
+from cache_store import TieredCache, tiered_cache_from_env
+from upload_buffer import UploadedFile
+from image_optimizer import ImageOptimizer
+from genai_client import get_genai_client
+from gemini_governor import GeminiGovernor, default_governor
+from single_flight import SingleFlight, default_single_flight, flight_key
+from prompt_compaction import PromptCompactor
+from perceptual_cache import Fingerprint, PerceptualIndex
+from drug_lexicon import DrugLexicon
+from structured_output import LoaderError, ModelCallError, ModelOutputError
+import telemetry
 
 load_dotenv()
 
+KNOWLEDGE_TASK = """TASK: For each medicine, provide a patient-friendly summary.
+Use each medicine's "name" exactly as given in INPUT as its key.
+OUTPUT JSON format:
+{"MedicineName":{"purpose":"Brief reason for use","side_effects":"2-3 common side effects","interactions":"1 major warning"}}"""
+
 class PrescriptionReaderAgent:
     """
     Agent responsible for analyzing prescription images.
@@ -16,18 +34,48 @@ class PrescriptionReaderAgent:
     and drug knowledge explanation (Medicine Knowledge Agent).
     """
 
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", medicine_cache: Optional[TieredCache] = None, image_optimizer: Optional[ImageOptimizer] = None,
+                 governor: Optional[GeminiGovernor] = None, single_flight: Optional[SingleFlight] = None,
+                 perceptual_index: Optional[PerceptualIndex] = None, drug_lexicon: Union[DrugLexicon, bool, None] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY", "")
-        # Using a client for consistency with other agents
-        self.client = genai.Client(api_key=self.api_key)
+        # Process-wide client shared with the other agents (one connection pool)
+        self.client = get_genai_client(self.api_key)
         self.vision_model = 'gemini-2.5-flash-lite'
         self.knowledge_model = 'gemini-2.5-flash-lite'
+        # Per-medicine explanations keyed on normalized name + form (default: 2000 entries, 7 days)
+        self.medicine_cache = medicine_cache if medicine_cache is not None else tiered_cache_from_env("MEDICINE", maxsize=2000, ttl=7 * 86400)
+        # Downscales/re-encodes phone photos before upload (VISION_* env vars)
+        self.image_optimizer = image_optimizer or ImageOptimizer.from_env()
+        # Shared rate limits, retries and circuit breaker for outbound Gemini calls
+        self.governor = governor or default_governor
+        # Concurrent uploads of the same image share one analysis
+        self.single_flight = single_flight or default_single_flight
+        # Re-uploads of a prescription the same user sent recently reuse its
+        # analysis, matched by perceptual hash and confirmed pixel by pixel
+        # (opt-in: PRESCRIPTION_PHASH=1)
+        if perceptual_index is None and os.getenv("PRESCRIPTION_PHASH", "0") == "1":
+            perceptual_index = PerceptualIndex.from_env()
+        self.perceptual_index = perceptual_index
+        # Maps OCR'd names to canonical names and strengths before the knowledge
+        # step, so misspellings and brands share one explanation (DRUG_LEXICON=0
+        # or drug_lexicon=False disables; None loads the bundled lexicon)
+        if drug_lexicon is None and os.getenv("DRUG_LEXICON", "1") == "1":
+            drug_lexicon = DrugLexicon.from_env()
+        self.drug_lexicon = drug_lexicon if isinstance(drug_lexicon, DrugLexicon) else None
+
+    @staticmethod
+    def _normalize_medicine_text(value: Optional[str]) -> str:
+        value = re.sub(r"[^\w\s.%/+-]", " ", str(value or "").lower())
+        return re.sub(r"\s+", " ", value).strip()
+
+    def _medicine_cache_key(self, name: str, form: Optional[str]) -> str:
+        """Normalizes 'Paracetamol  500mg ' / 'tablets' and 'PARACETAMOL 500MG' / 'Tablets' to the same key."""
+        return f"{self.knowledge_model}|{self._normalize_medicine_text(name)}|{self._normalize_medicine_text(form)}"
         
-    def _extract_medicines(self, image_input: Image.Image) -> Dict[str, Any]:
+    def _extraction_contents(self, image_input: Image.Image, upload_size: Optional[int] = None) -> list:
         """
-        [Agent 1: Prescription Reader Agent]
-        Scans the image and finds medicine names/forms using Gemini Vision.
-        Returns a dictionary with extracted data or an 'error' key on failure.
+        Prompt and optimized image; raises LoaderError when the image cannot be
+        decoded. `upload_size` (bytes) feeds the optimizer's keep-smaller check and log.
         """
         prompt = """
         You are an expert Pharmacist. 
@@ -36,106 +84,373 @@ class PrescriptionReaderAgent:
         3. Output strictly this JSON format and nothing else:
            {"medicines": [{"name": "MedName", "form": "MedForm"}]}
         """
+        # Auto-rotate, downscale and re-encode instead of re-saving in the original
+        # (often lossless PNG) format, which inflated the payload
         try:
-            # --- FIX: Convert PIL Image to Bytes in Memory for robust Part creation ---
-            img_byte_arr = io.BytesIO()
-            # Save the image as JPEG (adjust format based on input if necessary, but JPEG is usually robust)
-            image_input.save(img_byte_arr, format=image_input.format if image_input.format else 'JPEG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # Create the Part from the byte stream
-            mime_type = f"image/{image_input.format.lower() if image_input.format else 'jpeg'}"
-            img_bytes = types.Part.from_bytes(data=img_byte_arr, mime_type=mime_type)
-            # -----------------------------------------------------------------------
-            
-            response = self.client.models.generate_content(
-                model=self.vision_model,
-                contents=[prompt, img_bytes], 
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.1
+            with telemetry.span("optimize_image", agent="prescription"):
+                payload, mime_type = self.image_optimizer.optimize(
+                    image_input, original_size=upload_size, label="prescription"
+                )
+        except OSError as e:
+            # PIL decodes lazily: a truncated or corrupt file fails here, not in Image.open
+            raise LoaderError(f"Could not read the prescription image: {e}", 400) from e
+        img_bytes = types.Part.from_bytes(data=payload, mime_type=mime_type)
+        return [prompt, img_bytes]
+
+    @staticmethod
+    def _extraction_config() -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            temperature=0.1
+        )
+
+    @staticmethod
+    def _parse_model_json(text: Optional[str], agent_label: str, source_label: str) -> Dict[str, Any]:
+        """The response's JSON object; raises ModelOutputError."""
+        clean_text = (text or "").strip().replace('```json', '').replace('```', '')
+
+        try:
+            data = json.loads(clean_text)
+        except json.JSONDecodeError as json_e:
+            print(f"{agent_label} (JSON Decode Error): {json_e}. Raw: {clean_text[:100]}...")
+            raise ModelOutputError(f"{source_label} returned malformed JSON ({json_e}).") from json_e
+        if not isinstance(data, dict):
+            raise ModelOutputError(f"{source_label} returned {type(data).__name__} instead of a JSON object.")
+        return data
+
+    def _extract_medicines(self, image_input: Image.Image, upload_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        [Agent 1: Prescription Reader Agent]
+        Scans the image and finds medicine names/forms using Gemini Vision.
+        Returns the extracted data; raises LoaderError, ModelCallError or ModelOutputError.
+        """
+        contents = self._extraction_contents(image_input, upload_size)
+        try:
+            with telemetry.span("llm_read", agent="prescription"):
+                response = self.governor.generate_content(
+                    self.client,
+                    model=self.vision_model,
+                    contents=contents,
+                    config=self._extraction_config()
+                )
+        except Exception as e:
+            print(f"Prescription Reader Agent (Extraction) Error: {e}")
+            raise ModelCallError(f"API or Connection Error: {str(e)}") from e
+        return self._parse_model_json(response.text, "Prescription Reader Agent", "Model")
+
+    async def _extract_medicines_async(self, image_input: Image.Image, upload_size: Optional[int] = None) -> Dict[str, Any]:
+        """Async variant of _extract_medicines(); image encoding runs in a worker thread."""
+        contents = await asyncio.to_thread(self._extraction_contents, image_input, upload_size)
+        try:
+            with telemetry.span("llm_read", agent="prescription"):
+                response = await self.governor.generate_content_async(
+                    self.client,
+                    model=self.vision_model,
+                    contents=contents,
+                    config=self._extraction_config()
                 )
-            )
-            
-            clean_text = response.text.strip().replace('```json', '').replace('```', '')
-            
-            try:
-                return json.loads(clean_text)
-            except json.JSONDecodeError as json_e:
-                error_message = f"JSON Decode Error: Model returned malformed data. {json_e}. Raw: {clean_text[:100]}..."
-                print(f"Prescription Reader Agent (JSON Decode Error): {error_message}")
-                return {"error": error_message}
-            
         except Exception as e:
-            error_message = f"API or Connection Error: {str(e)}"
-            print(f"Prescription Reader Agent (Extraction) Error: {error_message}")
-            return {"error": error_message}
+            print(f"Prescription Reader Agent (Extraction) Error: {e}")
+            raise ModelCallError(f"API or Connection Error: {str(e)}") from e
+        return self._parse_model_json(response.text, "Prescription Reader Agent", "Model")
+
+    def _normalize_medicines(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Adds a "normalized" entry (canonical name, strength, confidence, method)
+        to each extracted medicine the drug lexicon matches exactly or nearly
+        exactly; the knowledge step then asks about the canonical name. Weaker
+        matches are added as a "suggestion" only, and the name as read is
+        explained. The extracted name is kept as-is; the response stays keyed on it.
+        """
+        medicines = data.get("medicines")
+        if self.drug_lexicon is None or not isinstance(medicines, list):
+            return data
+        with telemetry.span("normalize", agent="prescription"):
+            for med in medicines:
+                if not isinstance(med, dict) or not isinstance(med.get("name"), str):
+                    continue
+                match = self.drug_lexicon.match(med["name"])
+                if match is None:
+                    telemetry.record_drug_normalization("unmatched")
+                elif match.substitute:
+                    telemetry.record_drug_normalization(match.method)
+                    med["normalized"] = match.to_dict()
+                else:
+                    # A similar name may be a different drug (Prednisone, Prednisolone)
+                    telemetry.record_drug_normalization("suggestion")
+                    med["suggestion"] = match.to_dict()
+        return data
+
+    @staticmethod
+    def _query_name(med: Dict[str, Any]) -> str:
+        """The name the knowledge step is asked about: the canonical one when the lexicon matched."""
+        normalized = med.get("normalized")
+        return normalized["display_name"] if isinstance(normalized, dict) else med["name"]
 
+    def _lookup_medicine_cache(self, medicines: list) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """Splits medicines into cached explanations and misses (cache key -> first medicine with that key)."""
+        analysis: Dict[str, Any] = {}
+        misses: Dict[str, Dict[str, Any]] = {}
+        for med in medicines:
+            if not isinstance(med, dict) or not med.get("name"):
+                continue
+            query_name = self._query_name(med)
+            key = self._medicine_cache_key(query_name, med.get("form"))
+            cached = self.medicine_cache.get(key)
+            if cached is not None:
+                analysis[med["name"]] = json.loads(cached)
+            elif key not in misses:
+                # "Dolo-650" and "Paracetamol 650" are asked about once, by canonical name
+                misses[key] = {**{k: v for k, v in med.items() if k not in ("normalized", "suggestion")}, "name": query_name}
+
+        if misses:
+            print(f"[Cache] Medicine cache: {len(analysis)} hit(s), {len(misses)} miss(es).")
+        return analysis, misses
+
+    def _merge_explanations(self, medicines: list, analysis: Dict[str, Any], misses: Dict[str, Dict[str, Any]], explained: Dict[str, Any]) -> Dict[str, Any]:
+        """Caches the fresh explanations and merges them with the cached ones."""
+        # Match answers back to the requested names (the model may alter casing/spacing).
+        by_norm = {self._normalize_medicine_text(name): info for name, info in explained.items()}
+        resolved: Dict[str, Any] = {}
+        for key, med in misses.items():
+            info = explained.get(med["name"]) or by_norm.get(self._normalize_medicine_text(med["name"]))
+            if isinstance(info, dict):
+                resolved[key] = info
+                self.medicine_cache.set(key, json.dumps(info))
+
+        # Rebuild in prescription order so the response shape matches an uncached run.
+        merged: Dict[str, Any] = {}
+        for med in medicines:
+            if not isinstance(med, dict) or not med.get("name"):
+                continue
+            name = med["name"]
+            key = self._medicine_cache_key(self._query_name(med), med.get("form"))
+            if name in analysis:
+                merged[name] = analysis[name]
+            elif key in resolved:
+                merged[name] = resolved[key]
+
+        # Keep answers the model keyed under a name we could not match, as before.
+        requested = {self._normalize_medicine_text(med["name"]) for med in misses.values()}
+        for name, info in explained.items():
+            if self._normalize_medicine_text(name) not in requested and name not in merged:
+                merged[name] = info
+
+        return merged
 
     def _explain_medicines(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         [Agent 2: Medicine Knowledge Agent]
-        Takes the list of medicines and explains them using Gemini Knowledge.
-        Returns a dictionary with analysis or an 'error' key on failure.
-        """
-        prompt = f"""
-        You are an expert Pharmacist. 
-        INPUT: {json.dumps(data)}
-        
-        TASK: For each medicine, provide a patient-friendly summary.
-        OUTPUT JSON format:
-        {{
-            "MedicineName": {{
-                "purpose": "Brief reason for use",
-                "side_effects": "2-3 common side effects",
-                "interactions": "1 major warning"
-            }}
-        }}
+        Explains each medicine, serving known ones from the per-medicine cache.
+        Only cache misses are sent to Gemini, in a single batched prompt.
+        Raises ModelCallError or ModelOutputError on failure.
         """
+        medicines = data.get("medicines")
+        if not isinstance(medicines, list):
+            # Unexpected extraction shape: explain it as-is without caching.
+            return self._explain_medicines_llm(data)
+
+        analysis, misses = self._lookup_medicine_cache(medicines)
+        if not misses:
+            return analysis
+
+        explained = self._explain_medicines_llm({"medicines": list(misses.values())})
+        return self._merge_explanations(medicines, analysis, misses, explained)
+
+    async def _explain_medicines_async(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of _explain_medicines()."""
+        medicines = data.get("medicines")
+        if not isinstance(medicines, list):
+            return await self._explain_medicines_llm_async(data)
+
+        analysis, misses = self._lookup_medicine_cache(medicines)
+        if not misses:
+            return analysis
+
+        explained = await self._explain_medicines_llm_async({"medicines": list(misses.values())})
+        return self._merge_explanations(medicines, analysis, misses, explained)
+
+    @staticmethod
+    def _knowledge_prompt(data: Dict[str, Any]) -> str:
+        """Knowledge prompt with the OCR output as compact JSON (null/empty fields dropped)."""
+        compactor = PromptCompactor("prescription")
+        prompt = "\n".join([
+            compactor.text("You are an expert Pharmacist."),
+            "INPUT: " + compactor.json(data, original_indent=None),
+            compactor.text(KNOWLEDGE_TASK),
+        ])
+        compactor.report()
+        return prompt
+
+    @staticmethod
+    def _knowledge_config() -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            temperature=0.4
+        )
+
+    def _explain_medicines_llm(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Sends the given medicines to the knowledge model in one prompt."""
         try:
-            response = self.client.models.generate_content(
-                model=self.knowledge_model,
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    temperature=0.4
+            with telemetry.span("llm_explain", agent="prescription"):
+                response = self.governor.generate_content(
+                    self.client,
+                    model=self.knowledge_model,
+                    contents=[self._knowledge_prompt(data)],
+                    config=self._knowledge_config()
                 )
-            )
-            clean_text = response.text.strip().replace('```json', '').replace('```', '')
-            
-            try:
-                return json.loads(clean_text)
-            except json.JSONDecodeError as json_e:
-                error_message = f"JSON Decode Error: Explanation model returned malformed data. {json_e}. Raw: {clean_text[:100]}..."
-                print(f"Medicine Knowledge Agent (JSON Decode Error): {error_message}")
-                return {"error": error_message}
-                
         except Exception as e:
-            error_message = f"API or Connection Error: {str(e)}"
-            print(f"Medicine Knowledge Agent (Explanation) Error: {error_message}")
-            return {"error": error_message}
-            
-    def analyze_prescription_image(self, file_path: str) -> Dict[str, Any]:
+            print(f"Medicine Knowledge Agent (Explanation) Error: {e}")
+            raise ModelCallError(f"API or Connection Error: {str(e)}") from e
+        return self._parse_model_json(response.text, "Medicine Knowledge Agent", "Explanation model")
+
+    async def _explain_medicines_llm_async(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of _explain_medicines_llm()."""
+        try:
+            with telemetry.span("llm_explain", agent="prescription"):
+                response = await self.governor.generate_content_async(
+                    self.client,
+                    model=self.knowledge_model,
+                    contents=[self._knowledge_prompt(data)],
+                    config=self._knowledge_config()
+                )
+        except Exception as e:
+            print(f"Medicine Knowledge Agent (Explanation) Error: {e}")
+            raise ModelCallError(f"API or Connection Error: {str(e)}") from e
+        return self._parse_model_json(response.text, "Medicine Knowledge Agent", "Explanation model")
+
+    @staticmethod
+    def _upload_size(source: Union[str, bytes, BinaryIO, UploadedFile]) -> Optional[int]:
+        """Size of the original upload in bytes, for the image optimizer; None for file-like sources."""
+        if isinstance(source, UploadedFile):
+            return source.size
+        if isinstance(source, (bytes, bytearray)):
+            return len(source)
+        if isinstance(source, str):
+            try:
+                return os.path.getsize(source)
+            except OSError:
+                return None
+        return None
+
+    @staticmethod
+    def _open_image(source: Union[str, bytes, BinaryIO, UploadedFile]) -> Image.Image:
         """
-        Main orchestration function for the two-step analysis.
+        Opens a path, raw bytes, a file-like object or an UploadedFile without
+        touching disk; raises LoaderError (400) when it is not an image.
         """
+        if isinstance(source, UploadedFile):
+            source = source.open()
+        elif isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
         try:
-            image = Image.open(file_path)
-            
-            raw_data = self._extract_medicines(image)
-            # Check for error key in the dictionary returned by _extract_medicines
-            if "error" in raw_data:
-                return {"error": f"Failed to extract medicines from image: {raw_data['error']}"}
+            return Image.open(source)
+        except UnidentifiedImageError as e:
+            # PIL's message names the internal buffer object; not useful to the client
+            raise LoaderError("Could not read the prescription image: unsupported or corrupt image file.", 400) from e
+        except Image.DecompressionBombError as e:
+            raise LoaderError(f"Could not read the prescription image: {e}", 400) from e
+
+    def _flight_key(self, source: Union[str, bytes, BinaryIO, UploadedFile], user_scope: Optional[str] = None) -> Optional[str]:
+        """
+        Key on the image bytes and the user scope; None (no coalescing) for
+        file-like sources, which are read only once. Scoped like the perceptual
+        index, so one user's in-flight analysis is never shared with another.
+        """
+        if isinstance(source, UploadedFile):
+            digest = source.sha256
+        elif isinstance(source, (bytes, bytearray)):
+            digest = hashlib.sha256(source).hexdigest()
+        elif isinstance(source, str):
+            try:
+                with open(source, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256").hexdigest()
+            except OSError:
+                return None
+        else:
+            return None
+        return flight_key("prescription", self.vision_model, self.knowledge_model, digest, user_scope or "")
+
+    def _near_duplicate(self, image: Image.Image, user_scope: Optional[str]) -> Tuple[Optional[Fingerprint], Optional[Dict[str, Any]]]:
+        """
+        (image fingerprint, cached report) for a request with a user scope.
+        The report is None on a miss; both are None when there is no scope or
+        the index is disabled.
+        """
+        if self.perceptual_index is None or not user_scope:
+            return None, None
+        with telemetry.span("phash", agent="prescription"):
+            try:
+                fingerprint = self.perceptual_index.fingerprint(image)
+            except OSError as e:
+                raise LoaderError(f"Could not read the prescription image: {e}", 400) from e
+            outcome, match = self.perceptual_index.lookup(self._phash_namespace, user_scope, fingerprint)
+        telemetry.record_perceptual_lookup(outcome)
+        if match is None:
+            return fingerprint, None
+        distance, report = match
+        print(f"[Cache] Near-duplicate prescription image (distance {distance}); reusing its analysis.")
+        return fingerprint, report
+
+    def _remember(self, fingerprint: Optional[Fingerprint], user_scope: Optional[str], report: Dict[str, Any]) -> Dict[str, Any]:
+        """Indexes a successful report under the image's fingerprint; returns the report."""
+        if fingerprint is not None and report.get("status") == "success":
+            self.perceptual_index.add(self._phash_namespace, user_scope, fingerprint, report)
+        return report
+
+    @property
+    def _phash_namespace(self) -> str:
+        return f"prescription|{self.vision_model}|{self.knowledge_model}"
+
+    @staticmethod
+    def _build_report(raw_data: Dict[str, Any], final_report: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "raw_extraction": raw_data,
+            "analysis": final_report
+        }
             
-            final_report = self._explain_medicines(raw_data)
-            # Check for error key in the dictionary returned by _explain_medicines
-            if "error" in final_report:
-                return {"error": f"Failed to generate explanation report: {final_report['error']}"}
-
-            return {
-                "status": "success",
-                "raw_extraction": raw_data,
-                "analysis": final_report
-            }
-        except Exception as e:
-            return {"error": f"Internal Agent Error: {str(e)}"}
\ No newline at end of file
+    def analyze_prescription_image(self, source: Union[str, bytes, BinaryIO, UploadedFile], user_scope: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Main orchestration function for the two-step analysis.
+        `source` may be a file path, raw bytes, a file-like object or an UploadedFile.
+        `user_scope` (e.g. a user or client id) enables reuse of that scope's
+        earlier analysis for a near-duplicate photo.
+
+        Raises LoaderError (the upload is not a readable image), ModelCallError
+        or ModelOutputError (all AgentError).
+        """
+        key = self._flight_key(source, user_scope)
+        if key is None:
+            return self._analyze_prescription_image(source, user_scope)
+        return self.single_flight.do(key, lambda: self._analyze_prescription_image(source, user_scope))
+
+    def _analyze_prescription_image(self, source: Union[str, bytes, BinaryIO, UploadedFile], user_scope: Optional[str] = None) -> Dict[str, Any]:
+        upload_size = self._upload_size(source)
+        with telemetry.span("decode_image", agent="prescription"):
+            image = self._open_image(source)
+        fingerprint, cached = self._near_duplicate(image, user_scope)
+        if cached is not None:
+            return cached
+
+        raw_data = self._normalize_medicines(self._extract_medicines(image, upload_size))
+        return self._remember(fingerprint, user_scope, self._build_report(raw_data, self._explain_medicines(raw_data)))
+
+    async def analyze_prescription_image_async(self, source: Union[str, bytes, BinaryIO, UploadedFile], user_scope: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of analyze_prescription_image()."""
+        key = await asyncio.to_thread(self._flight_key, source, user_scope)
+        if key is None:
+            return await self._analyze_prescription_image_async(source, user_scope)
+        return await self.single_flight.do_async(key, lambda: self._analyze_prescription_image_async(source, user_scope))
+
+    async def _analyze_prescription_image_async(self, source: Union[str, bytes, BinaryIO, UploadedFile], user_scope: Optional[str] = None) -> Dict[str, Any]:
+        upload_size = self._upload_size(source)
+        with telemetry.span("decode_image", agent="prescription"):
+            image = await asyncio.to_thread(self._open_image, source)
+        fingerprint, cached = await asyncio.to_thread(self._near_duplicate, image, user_scope)
+        if cached is not None:
+            return cached
+
+        raw_data = self._normalize_medicines(await self._extract_medicines_async(image, upload_size))
+        report = self._build_report(raw_data, await self._explain_medicines_async(raw_data))
+        return self._remember(fingerprint, user_scope, report)
\ No newline at end of file
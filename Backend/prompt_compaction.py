@@ -0,0 +1,119 @@
+"""
+Prompt compaction: the same information in fewer input tokens.
+
+- compact_data() / compact_json(): drop null and empty fields, no separator whitespace
+- compact_text(): remove source indentation, trailing spaces, blank-line runs
+  and instruction lines repeated earlier in the prompt
+- PromptCompactor: compacts the pieces of one prompt and reports the estimated
+  tokens saved (medai_prompt_tokens_saved_total)
+"""
+import json
+import textwrap
+from typing import Any, Iterable, Optional
+
+import telemetry
+from gemini_governor import estimate_tokens
+
+
+def _is_empty(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (list, tuple, dict)):
+        return not value
+    return False
+
+
+def compact_data(data: Any) -> Any:
+    """Recursively drops None, blank strings and empty lists/dicts. 0 and False are kept."""
+    if isinstance(data, dict):
+        items = ((key, compact_data(value)) for key, value in data.items())
+        return {key: value for key, value in items if not _is_empty(value)}
+    if isinstance(data, (list, tuple)):
+        items = (compact_data(value) for value in data)
+        return [value for value in items if not _is_empty(value)]
+    if isinstance(data, str):
+        return data.strip()
+    return data
+
+
+def compact_json(data: Any) -> str:
+    """`data` without empty fields, serialized with no whitespace between tokens."""
+    return json.dumps(compact_data(data), separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def dedupe_lines(text: str, seen: Optional[set] = None) -> str:
+    """
+    Drops non-blank lines already present earlier (case/whitespace-insensitive).
+
+    Pass the same `seen` set across pieces of one prompt to deduplicate between them.
+    """
+    seen = set() if seen is None else seen
+    kept = []
+    for line in text.split("\n"):
+        normalized = " ".join(line.split()).casefold()
+        if normalized:
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def compact_text(text: str, seen: Optional[set] = None) -> str:
+    """Dedents, strips trailing whitespace, collapses blank-line runs and drops repeated lines."""
+    lines = [line.rstrip() for line in textwrap.dedent(text).split("\n")]
+    collapsed = []
+    for line in lines:
+        if not line and (not collapsed or not collapsed[-1]):
+            continue
+        collapsed.append(line)
+    return dedupe_lines("\n".join(collapsed), seen).strip()
+
+
+class PromptCompactor:
+    """
+    Compacts the pieces of one prompt and keeps the before/after size.
+
+    The "before" size is what the agent used to send: JSON as it was serialized
+    (pretty-printed with indent=2 by default) and instruction text as written
+    in the source.
+    """
+
+    def __init__(self, agent: str):
+        self.agent = agent
+        self.original_tokens = 0
+        self.compacted_tokens = 0
+        self._seen: set = set()
+
+    def _account(self, original: str, compacted: str) -> str:
+        self.original_tokens += estimate_tokens(original)
+        self.compacted_tokens += estimate_tokens(compacted)
+        return compacted
+
+    def json(self, data: Any, original_indent: Optional[int] = 2) -> str:
+        """`data` as compact JSON; `original_indent` is how the agent used to serialize it."""
+        if not isinstance(data, (dict, list)):
+            return self.text(str(data))
+        return self._account(json.dumps(data, indent=original_indent, default=str), compact_json(data))
+
+    def text(self, text: str) -> str:
+        return self._account(text, compact_text(text, self._seen))
+
+    def lines(self, lines: Iterable[str]) -> str:
+        return self.text("\n".join(lines))
+
+    def fixed(self, original: str, compacted: str) -> str:
+        """Accounts for a piece compacted ahead of time (e.g. a system instruction built once)."""
+        return self._account(original, compacted)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.compacted_tokens)
+
+    def report(self) -> int:
+        """Records the estimated saving for this prompt in the metrics; returns it."""
+        saved = self.tokens_saved
+        telemetry.record_prompt_compaction(self.agent, self.compacted_tokens, saved)
+        return saved
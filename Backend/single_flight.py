@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+from structured_output import type_adapter
+
+
+def flight_key(*parts: Any) -> str:
+    """Stable key for a call: SHA-256 over the normalized parts that determine its result."""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class SQLiteFlightStore:
+    """
+    Cross-process in-flight registry shared by every gunicorn worker on the host.
+
+    The first worker to insert a key's row becomes the leader and publishes its
+    JSON result into that row. Other workers poll the row until the result
+    appears. A leader that fails deletes its row so a waiter can take over;
+    one that dies without cleaning up is replaced once its `lease` expires.
+    Finished rows linger for `linger` seconds so duplicates still polling can
+    read them, then they are purged.
+    """
+
+    def __init__(self, path: str, lease: float = 300, linger: float = 10):
+        self.path = path
+        self.lease = lease
+        self.linger = linger
+        self._owner_suffix = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            " key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " started_at REAL NOT NULL,"
+            " result TEXT,"
+            " finished_at REAL)"
+        )
+
+    @property
+    def owner(self) -> str:
+        # Includes the pid so workers forked from a preloaded master stay distinct
+        return f"{os.getpid()}-{self._owner_suffix}"
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread (and per process: a forked worker opens its own)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def claim(self, key: str) -> bool:
+        """Returns True when this process should run the call (no live leader for `key`)."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("DELETE FROM flights WHERE finished_at IS NOT NULL AND finished_at <= ?", (now - self.linger,))
+        # Take over rows whose leader never finished within the lease
+        conn.execute("DELETE FROM flights WHERE key = ? AND result IS NULL AND started_at <= ?", (key, now - self.lease))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO flights (key, owner, started_at) VALUES (?, ?, ?)",
+            (key, self.owner, now)
+        )
+        return cursor.rowcount == 1
+
+    def publish(self, key: str, value: str) -> None:
+        self._connect().execute(
+            "UPDATE flights SET result = ?, finished_at = ? WHERE key = ? AND owner = ?",
+            (value, time.time(), key, self.owner)
+        )
+
+    def abandon(self, key: str) -> None:
+        self._connect().execute("DELETE FROM flights WHERE key = ? AND owner = ? AND result IS NULL", (key, self.owner))
+
+    def poll(self, key: str) -> tuple:
+        """Returns (done, value): done with the result, or done=True/value=None when the leader is gone."""
+        row = self._connect().execute(
+            "SELECT result, started_at FROM flights WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return True, None
+        result, started_at = row
+        if result is not None:
+            return True, result
+        if started_at <= time.time() - self.lease:
+            return True, None
+        return False, None
+
+
+class _Call:
+    """An in-process call in progress; followers wait on `done`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _LeaderCancelled(Exception):
+    """Set on a shared future when its leader is cancelled; followers retry."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and receive the same result (or exception) instead of
+    starting their own LLM call. Keys are released as soon as the call
+    finishes, so this is not a cache: it only deduplicates in-flight work,
+    e.g. double-clicks and frontend retries.
+
+    With a SQLiteFlightStore the same applies across worker processes. Results
+    are handed over as JSON, so the function must return a JSON-serializable
+    value, or a value of `result_type` (e.g. a pydantic model), which is
+    dumped and validated with its TypeAdapter.
+    """
+
+    def __init__(self, store: Optional[SQLiteFlightStore] = None, poll_interval: float = 0.1):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._calls: Dict[str, _Call] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_shared = 0
+
+    @staticmethod
+    def _dumps(result: Any, result_type: Any) -> str:
+        if result_type is None:
+            return json.dumps(result)
+        return type_adapter(result_type).dump_json(result).decode("utf-8")
+
+    @staticmethod
+    def _loads(value: str, result_type: Any) -> Any:
+        if result_type is None:
+            return json.loads(value)
+        return type_adapter(result_type).validate_json(value)
+
+    # --- Sync ---
+
+    def do(self, key: str, fn: Callable[[], Any], result_type: Any = None) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(key, fn, result_type)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, key: str, fn: Callable[[], Any], result_type: Any) -> Any:
+        if self.store is None:
+            return fn()
+        while True:
+            if self.store.claim(key):
+                try:
+                    result = fn()
+                except BaseException:
+                    self.store.abandon(key)
+                    raise
+                self.store.publish(key, self._dumps(result, result_type))
+                return result
+            done, value = self.store.poll(key)
+            while not done:
+                time.sleep(self.poll_interval)
+                done, value = self.store.poll(key)
+            if value is not None:
+                self.coalesced_shared += 1
+                return self._loads(value, result_type)
+
+    # --- Async ---
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]], result_type: Any = None) -> Any:
+        future = self._futures.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                # shield: a follower that is cancelled must not cancel the leader's call
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The leader's request went away; the first follower to get
+                # here leads a fresh call and the rest follow it.
+                self.coalesced -= 1
+                return await self.do_async(key, fn, result_type)
+
+        future = asyncio.get_running_loop().create_future()
+        # Avoid "exception was never retrieved" warnings when nobody followed
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._futures[key] = future
+        self.leaders += 1
+        try:
+            result = await self._lead_async(key, fn, result_type)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Don't cancel the shared future: followers are still waiting for
+            # a result and must not fail because the leader's client left.
+            future.set_exception(_LeaderCancelled(key))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._futures[key]
+
+    async def _lead_async(self, key: str, fn: Callable[[], Awaitable[Any]], result_type: Any) -> Any:
+        if self.store is None:
+            return await fn()
+        while True:
+            if await asyncio.to_thread(self.store.claim, key):
+                try:
+                    result = await fn()
+                except BaseException:
+                    await asyncio.to_thread(self.store.abandon, key)
+                    raise
+                await asyncio.to_thread(self.store.publish, key, self._dumps(result, result_type))
+                return result
+            done, value = await asyncio.to_thread(self.store.poll, key)
+            while not done:
+                await asyncio.sleep(self.poll_interval)
+                done, value = await asyncio.to_thread(self.store.poll, key)
+            if value is not None:
+                self.coalesced_shared += 1
+                return self._loads(value, result_type)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_shared": self.coalesced_shared,
+            "in_flight": len(self._calls) + len(self._futures),
+            "shared_path": self.store.path if self.store else None,
+        }
+
+
+def single_flight_from_env() -> SingleFlight:
+    """
+    Builds a SingleFlight configured from environment variables:
+
+    - SINGLE_FLIGHT_PATH: SQLite file shared by all workers (in-process only when unset)
+    - SINGLE_FLIGHT_LEASE: seconds before an unfinished leader is considered dead (default 300)
+    - SINGLE_FLIGHT_POLL: seconds between checks while waiting on another worker (default 0.1)
+    """
+    store = None
+    path = os.getenv("SINGLE_FLIGHT_PATH")
+    if path:
+        store = SQLiteFlightStore(path, lease=float(os.getenv("SINGLE_FLIGHT_LEASE", 300)))
+    return SingleFlight(store, poll_interval=float(os.getenv("SINGLE_FLIGHT_POLL", 0.1)))
+
+
+# Process-wide coalescing layer shared by all agents unless one is injected
+default_single_flight = single_flight_from_env()
@@ -0,0 +1,80 @@
+import json
+from typing import Any, List, Tuple
+from structured_output import to_jsonable
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Formats one Server-Sent Event; `data` (pydantic objects included) is JSON-encoded on a single line."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=to_jsonable)}\n\n"
+
+
+class JsonFieldStream:
+    """
+    Incremental scanner for a streamed top-level JSON object.
+
+    Feed it text chunks as they arrive; `feed()` returns the (key, value)
+    pairs whose values became complete in that chunk, in document order.
+    A value is complete once the following ',' or the closing '}' is seen,
+    so the first field can be shown long before the object is finished.
+    """
+
+    def __init__(self):
+        self._pos = 0              # absolute offset of the next character to scan
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start = None     # offset of the opening quote of the current key
+        self._key = None
+        self._value_start = None   # offset just after the ':' of the current key
+        self._text = ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        completed: List[Tuple[str, Any]] = []
+        self._text += chunk
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            ch = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key_start is not None and self._key is None:
+                        self._key = json.loads(text[self._key_start:pos + 1])
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = pos
+                    self._expect_key = False
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+            elif ch in "}]":
+                if self._depth == 1 and ch == "}":
+                    self._complete(text, pos, completed)
+                self._depth -= 1
+            elif self._depth == 1 and ch == ":" and self._key is not None and self._value_start is None:
+                self._value_start = pos + 1
+            elif self._depth == 1 and ch == ",":
+                self._complete(text, pos, completed)
+                self._expect_key = True
+        self._pos = len(text)
+        return completed
+
+    def _complete(self, text: str, end: int, completed: List[Tuple[str, Any]]) -> None:
+        if self._key is not None and self._value_start is not None:
+            try:
+                completed.append((self._key, json.loads(text[self._value_start:end])))
+            except json.JSONDecodeError:
+                pass
+        self._key_start = self._key = self._value_start = None
+
+    @property
+    def text(self) -> str:
+        return self._text
@@ -0,0 +1,83 @@
+"""
+Typed agent results: validated pydantic objects out, typed exceptions on failure.
+
+Agents return schema objects (MedicalRecord, ConsultationSummaryJSON, ...)
+instead of JSON strings with an "error" key, so a request parses the model
+output once and serializes it once, when the response is written.
+"""
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Type, TypeVar
+
+# pydantic is imported on first use: app.py imports this module (through
+# single_flight) before any agent is built.
+if TYPE_CHECKING:
+    from pydantic import TypeAdapter
+
+T = TypeVar("T")
+
+
+class AgentError(Exception):
+    """An agent failure; `message` is safe to show to the client, `status_code` is the HTTP status."""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class LoaderError(AgentError):
+    """The uploaded document could not be read."""
+
+
+class ModelCallError(AgentError):
+    """The Gemini call failed (after the governor's retries)."""
+
+
+class ModelOutputError(AgentError):
+    """The model answered, but not with JSON matching the response schema."""
+
+
+@lru_cache(maxsize=None)
+def type_adapter(schema: Any) -> "TypeAdapter":
+    """One TypeAdapter per schema type; building one compiles a validator, so it is done once."""
+    from pydantic import TypeAdapter
+
+    return TypeAdapter(schema)
+
+
+def validate_json(schema: Type[T], text: str) -> T:
+    """Parses and validates `text` in one pass; raises ModelOutputError."""
+    from pydantic import ValidationError
+
+    try:
+        return type_adapter(schema).validate_json(text)
+    except ValidationError as e:
+        first = e.errors(include_url=False)[0]
+        location = ".".join(str(part) for part in first["loc"]) or "response"
+        raise ModelOutputError(f"The AI failed to generate valid JSON data ({location}: {first['msg']}).") from e
+
+
+def parse_response(response: Any, schema: Type[T]) -> T:
+    """
+    The schema object for a Gemini response.
+
+    google-genai already validates the text into `response.parsed` when the
+    config carries a pydantic response_schema; that object is reused rather
+    than parsing the text a second time.
+    """
+    parsed = getattr(response, "parsed", None)
+    if isinstance(schema, type) and isinstance(parsed, schema):
+        return parsed
+    text = getattr(response, "text", None)
+    if not text:
+        raise ModelOutputError("The AI returned an empty response.")
+    return validate_json(schema, text)
+
+
+def to_jsonable(value: Any) -> Any:
+    """`default=` hook for json.dumps: pydantic objects become plain JSON data."""
+    # Duck-typed so encoding a response never has to import pydantic
+    model_dump = getattr(value, "model_dump", None)
+    if callable(model_dump):
+        return model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
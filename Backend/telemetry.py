@@ -0,0 +1,394 @@
+import os
+import glob
+import atexit
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; LLM calls on long scans run into the minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Request-scoped labels. Routes set them per request; async_runtime and the job
+# queue carry them over to the agent event loop and the job workers.
+_route = contextvars.ContextVar("telemetry_route", default="none")
+_agent = contextvars.ContextVar("telemetry_agent", default="none")
+_strategy = contextvars.ContextVar("telemetry_strategy", default="none")
+_timings = contextvars.ContextVar("telemetry_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "none")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dump(self) -> List[Any]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(into: Any, value: Any) -> Any:
+        return value if into is None else into + value
+
+    def render(self, values: Dict[Tuple[str, ...], Any]) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Counter):
+    """Cumulative-bucket histogram per label combination (Prometheus semantics)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def dump(self) -> List[Any]:
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    @staticmethod
+    def merge(into: Any, value: Any) -> Any:
+        if into is None:
+            return [list(value[0]), value[1], value[2]]
+        return [[a + b for a, b in zip(into[0], value[0])], into[1] + value[1], into[2] + value[2]]
+
+    def render(self, values: Dict[Tuple[str, ...], Any]) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in the Prometheus text format.
+
+    Every gunicorn worker keeps its own counts. With `shared_dir` set, each
+    process also writes a snapshot there every `flush_interval` seconds, and
+    `render()` sums the snapshots of all workers, so any worker answering
+    /metrics reports the whole server. Snapshots of workers that have exited
+    are kept so counters never go backwards; clear the directory on deploy.
+    """
+
+    def __init__(self, shared_dir: Optional[str] = None, flush_interval: float = 5.0):
+        self.shared_dir = shared_dir
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, Counter] = {}
+        self._flusher_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: Counter) -> Any:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    # --- Cross-process snapshots ---
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.shared_dir, f"metrics-{pid}.json")
+
+    def snapshot(self) -> Dict[str, List[Any]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.dump() for metric in metrics}
+
+    def flush(self) -> None:
+        """Writes this process's snapshot atomically (readers never see a partial file)."""
+        if not self.shared_dir:
+            return
+        path = self._snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def ensure_flusher(self) -> None:
+        # Started lazily so workers forked from a preloaded master run their own
+        if not self.shared_dir or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def loop() -> None:
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"[Metrics] Could not write snapshot: {e}")
+
+        threading.Thread(target=loop, name="metrics-flusher", daemon=True).start()
+        # Keep the last interval's counts when the worker exits
+        atexit.register(self.flush)
+
+    def _collect(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        snapshots = [self.snapshot()]
+        if self.shared_dir:
+            own = self._snapshot_path(os.getpid())
+            for path in glob.glob(os.path.join(self.shared_dir, "metrics-*.json")):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        with self._lock:
+            metrics = dict(self._metrics)
+        merged: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in metrics}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in series:
+                    key = tuple(key)
+                    if isinstance(metric, Histogram) and len(value[0]) != len(metric.buckets):
+                        continue  # written by a build with different buckets
+                    merged[name][key] = metric.merge(merged[name].get(key), value)
+        return merged
+
+    def render(self) -> str:
+        self.ensure_flusher()
+        merged = self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(
+    shared_dir=os.getenv("METRICS_DIR") or None,
+    flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 5)),
+)
+
+REQUESTS = registry.counter(
+    "medai_http_requests_total", "HTTP requests handled, by route and status code.", ("route", "method", "status"))
+REQUEST_SECONDS = registry.histogram(
+    "medai_http_request_duration_seconds", "Time to produce the response (streams: until headers).", ("route", "method"))
+STAGE_SECONDS = registry.histogram(
+    "medai_stage_duration_seconds", "Time spent in one pipeline stage.", ("route", "agent", "stage", "strategy"))
+DOCUMENTS = registry.counter(
+    "medai_documents_loaded_total", "Documents loaded, by loader strategy (text, vision or mixed).", ("route", "strategy"))
+LLM_CALLS = registry.counter(
+    "medai_llm_calls_total", "Governed Gemini calls by outcome (retries within a call count once).", ("route", "agent", "model", "outcome"))
+LLM_SECONDS = registry.histogram(
+    "medai_llm_call_duration_seconds", "Gemini call time including rate-limit waits and retries.",
+    ("route", "agent", "model", "strategy"))
+LLM_TOKENS = registry.counter(
+    "medai_llm_tokens_total", "Tokens reported in Gemini usage_metadata.", ("route", "agent", "model", "strategy", "type"))
+PROMPT_TOKENS = registry.counter(
+    "medai_prompt_tokens_estimated_total", "Estimated input tokens of compacted prompts, before the call.", ("route", "agent"))
+PROMPT_TOKENS_SAVED = registry.counter(
+    "medai_prompt_tokens_saved_total", "Estimated input tokens removed by prompt compaction.", ("route", "agent"))
+LOCAL_EXTRACTIONS = registry.counter(
+    "medai_local_extractions_total", "Text documents by local lab parser outcome (local, remainder or llm).", ("route", "outcome"))
+LOCAL_RESULTS = registry.counter(
+    "medai_local_lab_results_total", "Lab results read by the local parser instead of the model.", ("route",))
+PERCEPTUAL_LOOKUPS = registry.counter(
+    "medai_perceptual_cache_lookups_total", "Prescription images looked up by perceptual hash, by outcome (hit, miss or rejected).", ("route", "outcome"))
+SYMPTOM_CACHE_LOOKUPS = registry.counter(
+    "medai_symptom_cache_lookups_total", "Symptom analyses looked up by normalized signature, by outcome (hit or miss).", ("route", "outcome"))
+DRUG_NORMALIZATIONS = registry.counter(
+    "medai_drug_normalizations_total", "Extracted medicine names by drug lexicon match (exact, prefix, fuzzy, suggestion or unmatched).", ("route", "method"))
+
+
+# --- Request scope ---
+
+class RequestTimings:
+    """Per-request stage totals, reported in the Server-Timing header."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self) -> str:
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+def start_request(route: str) -> RequestTimings:
+    """Resets the request-scoped labels (threads are reused across requests)."""
+    timings = RequestTimings()
+    _route.set(route)
+    _agent.set("none")
+    _strategy.set("none")
+    _timings.set(timings)
+    registry.ensure_flusher()
+    return timings
+
+
+def finish_request(route: str, method: str, status: int, seconds: float) -> None:
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_SECONDS.observe(seconds, route=route, method=method)
+
+
+def set_strategy(strategy: str) -> None:
+    """Labels later spans and LLM calls in this request (or batch item) with the loader strategy."""
+    _strategy.set(strategy)
+
+
+def record_document(strategy: str) -> None:
+    """Counts a loaded document and labels the rest of the current context with its strategy."""
+    set_strategy(strategy)
+    DOCUMENTS.inc(route=_route.get(), strategy=strategy)
+
+
+def observe_stage(stage: str, seconds: float, agent: Optional[str] = None) -> None:
+    agent = agent or _agent.get()
+    STAGE_SECONDS.observe(seconds, route=_route.get(), agent=agent, stage=stage, strategy=_strategy.get())
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(stage if agent == "none" else f"{agent}-{stage}", seconds)
+
+
+@contextmanager
+def span(stage: str, agent: Optional[str] = None) -> Iterator[None]:
+    """
+    Times the block as `stage`. LLM calls inside it are attributed to `agent`.
+
+    Must not enclose a `yield` of an async generator: each step of a stream
+    may run in a different context.
+    """
+    token = _agent.set(agent) if agent else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if token is not None:
+            _agent.reset(token)
+        observe_stage(stage, elapsed, agent)
+
+
+@contextmanager
+def agent_scope(agent: str) -> Iterator[None]:
+    """Attributes LLM calls started inside the block to `agent`, without timing a stage."""
+    token = _agent.set(agent)
+    try:
+        yield
+    finally:
+        _agent.reset(token)
+
+
+def llm_labels(model: str) -> Dict[str, str]:
+    """Labels for a Gemini call, captured when it starts (streams finish in another context)."""
+    return {"route": _route.get(), "agent": _agent.get(), "model": model, "strategy": _strategy.get()}
+
+
+def record_llm_call(labels: Dict[str, str], seconds: float, outcome: str, response: Any = None) -> None:
+    """Records one governed Gemini call and the token counts from its usage_metadata."""
+    LLM_CALLS.inc(route=labels["route"], agent=labels["agent"], model=labels["model"], outcome=outcome)
+    if outcome != "success":
+        return
+    LLM_SECONDS.observe(seconds, **labels)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for token_type, attribute in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                                  ("thinking", "thoughts_token_count"), ("cached", "cached_content_token_count"),
+                                  ("total", "total_token_count")):
+        count = getattr(usage, attribute, None)
+        if count:
+            LLM_TOKENS.inc(count, type=token_type, **labels)
+
+
+def record_prompt_compaction(agent: str, tokens: int, saved: int) -> None:
+    """Records the estimated size of a compacted prompt and the tokens compaction removed."""
+    PROMPT_TOKENS.inc(tokens, route=_route.get(), agent=agent)
+    if saved:
+        PROMPT_TOKENS_SAVED.inc(saved, route=_route.get(), agent=agent)
+
+
+def record_local_extraction(outcome: str, results: int) -> None:
+    """Records how a text document was extracted and how many lab results the local parser read."""
+    LOCAL_EXTRACTIONS.inc(route=_route.get(), outcome=outcome)
+    if results:
+        LOCAL_RESULTS.inc(results, route=_route.get())
+
+
+def record_perceptual_lookup(outcome: str) -> None:
+    PERCEPTUAL_LOOKUPS.inc(route=_route.get(), outcome=outcome)
+
+
+def record_drug_normalization(method: str) -> None:
+    DRUG_NORMALIZATIONS.inc(route=_route.get(), method=method)
+
+
+def record_symptom_cache(outcome: str) -> None:
+    SYMPTOM_CACHE_LOOKUPS.inc(route=_route.get(), outcome=outcome)
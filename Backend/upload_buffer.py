@@ -0,0 +1,156 @@
+import os
+import io
+import hashlib
+import zipfile
+import tempfile
+from typing import BinaryIO, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+# Uploads above MAX_UPLOAD_BYTES are rejected while streaming; buffers stay in
+# memory up to UPLOAD_SPOOL_BYTES and spill to a temp file beyond that.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 4 * 1024 * 1024))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", 100))
+
+CHUNK_SIZE = 64 * 1024
+
+
+def format_megabytes(num_bytes: int) -> str:
+    return f"{round(num_bytes / (1024 * 1024), 1):g} MB"
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload exceeds the configured size or page limits."""
+
+
+class UploadedFile:
+    """
+    A fully buffered upload: spooled in memory (spilling to disk above a
+    threshold), with its size and SHA-256 computed in the same pass.
+
+    Consumers call `open()` to get the buffer rewound to the start; they must
+    not close it. Call `close()` (or use as a context manager) when done.
+    """
+
+    def __init__(self, buffer: BinaryIO, filename: str, size: int, sha256: str):
+        self._buffer = buffer
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1].lower()
+
+    def open(self) -> BinaryIO:
+        self._buffer.seek(0)
+        return self._buffer
+
+    def getvalue(self) -> bytes:
+        return self.open().read()
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def __enter__(self) -> "UploadedFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, filename: str, max_bytes: Optional[int] = None,
+                    spool_threshold: Optional[int] = None, max_pages: Optional[int] = None) -> "UploadedFile":
+        """
+        Copies `stream` into a spooled buffer chunk by chunk, hashing as it goes.
+
+        Raises:
+            UploadRejected: if the stream exceeds `max_bytes` (checked per chunk,
+            so oversized uploads are never fully read) or a PDF exceeds `max_pages`.
+        """
+        max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+        spool_threshold = UPLOAD_SPOOL_BYTES if spool_threshold is None else spool_threshold
+        max_pages = MAX_PDF_PAGES if max_pages is None else max_pages
+
+        buffer = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"File exceeds the {format_megabytes(max_bytes)} upload limit.")
+                sha.update(chunk)
+                buffer.write(chunk)
+
+            upload = cls(buffer, filename, size, sha.hexdigest())
+            if upload.ext == ".pdf" and max_pages:
+                upload._check_pdf_pages(max_pages)
+            return upload
+        except Exception:
+            buffer.close()
+            raise
+
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: str) -> "UploadedFile":
+        return cls(io.BytesIO(data), filename, len(data), hashlib.sha256(data).hexdigest())
+
+    @classmethod
+    def from_path(cls, file_path: str, **limits) -> "UploadedFile":
+        with open(file_path, "rb") as f:
+            return cls.from_stream(f, os.path.basename(file_path), **limits)
+
+    def _check_pdf_pages(self, max_pages: int) -> None:
+        # Only the xref and page tree are parsed here; page content is untouched.
+        from pypdf import PdfReader
+
+        try:
+            page_count = len(PdfReader(self.open()).pages)
+        except Exception:
+            # Unreadable PDFs are reported by the loader with its usual message.
+            return
+        if page_count > max_pages:
+            raise UploadRejected(f"PDF has {page_count} pages; the limit is {max_pages}.")
+
+
+def expand_zip(upload: UploadedFile, max_files: int, max_bytes: Optional[int] = None) -> List[Tuple[str, Optional[UploadedFile], Optional[str]]]:
+    """
+    Buffers every file inside a zip upload as its own UploadedFile.
+
+    Returns (filename, upload, error) per member. Members that break the size
+    or page limits get an error instead of an upload. Declared sizes are
+    checked before decompressing, and actual bytes are checked while
+    streaming, so zip bombs never reach memory.
+
+    Raises:
+        UploadRejected: if the archive is unreadable or holds more than `max_files` files.
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    try:
+        archive = zipfile.ZipFile(upload.open())
+    except zipfile.BadZipFile as e:
+        raise UploadRejected(f"Invalid zip archive: {e}")
+
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+    ]
+    if len(members) > max_files:
+        raise UploadRejected(f"Zip archive holds {len(members)} files; the limit is {max_files}.")
+
+    entries: List[Tuple[str, Optional[UploadedFile], Optional[str]]] = []
+    for info in members:
+        name = os.path.basename(info.filename)
+        if info.file_size > max_bytes:
+            entries.append((name, None, f"File exceeds the {format_megabytes(max_bytes)} upload limit."))
+            continue
+        try:
+            with archive.open(info) as member:
+                entries.append((name, UploadedFile.from_stream(member, name, max_bytes=max_bytes), None))
+        except UploadRejected as e:
+            entries.append((name, None, str(e)))
+        except Exception as e:
+            # Corrupt or encrypted members fail on their own; the rest of the archive is still used.
+            entries.append((name, None, f"Could not read '{name}' from the zip archive: {e}"))
+    return entries
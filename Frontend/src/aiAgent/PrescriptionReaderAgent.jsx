@@ -10,6 +10,17 @@ const ACCENT_BUTTON_STYLE = {
     boxShadow: "0 4px 15px rgba(21, 179, 161, 0.4)",
 };
 
+// Anonymous per-browser id: lets the backend reuse the analysis of a retaken photo
+// of the same prescription, without sharing results between browsers
+const getClientId = () => {
+    let clientId = localStorage.getItem("prescription_client_id");
+    if (!clientId) {
+        clientId = crypto.randomUUID();
+        localStorage.setItem("prescription_client_id", clientId);
+    }
+    return clientId;
+};
+
 // --- Sidebar report item (ReportHistoryItem) ---
 const ReportHistoryItem = ({ report, currentReport, onClick, onDelete }) => (
   <div
@@ -158,6 +169,7 @@ export default function AIAgentPrescriptionChat() {
         try {
             const formData = new FormData();
             formData.append("file", file);
+            formData.append("user_id", getClientId());
 
             const response = await fetch(BACKEND_URL, {
                 method: "POST",